@@ -17,6 +17,16 @@ import json                                     # For parsing of the patient jso
 import time                                     # To improve animation effect of the loader ;-)
 import base64                                   # To transfer pictures to embeddable format
 import pandas as pd                             # To work with the data
+from visualization.models.data_utils import load_cohort_data, get_dataset_version    # To load the raw data with the compact schema
+from visualization.models.neighbour_utils import get_neighbour_index                 # To find similar patients
+from visualization.models.ehr_feed import get_ehr_feed                               # To receive and score patients from the EHR
+
+# Copy-on-write makes filtered views of the shared data cheap and keeps changes to them from leaking back
+pd.set_option("mode.copy_on_write", True)
+
+# Files of the background data
+data_path = 'data/02_processed_data/complete_case_machine_learning_data.csv'
+raw_data_path = 'data/02_processed_data/complete_case_data.csv'
 
 #####################################################################################
 ### Functions that a reused in this file                                          ###
@@ -27,16 +37,18 @@ def get_image_as_base64(image_path):
     with open(image_path, "rb") as img_file:
         return base64.b64encode(img_file.read()).decode()
     
-# Load data and store in cache
-@st.cache_data
+# Load data once and share it read-only between all sessions (it must never be changed in place)
+@st.cache_resource
 def load_data():
     try:
-        data = pd.read_csv('data/02_processed_data/complete_case_machine_learning_data.csv')
-        raw_data = pd.read_csv('data/02_processed_data/complete_case_data.csv')
-        return data, raw_data
+        data = pd.read_csv(data_path)
+        raw_data, memory_report = load_cohort_data(raw_data_path)
+        print("Memory usage of the raw data before and after applying the schema:")
+        print(memory_report.to_string())
+        return data, raw_data, get_dataset_version([data_path, raw_data_path])
     except FileNotFoundError:
         st.error("Error loading dataset. Please check the file path.")
-        return pd.DataFrame(), pd.DataFrame()
+        return pd.DataFrame(), pd.DataFrame(), None
     
 
 #####################################################################################    
@@ -79,9 +91,17 @@ if not st.session_state.lottie:
 
     print("Loading data")
     # Load the dataset and store it in session state
-    df, raw_df = load_data()
+    df, raw_df, dataset_version = load_data()
     st.session_state['df'] = df
     st.session_state['raw_df'] = raw_df
+    st.session_state['dataset_version'] = dataset_version
+
+    # Warm up the similar patients index (loaded from disk or built once per dataset version)
+    if not df.empty:
+        get_neighbour_index(df, dataset_version)
+
+    # Start the EHR feed (once for all sessions), new patients are scored in the background
+    st.session_state['ehr_feed'] = get_ehr_feed()
 
     # Continue with lottie for the effect    
     time.sleep(3)
@@ -189,13 +209,14 @@ st.logo(
 # Define pages
 patient_data_page = st.Page("visualization/Subpages/1_Patient_Data.py", title="Patient Data", icon=":material/personal_injury:", default=True)
 risk_assessment_page = st.Page("visualization/Subpages/2_Risk_Calculation.py", title="Risk Calculation", icon=":material/recent_patient:")
+risk_worklist_page = st.Page("visualization/Subpages/7_Risk_Worklist.py", title="Risk Worklist", icon=":material/format_list_numbered:")
 descriptive_analytics_page = st.Page("visualization/Subpages/3_Descriptive_Analytics.py", title="Descriptive Analytics", icon=":material/monitor_heart:")
 diagnostic_analytics_page = st.Page("visualization/Subpages/4_Diagnostic_Analytics.py", title="Diagnostic Analytics", icon=":material/quick_reference_all:")
 about_page = st.Page("visualization/Subpages/5_About.py", title="About", icon=":material/help:")
 technical_information_page = st.Page("visualization/Subpages/6_Technical_Information.py", title="Technical Information", icon=":material/manufacturing:")
 pg = st.navigation(
     {
-        "Patient": [patient_data_page, risk_assessment_page],
+        "Patient": [patient_data_page, risk_assessment_page, risk_worklist_page],
         "Department Insights": [descriptive_analytics_page, diagnostic_analytics_page],
         "Others": [technical_information_page, about_page],
     }
@@ -0,0 +1,364 @@
+#####################################################################################
+# build_pipeline.py                                                                 #
+#                                                                                   #
+# This is the scripted build of the processed data and the ML model files           #
+#                                                                                   #
+# - Stages: parse, clean, encode, train, export (notebooks 01 to 04 as a script)    #
+# - Cache the outputs of each stage by the content hash of its inputs and code      #
+# - Only stages downstream of a change are executed again                           #
+#                                                                                   #
+# Usage (from the repository root): python -m data.build_pipeline [--force]         #
+#####################################################################################
+
+# Import needed libraries
+import os
+import sys
+import json
+import shutil
+import hashlib
+import inspect
+import pickle
+import numpy as np
+import pandas as pd
+from data import raw_data_parser
+
+# Folders used by the pipeline
+data_dir = raw_data_parser.data_dir
+repo_dir = os.path.dirname(data_dir)
+raw_dir = raw_data_parser.output_dir
+processed_dir = os.path.join(data_dir, '02_processed_data')
+build_dir = os.path.join(data_dir, '03_model_build')
+cache_dir = os.path.join(data_dir, '.pipeline_cache')
+models_dir = os.path.join(repo_dir, 'visualization', 'models')
+
+# Seed used for the train-test split and the model training (see 04_heart_disease_predictive_analysis.ipynb)
+random_seed = 12
+
+# Features used for the encoding (see 03_exploratory_data_analysis.ipynb)
+binary_features = ['high_fasting_blood_sugar', 'exercise_induced_angina', 'family_history_cad']
+categorical_features = ['gender', 'chest_pain_type', 'resting_ecg_results']
+numerical_features = ['age', 'serum_cholesterol', 'max_heart_rate', 'st_depression',
+                      'has_hypertension', 'cigarettes_per_day', 'years_smoking', 'resting_heart_rate']
+
+# Shortened column names of the one-hot encoded features in the machine learning data
+shortened_columns = {
+    'chest_pain_type_Asymptomatic': 'cp_Asymptomatic',
+    'chest_pain_type_Atypical Angina': 'cp_Atypical_Angina',
+    'chest_pain_type_Non-Anginal Pain': 'cp_Non_Anginal_Pain',
+    'chest_pain_type_Typical Angina': 'cp_Typical_Angina',
+    'resting_ecg_results_Left Ventricular Hypertrophy': 'ecg_LVH',
+    'resting_ecg_results_Normal': 'ecg_Normal',
+    'resting_ecg_results_ST-T Wave Abnormality': 'ecg_ST_Abnormality',
+    'gender_Female': 'gender_F',
+    'gender_Male': 'gender_M'
+}
+
+# Hyperparameter grid of the neural network (the exported model)
+nn_param_grid = {
+    'epochs': [10, 20],
+    'batch_size': [32, 64],
+    'optimizer': ['adam', 'rmsprop'],
+}
+
+
+#####################################################################################
+### Stage functions                                                               ###
+#####################################################################################
+
+# Stage 1: Parse the raw .data files into csv files
+def run_parse(inputs, outputs):
+    raw_data_parser.parse_all(output_dir=raw_dir)
+
+# Stage 2: Select the features, handle missing values and save the complete case data (notebook 02)
+def run_clean(inputs, outputs):
+    selected_raw_data_df = pd.read_csv(inputs['selected_raw_data'])
+
+    # Select the features chosen by the expert opinion
+    selected_df = selected_raw_data_df[["age", "sex", "cp", "chol", "fbs", "restecg", "thalach", "exang", "oldpeak", "slope", "ca", "painloc", "htn",
+                                        "cigs", "years", "famhist", "thalrest", "num"]]
+
+    # Replace -9 with NaN and convert the categorical features
+    selected_df = selected_df.replace(-9, np.nan)
+    for col in ['sex', 'cp', 'fbs', 'restecg', 'exang', 'slope', 'ca', 'painloc', 'htn', 'famhist']:
+        selected_df[col] = selected_df[col].astype("category")
+
+    # Rename columns based on the provided documentation
+    selected_df = selected_df.rename(columns={
+        'sex': 'gender',
+        'cp': 'chest_pain_type',
+        'chol': 'serum_cholesterol',
+        'fbs': 'high_fasting_blood_sugar',
+        'restecg': 'resting_ecg_results',
+        'thalach': 'max_heart_rate',
+        'exang': 'exercise_induced_angina',
+        'oldpeak': 'st_depression',
+        'slope': 'st_slope',
+        'ca': 'num_major_vessels',
+        'painloc': 'chest_pain_location',
+        'htn': 'has_hypertension',
+        'cigs': 'cigarettes_per_day',
+        'years': 'years_smoking',
+        'famhist': 'family_history_cad',
+        'thalrest': 'resting_heart_rate',
+        'num': 'heart_disease_diagnosis'
+    })
+
+    # Convert heart disease severity into a binary classification
+    selected_df['heart_disease_diagnosis'] = selected_df['heart_disease_diagnosis'] > 0
+
+    # Strategy 1: Drop the features with too many missing values and afterwards all rows with missing values
+    complete_case_df = selected_df.drop(columns=['num_major_vessels', 'chest_pain_location', 'st_slope']).dropna()
+
+    # Change the numeric values to the actual categories
+    complete_case_df['gender'] = complete_case_df['gender'].astype(int).replace({1: 'Male', 0: 'Female'})
+    complete_case_df['chest_pain_type'] = complete_case_df['chest_pain_type'].astype(int).replace({
+        1: 'Typical Angina',
+        2: 'Atypical Angina',
+        3: 'Non-Anginal Pain',
+        4: 'Asymptomatic'
+    })
+    complete_case_df['resting_ecg_results'] = complete_case_df['resting_ecg_results'].astype(int).replace({
+        0: 'Normal',
+        1: 'ST-T Wave Abnormality',
+        2: 'Left Ventricular Hypertrophy'
+    })
+    for col in ['high_fasting_blood_sugar', 'exercise_induced_angina', 'family_history_cad']:
+        complete_case_df[col] = complete_case_df[col].astype(bool)
+
+    complete_case_df.to_csv(outputs['complete_case_data'], index=False)
+    selected_df.to_csv(outputs['machine_learning_data'], index=False)
+
+# Stage 3: Fit the standardizer and save the encoded machine learning data (notebook 03)
+def run_encode(inputs, outputs):
+    from sklearn.compose import ColumnTransformer
+    from sklearn.preprocessing import StandardScaler, OneHotEncoder
+
+    data = pd.read_csv(inputs['complete_case_data'])
+
+    # Apply one-hot encoding only to non-binary categorical features
+    preprocessor = ColumnTransformer(
+        transformers=[
+            ('num', StandardScaler(), numerical_features),
+            ('cat', OneHotEncoder(), categorical_features),
+            ('bin', 'passthrough', binary_features)
+        ])
+    data_preprocessed = preprocessor.fit_transform(data)
+
+    # Column names as used by the app and the trained models so far
+    encoded_columns = preprocessor.named_transformers_['cat'].get_feature_names_out(categorical_features)
+    all_columns = numerical_features + binary_features + list(encoded_columns)
+    data_preprocessed_df = pd.DataFrame(data_preprocessed, columns=all_columns).rename(columns=shortened_columns)
+    data_preprocessed_df['Has_heart_disease'] = data['heart_disease_diagnosis']
+
+    data_preprocessed_df.to_csv(outputs['machine_learning_data'], index=False)
+    with open(outputs['standardizer'], "wb") as file:
+        pickle.dump(preprocessor, file)
+
+# Create the neural network used for the risk prediction
+def create_nn_model(input_dim, optimizer='adam'):
+    from tensorflow.keras.models import Sequential
+    from tensorflow.keras.layers import Dense, Dropout
+    from tensorflow.keras import Input
+
+    model = Sequential()
+    model.add(Input(shape=(input_dim,)))
+    model.add(Dense(128, activation='relu'))
+    model.add(Dropout(0.3))
+    model.add(Dense(64, activation='relu'))
+    model.add(Dropout(0.2))
+    model.add(Dense(32, activation='relu'))
+    model.add(Dropout(0.2))
+    model.add(Dense(1, activation='sigmoid'))
+    model.compile(loss='binary_crossentropy', optimizer=optimizer, metrics=['Recall'])
+    return model
+
+# Stage 4: Tune and train the neural network with the hyperparameter search (notebook 04)
+def run_train(inputs, outputs):
+    import tensorflow as tf
+    from scikeras.wrappers import KerasClassifier
+    from sklearn.model_selection import train_test_split, GridSearchCV, StratifiedKFold
+    from sklearn.metrics import accuracy_score, precision_score, recall_score, f1_score, roc_auc_score
+
+    np.random.seed(random_seed)
+    tf.random.set_seed(random_seed)
+
+    df = pd.read_csv(inputs['machine_learning_data'])
+    df['Has_heart_disease'] = df['Has_heart_disease'].astype(int)
+    data_X = df.drop(["Has_heart_disease"], axis=1).values
+    data_y = df["Has_heart_disease"].values
+
+    X_train, X_test, y_train, y_test = train_test_split(data_X, data_y, test_size=0.3, stratify=data_y, random_state=random_seed)
+
+    grid_search = GridSearchCV(
+        estimator=KerasClassifier(model=create_nn_model, input_dim=X_train.shape[1], verbose=0),
+        param_grid=nn_param_grid,
+        cv=StratifiedKFold(n_splits=5, shuffle=True, random_state=random_seed),
+        scoring={'recall': 'recall', 'precision': 'precision', 'roc_auc': 'roc_auc', 'f1': 'f1', 'accuracy': 'accuracy'},
+        refit='roc_auc'
+    )
+    grid_search.fit(X_train, y_train)
+
+    # Evaluate the best model on the test data
+    best_model = grid_search.best_estimator_
+    y_pred = best_model.predict(X_test)
+    metrics = {
+        'best_params': grid_search.best_params_,
+        'accuracy': accuracy_score(y_test, y_pred),
+        'precision': precision_score(y_test, y_pred),
+        'recall': recall_score(y_test, y_pred),
+        'f1': f1_score(y_test, y_pred),
+        'auc': roc_auc_score(y_test, y_pred),
+    }
+    print(f"Neural Network metrics: {metrics}")
+
+    best_model.model_.save(outputs['model'])
+    with open(outputs['metrics'], "w") as file:
+        json.dump(metrics, file, indent=2)
+
+# Stage 5: Copy the trained model and the standardizer to the app
+def run_export(inputs, outputs):
+    shutil.copyfile(inputs['standardizer'], outputs['standardizer'])
+    shutil.copyfile(inputs['model'], outputs['model'])
+
+
+#####################################################################################
+### Stage definitions                                                             ###
+#####################################################################################
+
+# Each stage declares its input and output files, the code and the parameters it depends on
+stages = [
+    {
+        'name': 'parse',
+        'run': run_parse,
+        'inputs': raw_data_parser.file_paths,
+        'outputs': {name: os.path.join(raw_dir, f'{name}_data.csv') for name in raw_data_parser.file_paths}
+                   | {'selected_raw_data': os.path.join(raw_dir, 'selected_raw_data.csv')},
+        'code': [run_parse, raw_data_parser],
+        'params': {},
+    },
+    {
+        'name': 'clean',
+        'run': run_clean,
+        'inputs': {'selected_raw_data': os.path.join(raw_dir, 'selected_raw_data.csv')},
+        'outputs': {
+            'complete_case_data': os.path.join(processed_dir, 'complete_case_data.csv'),
+            'machine_learning_data': os.path.join(processed_dir, 'machine_learning_data.csv'),
+        },
+        'code': [run_clean],
+        'params': {},
+    },
+    {
+        'name': 'encode',
+        'run': run_encode,
+        'inputs': {'complete_case_data': os.path.join(processed_dir, 'complete_case_data.csv')},
+        'outputs': {
+            'machine_learning_data': os.path.join(processed_dir, 'complete_case_machine_learning_data.csv'),
+            'standardizer': os.path.join(build_dir, 'standardizer.pkl'),
+        },
+        'code': [run_encode],
+        'params': {
+            'binary_features': binary_features,
+            'categorical_features': categorical_features,
+            'numerical_features': numerical_features,
+            'shortened_columns': shortened_columns,
+        },
+    },
+    {
+        'name': 'train',
+        'run': run_train,
+        'inputs': {'machine_learning_data': os.path.join(processed_dir, 'complete_case_machine_learning_data.csv')},
+        'outputs': {
+            'model': os.path.join(build_dir, 'risk_prediction_model.h5'),
+            'metrics': os.path.join(build_dir, 'metrics.json'),
+        },
+        'code': [run_train, create_nn_model],
+        'params': {'random_seed': random_seed, 'nn_param_grid': nn_param_grid},
+    },
+    {
+        'name': 'export',
+        'run': run_export,
+        'inputs': {
+            'standardizer': os.path.join(build_dir, 'standardizer.pkl'),
+            'model': os.path.join(build_dir, 'risk_prediction_model.h5'),
+        },
+        'outputs': {
+            'standardizer': os.path.join(models_dir, 'standardizer.pkl'),
+            'model': os.path.join(models_dir, 'risk_prediction_model.h5'),
+        },
+        'code': [run_export],
+        'params': {},
+    },
+]
+
+
+#####################################################################################
+### Content hashing and caching                                                   ###
+#####################################################################################
+
+# Hash the content of a file in blocks
+def hash_file(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for block in iter(lambda: file.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+# Hash the inputs, the source code and the parameters of a stage
+def hash_stage(stage):
+    digest = hashlib.sha256()
+    for name, path in sorted(stage['inputs'].items()):
+        digest.update(f"input:{name}:{hash_file(path)}".encode())
+    for code in stage['code']:
+        digest.update(inspect.getsource(code).encode())
+    digest.update(json.dumps(stage['params'], sort_keys=True).encode())
+    return digest.hexdigest()
+
+# Check if all outputs of a stage exist and match the cached files
+def outputs_match(stage, cache_path):
+    for name, path in stage['outputs'].items():
+        cached_file = os.path.join(cache_path, name)
+        if not os.path.exists(path) or hash_file(path) != hash_file(cached_file):
+            return False
+    return True
+
+# Run a single stage or restore its outputs from the cache, returns True if the stage was executed
+def run_stage(stage, force=False):
+    key = hash_stage(stage)
+    cache_path = os.path.join(cache_dir, stage['name'], key)
+    cached = os.path.exists(os.path.join(cache_path, 'manifest.json'))
+
+    for path in stage['outputs'].values():
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    if cached and not force:
+        # Restore the cached outputs if the files in place are missing or different
+        if not outputs_match(stage, cache_path):
+            for name, path in stage['outputs'].items():
+                shutil.copyfile(os.path.join(cache_path, name), path)
+        print(f"[{stage['name']}] up to date ({key[:12]})")
+        return False
+
+    print(f"[{stage['name']}] running ({key[:12]})")
+    stage['run'](stage['inputs'], stage['outputs'])
+
+    # Store the outputs in the cache, the manifest is written last so incomplete entries are never used
+    os.makedirs(cache_path, exist_ok=True)
+    for name, path in stage['outputs'].items():
+        shutil.copyfile(path, os.path.join(cache_path, name))
+    with open(os.path.join(cache_path, 'manifest.json'), 'w') as file:
+        json.dump({name: hash_file(path) for name, path in stage['outputs'].items()}, file, indent=2)
+    return True
+
+# Run all stages in order, the hashes of downstream stages change only if the upstream outputs change
+def run_pipeline(stages=stages, force=False, until=None):
+    executed = []
+    for stage in stages:
+        if run_stage(stage, force=force):
+            executed.append(stage['name'])
+        if stage['name'] == until:
+            break
+    return executed
+
+
+if __name__ == '__main__':
+    run_pipeline(force='--force' in sys.argv)
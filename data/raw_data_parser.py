@@ -0,0 +1,161 @@
+#####################################################################################
+# raw_data_parser.py                                                                #
+#                                                                                   #
+# This is the parser for the raw UCI heart disease files (76 attributes format)     #
+#                                                                                   #
+# - Stream the .data files in chunks and split them into patient records           #
+# - Drop corrupted records (e.g. the broken end of cleveland.data)                  #
+# - Parse all four locations in parallel and save them as csv files                 #
+#                                                                                   #
+# Usage (from the repository root): python -m data.raw_data_parser                  #
+#####################################################################################
+
+# Import needed libraries
+import os
+import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+
+# Folder of this file, all paths are relative to it so the parser can be started from anywhere
+data_dir = os.path.dirname(os.path.abspath(__file__))
+
+# Paths of the raw files per location
+file_paths = {
+    'cleveland': os.path.join(data_dir, '00_heart+disease', 'cleveland.data'),
+    'hungarian': os.path.join(data_dir, '00_heart+disease', 'hungarian.data'),
+    'switzerland': os.path.join(data_dir, '00_heart+disease', 'switzerland.data'),
+    'long-beach-va': os.path.join(data_dir, '00_heart+disease', 'long-beach-va.data'),
+}
+
+# Output folder for the parsed csv files
+output_dir = os.path.join(data_dir, '01_raw_data')
+
+# Locations that are combined into the selected_raw_data.csv (see 01_data_initialization.ipynb)
+selected_locations = {
+    'cleveland': 'Cleveland',
+    'long-beach-va': 'Long Beach VA',
+}
+
+# List of column names as headers from the delivered names file.
+headers = [
+    'id', 'ccf', 'age', 'sex', 'painloc', 'painexer', 'relrest', 'pncaden',
+    'cp', 'trestbps', 'htn', 'chol', 'smoke', 'cigs', 'years', 'fbs', 'dm',
+    'famhist', 'restecg', 'ekgmo', 'ekgday', 'ekgyr', 'dig', 'prop', 'nitr',
+    'pro', 'diuretic', 'proto', 'thaldur', 'thaltime', 'met', 'thalach',
+    'thalrest', 'tpeakbps', 'tpeakbpd', 'dummy', 'trestbpd', 'exang', 'xhypo',
+    'oldpeak', 'slope', 'rldv5', 'rldv5e', 'ca', 'restckm', 'exerckm', 'restef',
+    'restwm', 'exeref', 'exerwm', 'thal', 'thalsev', 'thalpul', 'earlobe',
+    'cmo', 'cday', 'cyr', 'num', 'lmt', 'ladprox', 'laddist', 'diag', 'cxmain',
+    'ramus', 'om1', 'om2', 'rcaprox', 'rcadist', 'lvx1', 'lvx2', 'lvx3', 'lvx4',
+    'lvf', 'cathef', 'junk', 'name'
+]
+
+# "name" is always the last token of a patient record
+end_token = 'name'
+record_length = len(headers)
+
+# Size of the chunks that are read from the file at once
+chunk_size = 1 << 20
+
+
+#####################################################################################
+### Tokenize and split the records                                                ###
+#####################################################################################
+
+# Read the file in chunks and yield the whitespace separated tokens as numpy arrays
+def stream_tokens(file_path, chunk_size=chunk_size):
+    rest = ''
+    with open(file_path, 'r', encoding='utf-8', errors='ignore') as file:
+        while True:
+            chunk = file.read(chunk_size)
+            if not chunk:
+                break
+            text = rest + chunk
+            # The last token may be cut by the chunk border, keep it for the next chunk
+            cut = max(text.rfind(' '), text.rfind('\n'))
+            rest = text[cut + 1:]
+            yield np.array(text[:cut + 1].split(), dtype=str)
+    if rest.split():
+        yield np.array(rest.split(), dtype=str)
+
+# Split a token array into complete records, returns the records and the tokens after the last "name"
+def split_records(tokens):
+    end_positions = np.flatnonzero(tokens == end_token)
+    if len(end_positions) == 0:
+        return np.empty((0, record_length), dtype=tokens.dtype), 0, tokens
+
+    starts = np.concatenate(([0], end_positions[:-1] + 1))
+    lengths = end_positions - starts + 1
+
+    # Records with a wrong number of tokens are corrupted, the parser re-syncs at the next "name"
+    complete = lengths == record_length
+    records = tokens[starts[complete, None] + np.arange(record_length)]
+
+    return records, int((~complete).sum()), tokens[end_positions[-1] + 1:]
+
+# Check all values of the records at once, a record is corrupted if any value is not a number
+def find_valid_records(records):
+    values = pd.DataFrame(records[:, :-1]).apply(pd.to_numeric, errors='coerce')
+    return values.notna().all(axis=1).to_numpy()
+
+# Parse a raw .data file into a DataFrame with one row per patient
+def parse_file(file_path):
+    parsed = []
+    corrupted = 0
+    rest = np.array([], dtype=str)
+
+    for tokens in stream_tokens(file_path):
+        records, wrong_length, rest = split_records(np.concatenate((rest, tokens)))
+        valid = find_valid_records(records)
+        parsed.append(records[valid])
+        corrupted += wrong_length + int((~valid).sum())
+
+    # Tokens after the last "name" do not form a complete record
+    if len(rest):
+        corrupted += 1
+
+    records = np.concatenate(parsed) if parsed else np.empty((0, record_length), dtype=str)
+    return pd.DataFrame(records, columns=headers), corrupted
+
+
+#####################################################################################
+### Parse all locations and save the results                                      ###
+#####################################################################################
+
+# Parse one location and save it as csv file, runs in a separate process
+def process_location(name, file_path, output_dir=output_dir):
+    df, corrupted = parse_file(file_path)
+    output_file_path = os.path.join(output_dir, f'{name}_data.csv')
+    df.to_csv(output_file_path, index=False)
+    return name, output_file_path, len(df), corrupted
+
+# Combine the selected locations into a single csv file
+def combine_selected_locations(output_dir=output_dir, locations=selected_locations):
+    frames = []
+    for name, dataset in locations.items():
+        df = pd.read_csv(os.path.join(output_dir, f'{name}_data.csv'))
+        df.insert(0, 'Dataset', dataset)
+        frames.append(df)
+
+    output_file_path = os.path.join(output_dir, 'selected_raw_data.csv')
+    pd.concat(frames, ignore_index=True).to_csv(output_file_path, index=False)
+    return output_file_path
+
+# Parse all locations in parallel and regenerate the csv files in 01_raw_data
+def parse_all(file_paths=file_paths, output_dir=output_dir, max_workers=None):
+    os.makedirs(output_dir, exist_ok=True)
+
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(process_location, name, path, output_dir) for name, path in file_paths.items()]
+        results = [future.result() for future in futures]
+
+    for name, output_file_path, rows, corrupted in results:
+        print(f"Data saved to {output_file_path} ({rows} records, {corrupted} corrupted records skipped)")
+
+    combined_path = combine_selected_locations(output_dir)
+    print(f"Selected locations combined into {combined_path}")
+    return results
+
+
+if __name__ == '__main__':
+    parse_all()
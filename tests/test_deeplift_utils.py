@@ -0,0 +1,76 @@
+# Tests of the NumPy DeepLIFT backend against shap.DeepExplainer (visualization/models/deeplift_utils.py)
+
+# Import needed libraries
+import os
+import numpy as np
+import pytest
+import tensorflow as tf
+import shap
+import pandas as pd
+from visualization.models.deeplift_utils import get_dense_layers, predict_network, deeplift_shap_values
+
+# Repository root, the test uses the shipped risk model and data
+repo_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Maximum difference to the SHAP values of the DeepExplainer
+tolerance = 1e-5
+
+
+# Small Dense ReLU/sigmoid network with fixed weights, like the risk model
+@pytest.fixture(scope='module')
+def network():
+    tf.keras.utils.set_random_seed(7)
+    model = tf.keras.Sequential([
+        tf.keras.Input(shape=(6,)),
+        tf.keras.layers.Dense(8, activation='relu'),
+        tf.keras.layers.Dropout(0.2),
+        tf.keras.layers.Dense(4, activation='relu'),
+        tf.keras.layers.Dense(1, activation='sigmoid'),
+    ])
+    rng = np.random.default_rng(7)
+    background = rng.normal(size=(20, 6)).astype(np.float32)
+    data = rng.normal(size=(5, 6)).astype(np.float32)
+    return model, background, data
+
+
+def test_dense_layers_are_read(network):
+    model, background, data = network
+    layers = get_dense_layers(model)
+
+    assert [activation for _, _, activation in layers] == ['relu', 'relu', 'sigmoid']
+    np.testing.assert_allclose(predict_network(layers, data), model.predict(data, verbose=0), atol=1e-6)
+
+def test_deeplift_matches_deep_explainer(network):
+    model, background, data = network
+    shap_values, expected_value = deeplift_shap_values(get_dense_layers(model), data, background)
+
+    explainer = shap.DeepExplainer(model, background)
+    reference = np.asarray(explainer.shap_values(data, check_additivity=False)).reshape(shap_values.shape)
+    np.testing.assert_allclose(shap_values, reference, atol=tolerance)
+    assert expected_value == pytest.approx(float(np.ravel(explainer.expected_value)[0]), abs=tolerance)
+
+def test_deeplift_matches_deep_explainer_on_the_risk_model():
+    model = tf.keras.models.load_model(os.path.join(repo_dir, 'visualization', 'models', 'risk_prediction_model.h5'))
+    df = pd.read_csv(os.path.join(repo_dir, 'data', '02_processed_data', 'complete_case_machine_learning_data.csv')).drop(columns=['Has_heart_disease'])
+    background = df.sample(20, random_state=22).to_numpy(dtype=np.float32)
+    data = df.head(5).to_numpy(dtype=np.float32)
+    shap_values, _ = deeplift_shap_values(get_dense_layers(model), data, background)
+
+    explainer = shap.DeepExplainer(model, background)
+    reference = np.asarray(explainer.shap_values(data, check_additivity=False)).reshape(shap_values.shape)
+    np.testing.assert_allclose(shap_values, reference, atol=tolerance)
+
+def test_deeplift_is_additive(network):
+    model, background, data = network
+    layers = get_dense_layers(model)
+    shap_values, expected_value = deeplift_shap_values(layers, data, background)
+
+    np.testing.assert_allclose(shap_values.sum(axis=1) + expected_value, np.ravel(predict_network(layers, data)), atol=1e-10)
+
+def test_other_layers_are_not_supported():
+    model = tf.keras.Sequential([
+        tf.keras.Input(shape=(6,)),
+        tf.keras.layers.Dense(4, activation='tanh'),
+        tf.keras.layers.Dense(1, activation='sigmoid'),
+    ])
+    assert get_dense_layers(model) is None
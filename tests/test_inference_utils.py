@@ -0,0 +1,56 @@
+# Tests of the risk scale of the predictions (visualization/models/inference_utils.py)
+
+# Import needed libraries
+import os
+import json
+import numpy as np
+import pandas as pd
+import pytest
+from sklearn.linear_model import LogisticRegression
+from sklearn.svm import SVC
+from visualization.models.inference_utils import predict
+from visualization.models.model_utils import load_preprocessor, score_patients
+
+# Repository root, the tests use the shipped standardizer, data and simulated patients
+repo_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+# Processed training data and target of the risk model
+@pytest.fixture(scope='module')
+def training_data():
+    df = pd.read_csv(os.path.join(repo_dir, 'data', '02_processed_data', 'complete_case_machine_learning_data.csv'))
+    return df.drop(columns=['Has_heart_disease']).to_numpy(dtype=np.float32), df['Has_heart_disease'].to_numpy()
+
+# The simulated patients, scored like the worklist and the EHR feed do
+@pytest.fixture(scope='module')
+def patient_records():
+    folder = os.path.join(repo_dir, 'Patient_Simulation_Data')
+    records = []
+    for file_name in sorted(os.listdir(folder)):
+        with open(os.path.join(folder, file_name)) as file:
+            records.append(json.load(file))
+    return records
+
+
+def test_logistic_regression_is_scored_with_probabilities(training_data, patient_records):
+    X, y = training_data
+    model = LogisticRegression(max_iter=1000).fit(X, y)
+    preprocessor = load_preprocessor(os.path.join(repo_dir, 'visualization', 'models', 'standardizer.pkl'))
+    probabilities = score_patients(preprocessor, model, patient_records)
+
+    complete = ~np.isnan(probabilities)
+    assert complete.any()
+    assert np.all((probabilities[complete] > 0) & (probabilities[complete] < 1))
+    # Not the labels of model.predict
+    assert not np.all(np.isin(probabilities[complete], [0, 1]))
+
+    np.testing.assert_allclose(predict(model, X[:5]), model.predict_proba(X[:5])[:, 1])
+
+def test_svc_without_probabilities_is_scored_between_0_and_1(training_data):
+    X, y = training_data
+    model = SVC().fit(X, y)
+    scores = predict(model, X[:20])
+
+    assert np.all((scores > 0) & (scores < 1))
+    # Same order as the decision function, the threshold 0.5 matches the predicted label
+    np.testing.assert_array_equal(scores > 0.5, model.predict(X[:20]) == 1)
@@ -0,0 +1,70 @@
+# Tests of the streaming parser for the raw UCI heart disease files (data/raw_data_parser.py)
+
+# Import needed libraries
+import io
+import os
+import numpy as np
+import pandas as pd
+from data.raw_data_parser import stream_tokens, split_records, parse_file, file_paths, output_dir, record_length, end_token
+
+
+# Tokens of a record with the given id, all values are numbers and the last token is "name"
+def make_record(patient_id, length=record_length):
+    return [str(patient_id)] + [str(value) for value in range(1, length - 1)] + [end_token]
+
+
+def test_split_records_resyncs_after_corrupt_record():
+    tokens = np.array(make_record(1) + make_record(2, length=record_length - 5) + make_record(3), dtype=str)
+    records, corrupted, rest = split_records(tokens)
+
+    assert records[:, 0].tolist() == ['1', '3']
+    assert corrupted == 1
+    assert len(rest) == 0
+
+def test_split_records_drops_short_and_long_records():
+    tokens = np.array(make_record(1, length=3) + make_record(2) + make_record(3, length=record_length + 1), dtype=str)
+    records, corrupted, _ = split_records(tokens)
+
+    assert records[:, 0].tolist() == ['2']
+    assert corrupted == 2
+
+def test_split_records_keeps_tokens_after_the_last_record():
+    tokens = np.array(make_record(1) + ['4', '5'], dtype=str)
+    records, corrupted, rest = split_records(tokens)
+
+    assert len(records) == 1
+    assert corrupted == 0
+    assert rest.tolist() == ['4', '5']
+
+def test_stream_tokens_across_chunk_borders(tmp_path):
+    text = " ".join(make_record(1001)) + "\n" + " ".join(make_record(1002)) + "\n"
+    file_path = tmp_path / 'records.data'
+    file_path.write_text(text)
+
+    # Every chunk size cuts some token in two, the tokens must still be complete
+    for chunk_size in (1, 2, 3, 7, 64):
+        tokens = np.concatenate(list(stream_tokens(file_path, chunk_size=chunk_size)))
+        assert tokens.tolist() == text.split()
+
+    records, corrupted, rest = split_records(np.concatenate(list(stream_tokens(file_path, chunk_size=5))))
+    assert records[:, 0].tolist() == ['1001', '1002']
+    assert corrupted == 0
+    assert len(rest) == 0
+
+def test_parse_file_drops_records_with_invalid_values(tmp_path):
+    broken = make_record(2)
+    broken[5] = 'x'
+    file_path = tmp_path / 'records.data'
+    file_path.write_text("\n".join(" ".join(record) for record in (make_record(1), broken, make_record(3))) + "\n4 5 6")
+
+    df, corrupted = parse_file(file_path)
+    assert df['id'].tolist() == ['1', '3']
+    assert corrupted == 2
+
+def test_parse_file_matches_the_committed_csv():
+    df, _ = parse_file(file_paths['switzerland'])
+
+    # Same round trip through csv as the saved files
+    parsed = pd.read_csv(io.StringIO(df.to_csv(index=False)))
+    committed = pd.read_csv(os.path.join(output_dir, 'switzerland_data.csv'))
+    pd.testing.assert_frame_equal(parsed, committed)
@@ -5,6 +5,7 @@
 #                                                                                   #
 # - Load Patient data                                                               #
 # - Display Patient Data                                                            #
+# - Rank the patient values within the cohort (percentiles)                         #
 #####################################################################################
 
 # Import needed libraries
@@ -14,8 +15,11 @@ import numpy as np
 import base64
 import json
 from datetime import datetime, timedelta
-import time
 import plotly.express as px
+from visualization.models.patient_utils import search_patients, load_patient, save_patient, patients_page_size
+from visualization.models.vitals_utils import vital_units, get_vitals_trend
+from visualization.models.percentile_utils import get_percentile_index, get_percentile, describe_stratum, format_percentile
+from visualization.models.ehr_feed import notification_bell_html
 
 #####################################################################################
 ### File preparation: Functions and Status checks                                 ###
@@ -108,9 +112,7 @@ with st.container():
         st.html(
             f"""
             <div class="doctor-profile" style="display: flex; align-items: center; justify-content: flex-end;">
-                <span class="notification-bell" title="Notifications" style="font-size: 15px; margin-right: 5px;">
-                    🔔
-                </span>
+                {notification_bell_html(st.session_state.get('ehr_feed'))}
                 <h4 style="margin: 0; font-size: 14px; margin-right: 10px;">{doctor_name}</h4>
                 <img src="data:image/png;base64,{doctor_image_base64}" alt="Doctor Picture" style="width: 35px; height: auto;">
             </div>
@@ -158,8 +160,9 @@ with st.expander("Simulate EHR Data Transfer", icon=":material/publish:"):
     with upload_col1:
         # File uploader in expander
         uploaded_file = st.file_uploader("Upload a JSON file for new patient data", type="json")
-        # Upload JSON area    
-        if uploaded_file:
+        # Upload JSON area, the file is only loaded and stored once and not again on every rerun
+        if uploaded_file and uploaded_file.file_id != st.session_state.get('uploaded_file_id'):
+            st.session_state['uploaded_file_id'] = uploaded_file.file_id
             with st.spinner("Loading patient data..."):
                 # Reset specific session state values when a new file is uploaded
                 st.session_state['risk_calculated'] = False
@@ -169,36 +172,64 @@ with st.expander("Simulate EHR Data Transfer", icon=":material/publish:"):
                 
                 # Load JSON content into session_state immediately
                 st.session_state['patient_data'] = json.load(uploaded_file)
-                time.sleep(1)  # Simulating processing delay if needed
+
+                # Keep the uploaded patient in the repository, so it can be found again
+                try:
+                    save_patient(st.session_state['patient_data'])
+                except ValueError as e:
+                    st.warning(f"The patient could not be stored: {e}")
                 st.success("Patient data loaded successfully!")
 
     with upload_col2:
-        # Dropdown for predefined patients
-        selected_patient = st.selectbox(
-            "Or choose a predefined patient from the list to simulate EHR data transfer.",
-            ("Patient_1", "Patient_2", "Patient_3"),  # Add empty option for default
+        # Search the patient repository, only one page of ids and names is read per rerun
+        search_text = st.text_input("Or search a stored patient by name or ID to simulate EHR data transfer.", placeholder="Start typing a name or ID...")
+        search_page = st.session_state.get('patient_search_page', 0)
+        patients, total_patients = search_patients(search_text, search_page)
+
+        # Go back to the first page if the search has fewer results than the current page
+        if search_page and not patients:
+            st.session_state['patient_search_page'] = search_page = 0
+            patients, total_patients = search_patients(search_text, search_page)
+
+        patient_ids = {f"{name} ({patient_id})": patient_id for patient_id, name, _ in patients}
+        selected_label = st.selectbox(
+            f"{total_patients} patients found",
+            list(patient_ids),
             index=None,  # Start with the empty option
-            placeholder="Select a predefined patient...",
+            placeholder="Select a patient...",
         )
-        
-        if not selected_patient == None:
-            with st.spinner("Loading patient data..."):
-                # Reset specific session state values when a new patient is selected
-                st.session_state['risk_calculated'] = False
-                st.session_state['risk_result'] = None
-                st.session_state['risk_explanation'] = None
-                st.session_state['shap_values'] = None
-                
-                # Load JSON content into session_state immediately
-                patient_file_path = f"Patient_Simulation_Data/{selected_patient}.json"
-                
-                try:
-                    with open(patient_file_path) as f:
-                        st.session_state['patient_data'] = json.load(f)
-                    time.sleep(1)  # Simulating processing delay if needed
-                    st.success("Patient data loaded successfully!")
-                except FileNotFoundError:
-                    st.error(f"Data for {selected_patient} not found.")
+        selected_patient = patient_ids.get(selected_label)
+
+        # Pagination of the search results
+        page_count = max(1, -(-total_patients // patients_page_size))
+        if page_count > 1:
+            page_col1, page_col2, page_col3 = st.columns([1, 2, 1])
+            with page_col1:
+                if st.button("Previous", disabled=search_page == 0, use_container_width=True):
+                    st.session_state['patient_search_page'] = search_page - 1
+                    st.rerun()
+            with page_col2:
+                st.caption(f"Page {search_page + 1} of {page_count}")
+            with page_col3:
+                if st.button("Next", disabled=search_page + 1 >= page_count, use_container_width=True):
+                    st.session_state['patient_search_page'] = search_page + 1
+                    st.rerun()
+
+        # The full record is only loaded when another patient is selected
+        if selected_patient is not None and selected_patient != st.session_state.get('loaded_patient_id'):
+            # Reset specific session state values when a new patient is selected
+            st.session_state['risk_calculated'] = False
+            st.session_state['risk_result'] = None
+            st.session_state['risk_explanation'] = None
+            st.session_state['shap_values'] = None
+
+            patient_record = load_patient(selected_patient)
+            if patient_record is not None:
+                st.session_state['patient_data'] = patient_record
+                st.session_state['loaded_patient_id'] = selected_patient
+                st.success("Patient data loaded successfully!")
+            else:
+                st.error(f"Data for {selected_patient} not found.")
 
 # Access patient data from session state for the rest of the app
 patient_data = st.session_state.get('patient_data', {})
@@ -261,14 +292,27 @@ with col1:
 with col2:
 
     # Define a function to generate the tile content dynamically
-    def display_tile(label, value, color="black"):
+    def display_tile(label, value, color="black", note=""):
+        note_html = f'<p style="margin: 0; color: #777; font-size: 12px;">{note}</p>' if note else ""
         return f"""
             <div class="data-tile" style="width: 20%; margin: 5px; padding: 10px; background-color: #ffffff; border: 1px solid #e0e0e0; border-radius: 10px; box-shadow: 0 4px 8px rgba(0, 0, 0, 0.05); text-align: center;">
                 <p style="margin: 0; font-weight: bold; color: #333;">{label}</p>
                 <p style="margin: 5px 0; color: {color}; font-size: 18px;">{value}</p>
+                {note_html}
             </div>
         """
 
+    # Percentile of a patient value within the cohort of the same gender and age group
+    def get_percentile_note(feature, value):
+        if 'raw_df' not in st.session_state or value in (None, ""):
+            return ""
+        percentile_index = get_percentile_index(st.session_state['raw_df'], st.session_state.get('dataset_version'))
+        patient_info = patient_data.get("PatientInfo", {})
+        percentile, stratum = get_percentile(percentile_index, feature, float(value), patient_info.get("gender"), patient_info.get("age"))
+        if percentile is None:
+            return ""
+        return f"{format_percentile(percentile)} of {describe_stratum(stratum)}"
+
     # Define a function to generate the HTML for complaints dynamically
     def display_complaint(complaint):
         return f"""
@@ -334,12 +378,12 @@ with col2:
         # Generate the HTML content for the tiles
         tile_content = f"""
             <div class="tile-container">
-                {display_tile("Resting Heart Rate (bpm)", patient_data["VitalParameters"].get("resting_heart_rate", ""), get_color(patient_data["VitalParameters"].get("resting_heart_rate", ""), thresholds.get("resting_heart_rate")))}
-                {display_tile("Max Heart Rate (bpm)", patient_data["VitalParameters"].get("max_heart_rate", ""), get_color(patient_data["VitalParameters"].get("max_heart_rate", ""), thresholds.get("max_heart_rate")))}
-                {display_tile("Serum Cholesterol (mg/dL)", patient_data["LaboratoryValues"].get("serum_cholesterol", ""), get_color(patient_data["LaboratoryValues"].get("serum_cholesterol", ""), thresholds.get("serum_cholesterol")))}
-                {display_tile("Cigarettes per Day", patient_data["SocialFactors"].get("cigarettes_per_day", ""))}
+                {display_tile("Resting Heart Rate (bpm)", patient_data["VitalParameters"].get("resting_heart_rate", ""), get_color(patient_data["VitalParameters"].get("resting_heart_rate", ""), thresholds.get("resting_heart_rate")), get_percentile_note("resting_heart_rate", patient_data["VitalParameters"].get("resting_heart_rate")))}
+                {display_tile("Max Heart Rate (bpm)", patient_data["VitalParameters"].get("max_heart_rate", ""), get_color(patient_data["VitalParameters"].get("max_heart_rate", ""), thresholds.get("max_heart_rate")), get_percentile_note("max_heart_rate", patient_data["VitalParameters"].get("max_heart_rate")))}
+                {display_tile("Serum Cholesterol (mg/dL)", patient_data["LaboratoryValues"].get("serum_cholesterol", ""), get_color(patient_data["LaboratoryValues"].get("serum_cholesterol", ""), thresholds.get("serum_cholesterol")), get_percentile_note("serum_cholesterol", patient_data["LaboratoryValues"].get("serum_cholesterol")))}
+                {display_tile("Cigarettes per Day", patient_data["SocialFactors"].get("cigarettes_per_day", ""), note=get_percentile_note("cigarettes_per_day", patient_data["SocialFactors"].get("cigarettes_per_day")))}
                 {display_tile("Has Hypertension", "Yes" if patient_data["VitalParameters"].get("has_hypertension", 0) == 1 else "No", get_condition_color(patient_data["VitalParameters"].get("has_hypertension", 0), 1))}
-                {display_tile("ST Depression", patient_data["LaboratoryValues"].get("st_depression", ""), "red" if patient_data["LaboratoryValues"].get("st_depression", 0) > 0 else "black")}
+                {display_tile("ST Depression", patient_data["LaboratoryValues"].get("st_depression", ""), "red" if patient_data["LaboratoryValues"].get("st_depression", 0) > 0 else "black", get_percentile_note("st_depression", patient_data["LaboratoryValues"].get("st_depression")))}
                 {display_tile("Exercise Induced Angina", "Yes" if patient_data["SymptomsObservations"].get("exercise_induced_angina", False) else "No", get_condition_color(patient_data["SymptomsObservations"].get("exercise_induced_angina", False), True))}
                 {display_tile("Resting ECG Results", patient_data["ECGResults"].get("resting_ecg_results", ""), "red" if patient_data["ECGResults"].get("resting_ecg_results", "").lower() != "normal" else "black")}
             </div>
@@ -350,44 +394,35 @@ with col2:
 
         # Trend Analysis section
         with st.expander("Trend Analysis"):
-            date_range = pd.date_range(start=datetime.now() - timedelta(days=30), periods=30)
-            trend_data = pd.DataFrame({
-                'Date': date_range,
-                'Blood Pressure': np.random.randint(110, 140, size=len(date_range)),
-                'Cholesterol': np.random.randint(150, 240, size=len(date_range)),
-                'FBS': np.random.randint(70, 130, size=len(date_range)),
-                'Heart Rate': np.random.randint(60, 100, size=len(date_range)),
-            })
-
-            # Define units for each feature
-            units = {
-                'Blood Pressure': 'mmHg',
-                'Cholesterol': 'mg/dL',
-                'FBS': 'mg/dL',
-                'Heart Rate': 'bpm'
-            }
+            # Readings come from the vitals store, patients without readings are shown a simulated history
+            patient_id = patient_data.get("PatientInfo", {}).get("patient_id", "unknown")
 
             row1_col1, row1_col2, row1_col3 = st.columns(3)
             with row1_col1:
-                feature = st.selectbox('Select feature', ['Blood Pressure', 'Cholesterol', 'FBS', 'Heart Rate'])
+                feature = st.selectbox('Select feature', list(vital_units))
             with row1_col2:
                 start_date = st.date_input('Start Date', value=datetime.now() - timedelta(days=30))
             with row1_col3:
                 end_date = st.date_input('End Date', value=datetime.now())
 
             if start_date <= end_date:
-                filtered_data = trend_data[(trend_data['Date'] >= pd.to_datetime(start_date)) & 
-                                        (trend_data['Date'] <= pd.to_datetime(end_date))]
-                
+                # Range query on the store, long ranges are downsampled to the chart width
+                trend_data = get_vitals_trend(patient_id, feature, pd.Timestamp(start_date), pd.Timestamp(end_date) + pd.Timedelta(days=1) - pd.Timedelta(seconds=1))
+
                 # Plotly line chart with custom y-axis label based on selected feature
                 fig = px.line(
-                    filtered_data,
+                    trend_data,
                     x='Date',
-                    y=feature,
+                    y='Mean',
                     title=f'{feature} Over Time',
-                    labels={feature: f'{feature} ({units[feature]})', 'Date': 'Date'}
+                    labels={'Mean': f'{feature} ({vital_units[feature]})', 'Date': 'Date'}
                 )
 
+                # Show the range of the readings when several readings are combined into one point
+                if (trend_data['Readings'] > 1).any():
+                    fig.add_scatter(x=trend_data['Date'], y=trend_data['Max'], mode='lines', line=dict(width=0), showlegend=False, hoverinfo='skip')
+                    fig.add_scatter(x=trend_data['Date'], y=trend_data['Min'], mode='lines', line=dict(width=0), fill='tonexty', fillcolor='rgba(99, 110, 250, 0.2)', name='Min/Max', hoverinfo='skip')
+
                 # Show the plot
                 st.plotly_chart(fig)
             else:
@@ -5,6 +5,9 @@
 #                                                                                   #
 # - Calculate Heart Attack Risk                                                     #
 # - Display SHAP Explanation                                                        #
+# - Show the most similar training patients                                         #
+# - Log every calculation, unchanged inputs are read from the risk log              #
+# - Create the PDF risk report on request, cached for all sessions                  #
 #####################################################################################
 
 # Import needed libraries
@@ -13,11 +16,13 @@ import streamlit.components.v1 as components
 import numpy as np
 import base64
 import time
-import matplotlib.pyplot as plt
-import shap
-from visualization.models.model_utils import load_preprocessor, load_model, calculate_risk, interpret_shap_values
-from visualization.models.data_utils import generate_pdf
-from io import BytesIO
+from visualization.models.model_utils import get_prediction_models, process_and_predict, get_input_hash, prepare_patient_data, get_model_feature_names
+from visualization.models.explanation_utils import submit_explanation, get_render_pool
+from visualization.models.report_utils import get_report_key, find_risk_report, get_risk_report
+from visualization.models.percentile_utils import get_risk_distribution, percentile_of, format_percentile
+from visualization.models.neighbour_utils import get_neighbour_index, find_similar_patients
+from visualization.models.ehr_feed import notification_bell_html
+from visualization.models.risk_log_utils import log_risk_calculation, attach_risk_explanation, find_risk_calculation, get_risk_log_writer
 
 #####################################################################################
 ### File preparation: Functions and Status checks and model import                ###
@@ -28,11 +33,11 @@ def get_image_as_base64(image_path):
     with open(image_path, "rb") as img_file:
         return base64.b64encode(img_file.read()).decode()
 
-# Load the model and preprocessor
-preprocessor = load_preprocessor("visualization/models/standardizer.pkl")
+# Load the model and preprocessor once for all sessions, the version identifies the model in the risk log
+preprocessor, risk_model, model_version = get_prediction_models()
 
-# Load the risk model but just provide the name, as the util will find out if it is pkl or h5
-risk_model = load_model("visualization/models/risk_prediction_model")
+# Start the render process of the waterfall plots now, so it is ready for the first explanation
+get_render_pool()
 
 # Get patient data form session
 patient_data = st.session_state.get('patient_data', {})
@@ -43,37 +48,97 @@ if 'risk_calculated' not in st.session_state:
     st.session_state['risk_calculated'] = False
 
 
-def calculate_SHAP():
-    # Get the SHAP values and expected value from calculate_risk
-    result, shap_values, expected_value, prediction = calculate_risk(preprocessor, risk_model)
+# Session keys of the explanation, filled in when the background explanation has finished
+explanation_keys = ['shap_values_patient', 'expected_value', 'feature_names', 'shap_image', 'interpretation_text']
+
+# Save a risk calculation (new or from the risk log) in the session state, the explanation follows later
+def store_risk_calculation(result, probability, logged_at=None):
+    st.session_state['risk_calculated'] = True
+    st.session_state['risk_result'] = result
+    st.session_state['risk_prediction'] = probability
+    st.session_state['risk_logged_at'] = logged_at
+    for key in explanation_keys:
+        st.session_state[key] = None
+
+# Start the explanation of the session patient in the background (SHAP values, waterfall plot and text)
+def start_explanation(probability, shap_values=None, expected_value=None, on_explained=None):
+    st.session_state['explanation_future'] = submit_explanation(
+        risk_model, st.session_state['patient_data_processed'].to_numpy(), st.session_state['df'], probability,
+        st.session_state['flat_patient_data'], get_model_feature_names(preprocessor),
+        shap_values=shap_values, expected_value=expected_value, on_explained=on_explained
+    )
+    st.session_state['explanation_input_hash'] = get_input_hash(patient_data)
+
+# Save the finished explanation in the session state, explanations of another patient are dropped
+def apply_explanation():
+    explanation_future = st.session_state.get('explanation_future')
+    if explanation_future is None or not explanation_future.done():
+        return
+    del st.session_state['explanation_future']
+    if not st.session_state['risk_calculated'] or st.session_state.get('explanation_input_hash') != get_input_hash(patient_data):
+        return
+    if explanation_future.exception() is not None:
+        st.session_state['explanation_error'] = str(explanation_future.exception())
+        return
+    explanation = explanation_future.result()
+    for key in explanation_keys:
+        st.session_state[key] = explanation[key]
+    st.session_state['risk_explanation'] = explanation['shap_values_patient']
+    st.session_state['shap_values'] = explanation['expected_value']
+
+# Callback of the explanation that attaches the SHAP values to the logged calculation
+# The writer is looked up here, the explanation thread has no Streamlit context
+def attach_to_risk_log(input_hash, logged_at):
+    risk_log_writer = get_risk_log_writer()
+    return lambda shap_values, expected_value: attach_risk_explanation(
+        input_hash, model_version, logged_at, shap_values, expected_value, writer=risk_log_writer
+    )
 
-    # Reshape the SHAP values if needed
-    if len(shap_values.shape) == 3:
-        shap_values_patient = shap_values.reshape(-1, shap_values.shape[1])
+# Load the logged calculation of the session patient if the inputs and the model are unchanged
+def load_logged_risk():
+    input_hash = get_input_hash(patient_data)
+    logged = find_risk_calculation(input_hash, model_version)
+    if logged is None:
+        return False
+    # The model inputs are still needed for the similar patients
+    prepare_patient_data(preprocessor)
+    store_risk_calculation(logged['label'], logged['probability'], logged['logged_at'])
+    # The SHAP values are missing if the explanation of the logged calculation did not finish
+    if logged['shap_values'] is None:
+        start_explanation(logged['probability'], on_explained=attach_to_risk_log(input_hash, logged['logged_at']))
     else:
-        shap_values_patient = shap_values
-
-    st.session_state['shap_values_patient'] = shap_values_patient
-    st.session_state['expected_value'] = expected_value
-
-    # Display SHAP waterfall plot
-    if shap_values is not None:
-        feature_names = st.session_state['df'].columns.drop('Has_heart_disease')
-        st.session_state['feature_names'] = feature_names
-
-        fig, ax = plt.subplots()
-        shap.waterfall_plot(shap.Explanation(
-            values=shap_values_patient[0],
-            base_values=expected_value,
-            feature_names=feature_names
-        ))
-
-        # Save the SHAP waterfall plot as an image in memory (BytesIO)
-        img_buffer = BytesIO()
-        fig.savefig(img_buffer, format='png')
-        img_buffer.seek(0)  # Rewind the buffer to the beginning
-        st.session_state['shap_image'] = img_buffer  # Save image in session state
-        st.session_state['interpretation_text'] = interpret_shap_values(shap_values_patient, feature_names, prediction)
+        start_explanation(logged['probability'], logged['shap_values'], logged['expected_value'])
+    return True
+
+# Predict and log the risk of the session patient, the SHAP values are calculated in the background
+# and attached to the log entry. Returns an error message if the patient data can not be used
+def calculate_and_log_risk():
+    prediction, transformed_df = process_and_predict(preprocessor, risk_model)
+    if prediction is None:
+        return transformed_df
+    probability = float(np.ravel(prediction)[0])
+    result = "High Risk" if probability > 0.5 else "Low Risk"
+    store_risk_calculation(result, probability)
+
+    input_hash = get_input_hash(patient_data)
+    logged_at = log_risk_calculation(patient_data.get('PatientInfo', {}).get('patient_id'), input_hash, model_version, probability, result)
+    start_explanation(probability, on_explained=attach_to_risk_log(input_hash, logged_at))
+    return None
+
+# Show the explanation once it is ready, polls while the background explanation is running
+def show_explanation(explanation_future):
+    if not explanation_future.done():
+        st.info("Calculating the explanation of the risk in the background...", icon=":material/hourglass_top:")
+        return
+    # The explanation finished while polling, rerun the page so it is taken over (and the report can be created)
+    st.rerun()
+
+# A revisited patient with unchanged inputs shows the logged result without calculating it again
+if data_available and not st.session_state['risk_calculated']:
+    load_logged_risk()
+
+# Take over the explanation of the background worker
+apply_explanation()
 
 #####################################################################################
 ### Page Title and Doctor Infor                                                   ###
@@ -129,9 +194,7 @@ with st.container():
         st.html(
             f"""
             <div class="doctor-profile" style="display: flex; align-items: center; justify-content: flex-end;">
-                <span class="notification-bell" title="Notifications" style="font-size: 15px; margin-right: 5px;">
-                    🔔
-                </span>
+                {notification_bell_html(st.session_state.get('ehr_feed'))}
                 <h4 style="margin: 0; font-size: 14px; margin-right: 10px;">{doctor_name}</h4>
                 <img src="data:image/png;base64,{doctor_image_base64}" alt="Doctor Picture" style="width: 35px; height: auto;">
             </div>
@@ -231,24 +294,30 @@ with light_column:
                 if st.button("Calculate Risk", type="primary"):
                     if data_available:
                         with st.spinner("Calculating risk..."):
-                            result, explanation, shap_values, prediction = calculate_risk(preprocessor, risk_model)
-                            st.session_state['risk_calculated'] = True
-                            st.session_state['risk_result'] = result
-                            st.session_state['risk_explanation'] = explanation
-                            st.session_state['shap_values'] = shap_values
-                            calculate_SHAP()
+                            error_message = calculate_and_log_risk()
+                        if error_message:
+                            st.error(error_message)
+                        else:
                             st.rerun()  # Refresh the page after calculation
 
-            # If risk is already calculated, show the download button
+            # If risk is already calculated, the report is created on request and then offered for download
             else:
-                if st.session_state['interpretation_text']:
-                    st.download_button(
-                        label="Download Risk Report",
-                        file_name="risk_report.pdf",
-                        mime="application/pdf",
-                        data=generate_pdf(st.session_state['patient_data'], st.session_state['risk_result'], st.session_state['shap_image'], st.session_state['interpretation_text']),
-                        type="primary"
-                    )
+                if st.session_state.get('interpretation_text'):
+                    report_key = get_report_key(st.session_state['patient_data'], model_version)
+                    risk_report = find_risk_report(report_key)
+                    if risk_report is None:
+                        if st.button("Create Risk Report", type="primary"):
+                            with st.spinner("Creating report..."):
+                                get_risk_report(report_key, st.session_state['patient_data'], st.session_state['risk_result'], st.session_state['shap_image'], st.session_state['interpretation_text'])
+                            st.rerun()
+                    else:
+                        st.download_button(
+                            label="Download Risk Report",
+                            file_name="risk_report.pdf",
+                            mime="application/pdf",
+                            data=risk_report,
+                            type="primary"
+                        )
 
 # Column 3: Risk calculation result text
 with explain_column:
@@ -265,6 +334,16 @@ with explain_column:
                 st.error(f"A heart attack risk score has been calculated based on the provided patient information. {patient_name} has a **High Risk** of experiencing a heart attack.")
             elif risk_result == "Low Risk":
                 st.success(f"A heart attack risk score has been calculated based on the provided patient information. {patient_name} has a **Low Risk** of experiencing a heart attack.")
+
+            # Rank the predicted risk among all scored training patients (sorted once, binary search per lookup)
+            if 'risk_prediction' in st.session_state:
+                risk_distribution = get_risk_distribution(risk_model, st.session_state['df'], st.session_state.get('dataset_version'), model_version)
+                risk_percentile = percentile_of(risk_distribution, st.session_state['risk_prediction'])
+                st.write(f"The predicted risk of **{st.session_state['risk_prediction']:.0%}** is at the **{format_percentile(risk_percentile)}** of all patients in the training cohort.")
+
+            # Results of unchanged inputs come from the risk log
+            if st.session_state.get('risk_logged_at'):
+                st.caption(f"Result of the calculation from {time.strftime('%Y-%m-%d %H:%M', time.localtime(st.session_state['risk_logged_at']))}, the patient data has not changed since then.")
     else:
         st.error("⚠️ No Patient Data uploaded. Reload Patient data from EHR or enter manually!")
 
@@ -293,37 +372,57 @@ with st.expander("What are SHAP Values?", expanded=False):
 shap_col, explanation_col = st.columns([1.5, 2])
 
 if st.session_state['risk_calculated']:
-    # Get the SHAP values and expected value from calculate_risk
-    result, shap_values, expected_value, prediction = calculate_risk(preprocessor, risk_model)
-
-    # Reshape the SHAP values if needed
-    if len(shap_values.shape) == 3:
-        shap_values_patient = shap_values.reshape(-1, shap_values.shape[1])
-    else:
-        shap_values_patient = shap_values
-
-    # Display SHAP waterfall plot
-    if shap_values is not None:
+    # Display the SHAP waterfall plot rendered by the background explanation
+    if st.session_state.get('shap_image') is not None:
 
         col1, col2 = st.columns([1, 1])
         
         with col1:
-            # Display SHAP waterfall plot directly as matplotlib figure
-            fig, ax = plt.subplots()
-            shap.waterfall_plot(shap.Explanation(
-                values=st.session_state['shap_values_patient'][0],
-                base_values=st.session_state['expected_value'],
-                feature_names=st.session_state['feature_names']
-            ))
-            st.pyplot(fig)
+            st.image(st.session_state['shap_image'].getvalue(), use_column_width=True)
 
         with col2:
             # Show the interpretation text of the SHAP results
             st.markdown(st.session_state['interpretation_text'])
+
+    elif 'explanation_future' in st.session_state:
+        explanation_future = st.session_state['explanation_future']
+        # Finished after it was taken over at the top of the page, the rerun takes it over
+        if explanation_future.done():
+            st.rerun()
+        st.fragment(show_explanation, run_every=1)(explanation_future)
+
+    elif st.session_state.get('explanation_error'):
+        st.error(f"The explanation of the risk failed: {st.session_state.pop('explanation_error')}")
                 
     else:
         st.write("SHAP values not available.")
 
+#####################################################################################
+### Similar Patients from the training cohort                                     ###
+#####################################################################################
+
+if st.session_state['risk_calculated'] and 'patient_data_processed' in st.session_state:
+    st.subheader("Similar Patients")
+
+    with st.expander("How are similar patients found?", expanded=False):
+        st.write(
+            """
+            The patients of the training cohort are compared with the current patient after the same standardization that is used for the risk model.
+            The patients with the smallest distance in this standardized feature space are shown together with their diagnosis.
+            """
+        )
+
+    # The index is built once per dataset version at start-up, the query is a KD-tree lookup
+    neighbour_index = get_neighbour_index(st.session_state['df'], st.session_state.get('dataset_version'))
+    positions, distances, diagnoses = find_similar_patients(neighbour_index, st.session_state['patient_data_processed'].to_numpy())
+
+    # The rows of the raw data and the machine learning data belong to the same patients
+    similar_patients = st.session_state['raw_df'].iloc[positions].reset_index(drop=True)
+    similar_patients.insert(0, 'distance', distances.round(2))
+
+    st.write(f"**{int(diagnoses.sum())}** of the **{len(diagnoses)}** most similar patients were diagnosed with a heart disease.")
+    st.dataframe(similar_patients, hide_index=True, use_container_width=True)
+
 # Add a small information text at the bottom
 st.markdown("---")
 st.markdown("If you want to learn more about the prediction model, data used, and quality of our predictions:")
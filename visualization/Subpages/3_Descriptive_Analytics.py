@@ -15,10 +15,19 @@ from visualization.models.plot_utils import (
     plot_risk_by_gender,
     plot_risk_distribution,
     plot_age_distribution_by_gender_and_heart_attack,
-    plot_heart_attack_by_age_group_and_gender
+    plot_heart_attack_by_age_group_and_gender,
+    plot_feature_distribution,
+    plot_feature_box_plot
 )
-import plotly.express as px
-from visualization.models.data_utils import get_summary_statistics
+from visualization.models.figure_cache import get_cached_figure
+from visualization.models.cohort_utils import (
+    patient_filters,
+    filter_cohort,
+    get_cohort_view,
+    get_cohort_cube,
+    get_cube_summary_statistics
+)
+from visualization.models.ehr_feed import notification_bell_html
 
 #####################################################################################
 ### File preparation: Functions and Status checks and model import                ###
@@ -28,10 +37,13 @@ from visualization.models.data_utils import get_summary_statistics
 # Access data from session state in other subpages
 if 'df' in st.session_state:
     df = st.session_state['raw_df']
+    dataset_version = st.session_state.get('dataset_version')
+    # Pre-aggregated patient counts, computed once per dataset version
+    cube = get_cohort_cube(df, dataset_version)
 else:
     st.error("Data not loaded. Please go back to the main page to load the data.")
 
-total_patients, total_risk_patients, average_age = get_summary_statistics(df)
+total_patients, total_risk_patients, average_age = get_cube_summary_statistics(cube)
 
 
 #####################################################################################
@@ -50,9 +62,7 @@ with st.container():
         st.html(
             f"""
             <div class="doctor-profile" style="display: flex; align-items: center; justify-content: flex-end;">
-                <span class="notification-bell" title="Notifications" style="font-size: 15px; margin-right: 5px;">
-                    🔔
-                </span>
+                {notification_bell_html(st.session_state.get('ehr_feed'))}
                 <h4 style="margin: 0; font-size: 14px; margin-right: 10px;">{doctor_name}</h4>
                 <img src="data:image/png;base64,{doctor_image_base64}" alt="Doctor Picture" style="width: 35px; height: auto;">
             </div>
@@ -109,10 +119,6 @@ st.html(
 )
 
 # Display tiles within a container
-total_patients = 396
-total_risk_patients = 217
-average_age = 55.9
-
 # Concatenate all the tiles as a single HTML string
 tiles_html = f"""
 <div class="tile-container">
@@ -131,6 +137,16 @@ st.html(tiles_html)
 ### Expander for population visualizations                                        ###
 #####################################################################################
 
+# Graph options with their plot functions
+graph_options = {
+    'Gender Distribution': plot_gender_distribution,
+    'Age Distribution of Patients': plot_age_distribution,
+    'Heart Attack Risk by Gender': plot_risk_by_gender,
+    'Distribution of Heart Attacks': plot_risk_distribution,
+    'Age Distribution by Gender and Heart Attack Status': plot_age_distribution_by_gender_and_heart_attack,
+    'Heart Attack Distribution by Age Group and Gender': plot_heart_attack_by_age_group_and_gender,
+}
+
 # Expander for Population Visualization with independent filtering for each graph
 with st.expander("Population Visualization", expanded=True):
     
@@ -144,96 +160,42 @@ with st.expander("Population Visualization", expanded=True):
         # Add a radio button for filtering data for the first graph
         patient_filter1 = st.radio(
             "Select patient group for first graph:",
-            ("All Patients", "Only Heart Attack Patients", "Only No Heart Attack Patients")
+            patient_filters
         )
 
-        # Apply the filtering logic for the first graph
-        if patient_filter1 == "Only Heart Attack Patients":
-            filtered_df1 = df[df['heart_disease_diagnosis'] == True]
-        elif patient_filter1 == "Only No Heart Attack Patients":
-            filtered_df1 = df[df['heart_disease_diagnosis'] == False]
-        else:
-            filtered_df1 = df  # All patients
+        # Filter the cohort cube by the selected patient group
+        filtered_cube1 = filter_cohort(cube, patient_filter1)
 
         # Graph options for the first graph
-        graph_options = [
-            'Gender Distribution', 
-            'Age Distribution of Patients', 
-            'Heart Attack Risk by Gender', 
-            'Distribution of Heart Attacks',
-            'Age Distribution by Gender and Heart Attack Status',
-            'Heart Attack Distribution by Age Group and Gender'
-        ]
         selected_graph1 = st.selectbox("Select first graph", graph_options, index=0)
 
-        # First Graph Visualization based on filtered data
-        if selected_graph1 == 'Gender Distribution':
-            fig1 = plot_gender_distribution(filtered_df1)
-            st.plotly_chart(fig1, use_container_width=True)
-
-        elif selected_graph1 == 'Age Distribution of Patients':
-            fig1 = plot_age_distribution(filtered_df1)
-            st.plotly_chart(fig1, use_container_width=True)
-
-        elif selected_graph1 == 'Heart Attack Risk by Gender':
-            fig1 = plot_risk_by_gender(filtered_df1)
-            st.plotly_chart(fig1, use_container_width=True)
-
-        elif selected_graph1 == 'Distribution of Heart Attacks':
-            fig1 = plot_risk_distribution(filtered_df1)
-            st.plotly_chart(fig1, use_container_width=True)
-
-        elif selected_graph1 == 'Age Distribution by Gender and Heart Attack Status':
-            fig1 = plot_age_distribution_by_gender_and_heart_attack(filtered_df1)
-            st.plotly_chart(fig1, use_container_width=True)
-
-        elif selected_graph1 == 'Heart Attack Distribution by Age Group and Gender':
-            fig1 = plot_heart_attack_by_age_group_and_gender(filtered_df1)
-            st.plotly_chart(fig1, use_container_width=True)
+        # First Graph Visualization based on filtered data, shared with all sessions through the figure cache
+        fig1 = get_cached_figure(
+            (selected_graph1, patient_filter1, dataset_version),
+            graph_options[selected_graph1], filtered_cube1
+        )
+        st.plotly_chart(fig1, use_container_width=True)
 
     # Second graph filtering and graph options
     with g2:
         # Add a radio button for filtering data for the second graph
         patient_filter2 = st.radio(
             "Select patient group for second graph:",
-            ("All Patients", "Only Heart Attack Patients", "Only No Heart Attack Patients")
+            patient_filters
         )
 
-        # Apply the filtering logic for the second graph
-        if patient_filter2 == "Only Heart Attack Patients":
-            filtered_df2 = df[df['heart_disease_diagnosis'] == True]
-        elif patient_filter2 == "Only No Heart Attack Patients":
-            filtered_df2 = df[df['heart_disease_diagnosis'] == False]
-        else:
-            filtered_df2 = df  # All patients
+        # Filter the cohort cube by the selected patient group
+        filtered_cube2 = filter_cohort(cube, patient_filter2)
 
         # Graph options for the second graph
         selected_graph2 = st.selectbox("Select second graph", graph_options, index=1)
 
-        # Second Graph Visualization based on filtered data
-        if selected_graph2 == 'Gender Distribution':
-            fig2 = plot_gender_distribution(filtered_df2)
-            st.plotly_chart(fig2, use_container_width=True)
-
-        elif selected_graph2 == 'Age Distribution of Patients':
-            fig2 = plot_age_distribution(filtered_df2)
-            st.plotly_chart(fig2, use_container_width=True)
-
-        elif selected_graph2 == 'Heart Attack Risk by Gender':
-            fig2 = plot_risk_by_gender(filtered_df2)
-            st.plotly_chart(fig2, use_container_width=True)
-
-        elif selected_graph2 == 'Distribution of Heart Attacks':
-            fig2 = plot_risk_distribution(filtered_df2)
-            st.plotly_chart(fig2, use_container_width=True)
-
-        elif selected_graph2 == 'Age Distribution by Gender and Heart Attack Status':
-            fig2 = plot_age_distribution_by_gender_and_heart_attack(filtered_df2)
-            st.plotly_chart(fig2, use_container_width=True)
-
-        elif selected_graph2 == 'Heart Attack Distribution by Age Group and Gender':
-            fig2 = plot_heart_attack_by_age_group_and_gender(filtered_df2)
-            st.plotly_chart(fig2, use_container_width=True)
+        # Second Graph Visualization based on filtered data, shared with all sessions through the figure cache
+        fig2 = get_cached_figure(
+            (selected_graph2, patient_filter2, dataset_version),
+            graph_options[selected_graph2], filtered_cube2
+        )
+        st.plotly_chart(fig2, use_container_width=True)
 
 
 #####################################################################################
@@ -252,21 +214,16 @@ with st.expander("Feature Exploration", expanded=True):
     with row1_col1:
         patient_filter_feature = st.radio(
             "Select patient group:",
-            ("All Patients", "Only Heart Attack Patients", "Only No Heart Attack Patients")
+            patient_filters
         )
 
-        # Apply the filtering logic based on the selected option
-        if patient_filter_feature == "Only Heart Attack Patients":
-            filtered_feature_df = df[df['heart_disease_diagnosis'] == True]
-        elif patient_filter_feature == "Only No Heart Attack Patients":
-            filtered_feature_df = df[df['heart_disease_diagnosis'] == False]
-        else:
-            filtered_feature_df = df
+        # Get the shared read-only view of the selected patient group
+        filtered_feature_df = get_cohort_view(df, dataset_version, patient_filter_feature)
 
     st.divider()
     # Feature selection dropdown on the right
     with row1_col2:
-        numerical_features = filtered_feature_df.select_dtypes(include=['float64', 'int64']).columns.tolist()
+        numerical_features = filtered_feature_df.select_dtypes(include='number').columns.tolist()
         selected_feature = st.selectbox("Choose a feature to analyze:", numerical_features)
 
     # Show two columns for tabular data and visualization
@@ -307,12 +264,16 @@ with st.expander("Feature Exploration", expanded=True):
 
         if analysis_type == "Distribution":
             # Distribution plot of the selected feature
-            fig = px.histogram(filtered_feature_df, x=selected_feature, nbins=20, title=f'Distribution of {selected_feature}')
-            fig.update_layout(xaxis_title=selected_feature, yaxis_title='Frequency')
+            fig = get_cached_figure(
+                ('Feature Distribution', patient_filter_feature, selected_feature, dataset_version),
+                plot_feature_distribution, filtered_feature_df, selected_feature
+            )
             st.plotly_chart(fig, use_container_width=True)
 
         elif analysis_type == "Box Plot":
             # Box plot of the selected feature
-            fig = px.box(filtered_feature_df, y=selected_feature, title=f'Box Plot of {selected_feature}')
-            fig.update_layout(yaxis_title=selected_feature)
+            fig = get_cached_figure(
+                ('Feature Box Plot', patient_filter_feature, selected_feature, dataset_version),
+                plot_feature_box_plot, filtered_feature_df, selected_feature
+            )
             st.plotly_chart(fig, use_container_width=True)
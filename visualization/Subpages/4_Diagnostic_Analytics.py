@@ -12,10 +12,11 @@ import pandas as pd
 import plotly.express as px
 import plotly.graph_objects as go
 import numpy as np
-from scipy import stats
-from sklearn.cluster import KMeans
-from sklearn.metrics import silhouette_score
-from sklearn.decomposition import PCA
+from visualization.models.plot_utils import plot_correlation_heatmap, plot_pair_plot, plot_feature_comparison, plot_clusters_2d, plot_cluster_selection
+from visualization.models.figure_cache import get_cached_figure
+from visualization.models.cluster_utils import cluster_range, get_cluster_sweep, get_clustering_result, get_projection, suggest_num_clusters
+from visualization.models.statistics_utils import get_pairwise_statistics, select_correlation_matrix, get_pair_statistics, find_strong_correlations
+from visualization.models.ehr_feed import notification_bell_html
 
 #####################################################################################
 ### File preparation: Functions and Status checks and model import                ###
@@ -25,46 +26,37 @@ from sklearn.decomposition import PCA
 if 'selected_features' not in st.session_state:
     st.session_state['selected_features'] = []
     
-# Function to calculate correlation and regression
-def calculate_regression(df, feature_1, feature_2):
-    # Calculate correlation using numpy
-    correlation_value = np.corrcoef(df[feature_1], df[feature_2])[0, 1]
-    
-    # Perform linear regression using scipy
-    slope, intercept, r_value, p_value, std_err = stats.linregress(df[feature_1], df[feature_2])
-    
-    return correlation_value, r_value**2, p_value  # r_value**2 is R-squared
-
-# Function to perform K-Means clustering and calculate performance metrics
-def perform_clustering(df, features, num_clusters):
-    kmeans = KMeans(n_clusters=num_clusters, random_state=42)
-    clusters = kmeans.fit_predict(df[features])
-    inertia = kmeans.inertia_  # Sum of squared distances to the closest cluster center
-    
-    if num_clusters > 1:
-        silhouette_avg = silhouette_score(df[features], clusters)
-    else:
-        silhouette_avg = None
-    
-    return clusters, kmeans, inertia, silhouette_avg
-
-# Function to reduce the dimensions of the data using PCA
-def reduce_to_2d(df, features):
-    pca = PCA(n_components=2)  # Reduce to 2D
-    reduced_data = pca.fit_transform(df[features])
-    return reduced_data
+# Show the elbow and silhouette curves of the k-sweep, polls until the background sweep is finished
+def show_cluster_selection(sweep):
+    if not sweep.done():
+        st.info("Comparing all numbers of clusters in the background...", icon=":material/hourglass_top:")
+        return
+    # The sweep finished while polling, rerun the page so the slider uses its results
+    if st.session_state.get('cluster_sweep_polling'):
+        st.session_state['cluster_sweep_polling'] = False
+        st.rerun()
+    if sweep.exception() is not None:
+        st.error(f"The comparison of the numbers of clusters failed: {sweep.exception()}")
+        return
+
+    sweep_results = sweep.result()
+    suggested_k = suggest_num_clusters(sweep_results)
+    if suggested_k is not None:
+        st.write(f"Suggested number of clusters: **{suggested_k}** (highest silhouette score).")
+    st.plotly_chart(plot_cluster_selection(sweep_results, suggested_k), use_container_width=True)
 
 # Access data from session state in other subpages
 if 'df' in st.session_state and 'raw_df' in st.session_state:
     df = st.session_state['df']
     raw_df = st.session_state['raw_df']
+    dataset_version = st.session_state.get('dataset_version')
 else:
     st.error("Data not loaded. Please go back to the main page to load the data.")
 
 # Filter out original numeric columns excluding "has_hypertension"
 @st.cache_resource
 def get_numeric_features(df):
-    numeric_features = df.select_dtypes(include=['float64', 'int64']).columns.tolist()
+    numeric_features = df.select_dtypes(include='number').columns.tolist()
     if "has_hypertension" in numeric_features:
         numeric_features.remove("has_hypertension")
     return numeric_features
@@ -86,9 +78,7 @@ with st.container():
         st.html(
             f"""
             <div class="doctor-profile" style="display: flex; align-items: center; justify-content: flex-end;">
-                <span class="notification-bell" title="Notifications" style="font-size: 15px; margin-right: 5px;">
-                    🔔
-                </span>
+                {notification_bell_html(st.session_state.get('ehr_feed'))}
                 <h4 style="margin: 0; font-size: 14px; margin-right: 10px;">{doctor_name}</h4>
                 <img src="data:image/png;base64,{doctor_image_base64}" alt="Doctor Picture" style="width: 35px; height: auto;">
             </div>
@@ -113,7 +103,7 @@ with st.expander("Instructions", icon=":material/info:", expanded=True):
 
 if not df.empty:
     # Ensure numeric columns from the dataset are available for initial selection
-    numeric_features = df.select_dtypes(include=['float64', 'int64']).columns.tolist()
+    numeric_features = df.select_dtypes(include='number').columns.tolist()
 
     # Use session state to maintain the feature selection
     if 'selected_variables' not in st.session_state:
@@ -156,49 +146,25 @@ if not df.empty:
     col1, col2 = st.columns([1, 2])
 
     if len(selected_variables) > 1:
-        # Compute the correlation matrix
-        correlation_matrix = df[selected_variables].corr()
+        # Slice the correlation matrix of the selected variables from the cached statistics
+        correlation_matrix = select_correlation_matrix(get_pairwise_statistics(df, dataset_version, 'df'), selected_variables)
 
         # Visualize the correlation matrix using Plotly
         with col2:
             st.subheader("**Correlation Heatmap**")
 
-            fig = go.Figure(data=go.Heatmap(
-                z=correlation_matrix.values,
-                x=correlation_matrix.columns,
-                y=correlation_matrix.index,
-                colorscale='Viridis',  # You can adjust the color scale
-                texttemplate="%{z:.2f}",
-                hoverongaps=False
-            ))
-
-            fig.update_layout(
-                title="",
-                xaxis_title="Features",
-                yaxis_title="Features",
-                width=700,
-                height=700
+            fig = get_cached_figure(
+                ('Correlation Heatmap', tuple(selected_variables), dataset_version),
+                plot_correlation_heatmap, correlation_matrix
             )
-
             st.plotly_chart(fig, use_container_width=True)
 
         # Find strong correlations
-        strong_positive = []
-        strong_negative = []
-        very_strong_positive = []
-        very_strong_negative = []
-
-        for i in range(len(correlation_matrix.columns)):
-            for j in range(i):
-                corr_value = correlation_matrix.iloc[i, j]
-                if 0.5 <= corr_value < 0.7:
-                    strong_positive.append((correlation_matrix.columns[i], correlation_matrix.columns[j], corr_value))
-                elif -0.7 < corr_value <= -0.5:
-                    strong_negative.append((correlation_matrix.columns[i], correlation_matrix.columns[j], corr_value))
-                elif corr_value >= 0.7:
-                    very_strong_positive.append((correlation_matrix.columns[i], correlation_matrix.columns[j], corr_value))
-                elif corr_value <= -0.7:
-                    very_strong_negative.append((correlation_matrix.columns[i], correlation_matrix.columns[j], corr_value))
+        strong_correlations = find_strong_correlations(correlation_matrix)
+        strong_positive = strong_correlations['strong_positive']
+        strong_negative = strong_correlations['strong_negative']
+        very_strong_positive = strong_correlations['very_strong_positive']
+        very_strong_negative = strong_correlations['very_strong_negative']
 
         # Display correlation insights on the left column
         with col1:
@@ -267,8 +233,8 @@ if not df.empty:
             feature_2 = st.selectbox("Select the second feature:", numeric_features, key="feature_2")
 
             if feature_1 != feature_2:
-                # Calculate correlation and regression results using scipy and numpy
-                correlation_value, r_squared, p_value = calculate_regression(raw_df, feature_1, feature_2)
+                # Look up correlation and regression results in the cached statistics
+                correlation_value, r_squared, p_value = get_pair_statistics(get_pairwise_statistics(raw_df, dataset_version, 'raw_df'), feature_1, feature_2)
 
                 # Generate dynamic text explanation
                 significance_text = "statistically significant, meaning the result is unlikely to have occurred by chance" if p_value < 0.05 else "not statistically significant, meaning the result is likely to have occurred by chance"
@@ -300,21 +266,25 @@ if not df.empty:
 
                 # Show progress bar while loading the pair plot
                 with st.spinner("Loading pair plot..."):
-                    fig = px.scatter_matrix(raw_df[numeric_features])
-                    fig.update_layout(width=800, height=800)
+                    fig = get_cached_figure(
+                        ('Pair Plot', tuple(numeric_features), dataset_version),
+                        plot_pair_plot, raw_df, numeric_features
+                    )
                     st.plotly_chart(fig, use_container_width=True)
             else:
-                # Scatter plot to visualize the correlation using Plotly
-                fig = px.scatter(raw_df, x=feature_1, y=feature_2, trendline="ols", title=f'{feature_1} vs {feature_2}')
-                fig.update_layout(xaxis_title=feature_1, yaxis_title=feature_2)
+                # Scatter plot with regression line to visualize the correlation using Plotly
+                fig = get_cached_figure(
+                    ('Feature Comparison', feature_1, feature_2, dataset_version),
+                    plot_feature_comparison, raw_df, feature_1, feature_2
+                )
                 st.plotly_chart(fig, use_container_width=True)
 
 #####################################################################################
 ### Clusterin Values                                                              ###
 #####################################################################################
 
-    # Clustering Section
-    df_clustering = df.copy(deep=True)
+    # Clustering Section (the shared data is only read, the cluster labels are kept separately)
+    df_clustering = df
 
     with st.container():
         st.subheader("Clustering Analysis")
@@ -349,14 +319,15 @@ if not df.empty:
         with col1:
             
             # Select the number of clusters
-            num_clusters = st.slider("Select the number of clusters:", min_value=2, max_value=10, value=3)
+            num_clusters = st.slider("Select the number of clusters:", min_value=cluster_range.start, max_value=cluster_range.stop - 1, value=3)
 
             # Perform clustering only if features are selected
             if selected_features:
-                clusters, kmeans, inertia, silhouette_avg = perform_clustering(df_clustering, selected_features, num_clusters)
-
-                # Add the cluster labels to the dataframe for visualization
-                df_clustering['Cluster'] = clusters
+                # All numbers of clusters are fitted in the background, the slider then only looks up the results
+                sweep = get_cluster_sweep(df_clustering, dataset_version, tuple(selected_features))
+                st.session_state['cluster_sweep_polling'] = not sweep.done()
+                clustering = get_clustering_result(df_clustering, dataset_version, tuple(selected_features), num_clusters)
+                clusters, inertia, silhouette_avg = clustering['labels'], clustering['inertia'], clustering['silhouette']
 
                 # Provide information about the clustering performance
                 st.write(f"Clustering was performed on the selected features, dividing the data into **{num_clusters}** clusters.")
@@ -366,20 +337,20 @@ if not df.empty:
                 if silhouette_avg is not None:
                     st.write(f"The average silhouette score is **{silhouette_avg:.2f}**. A score closer to 1 means the clusters are well-separated, while a score closer to -1 means they overlap.")
 
+                st.fragment(show_cluster_selection, run_every=None if sweep.done() else 1)(sweep)
+
         with col2:
             if selected_features:
                 st.subheader(f"Clustering Visualization with {num_clusters} Clusters")
 
-                # Reduce to 2 dimensions using PCA for visualization
-                reduced_data = reduce_to_2d(df_clustering, selected_features)
-                reduced_df = pd.DataFrame(reduced_data, columns=['PCA 1', 'PCA 2'])
-                reduced_df['Cluster'] = clusters
+                # Reduce to 2 dimensions using PCA for visualization (fitted once per feature set)
+                reduced_data = get_projection(df_clustering, dataset_version, tuple(selected_features))
 
                 # Plot the reduced data with clusters
-                fig = px.scatter(reduced_df, x='PCA 1', y='PCA 2', color='Cluster',
-                                title=f'Clusters Visualized in 2D with PCA',
-                                color_continuous_scale='Viridis')
-                fig.update_layout(xaxis_title='PCA 1', yaxis_title='PCA 2')
+                fig = get_cached_figure(
+                    ('Clusters', tuple(selected_features), num_clusters, dataset_version),
+                    plot_clusters_2d, reduced_data, clusters
+                )
                 st.plotly_chart(fig, use_container_width=True)
 
             else:
@@ -8,6 +8,7 @@
 
 # Import needed libraries
 import streamlit as st
+from visualization.models.ehr_feed import notification_bell_html
 import streamlit.components.v1 as components
 import base64
 
@@ -50,9 +51,7 @@ with st.container():
         st.html(
             f"""
             <div class="doctor-profile" style="display: flex; align-items: center; justify-content: flex-end;">
-                <span class="notification-bell" title="Notifications" style="font-size: 15px; margin-right: 5px;">
-                    🔔
-                </span>
+                {notification_bell_html(st.session_state.get('ehr_feed'))}
                 <h4 style="margin: 0; font-size: 14px; margin-right: 10px;">{doctor_name}</h4>
                 <img src="data:image/png;base64,{doctor_image_base64}" alt="Doctor Picture" style="width: 35px; height: auto;">
             </div>
@@ -0,0 +1,185 @@
+#####################################################################################
+# 7_Risk_Worklist.py                                                                #
+#                                                                                   #
+# This is the streamlit page showing the worklist of all stored patients            #
+#                                                                                   #
+# - Re-score the patients whose data changed since the last scoring                 #
+# - List all patients sorted by the predicted risk                                  #
+# - Open a patient from the worklist                                                #
+# - Export the risk reports of the worklist as one ZIP                              #
+#####################################################################################
+
+# Import needed libraries
+import streamlit as st
+import pandas as pd
+from visualization.models.model_utils import get_prediction_models
+from visualization.models.patient_utils import load_patient, ensure_simulated_patients
+from visualization.models.worklist_utils import refresh_worklist, get_worklist, get_worklist_patient_ids, worklist_page_size, high_risk_threshold
+from visualization.models.report_utils import prepare_report_tasks
+from visualization.models.report_export import ReportExport, get_export_pool
+from visualization.models.risk_log_utils import get_risk_log_writer
+from visualization.models.ehr_feed import notification_bell_html
+
+#####################################################################################
+### Page Title and Doctor Info                                                    ###
+#####################################################################################
+
+doctor_name = "Dr. Emily Stone"
+doctor_image_base64 = st.session_state.get('doctor_image_base64', '')
+
+with st.container():
+    r1, r2 = st.columns([2, 1])
+
+    with r1:
+        # Display the title in the first column
+        r1.title("Risk Worklist")
+
+    with r2:
+        st.html(
+            f"""
+            <div class="doctor-profile" style="display: flex; align-items: center; justify-content: flex-end;">
+                {notification_bell_html(st.session_state.get('ehr_feed'))}
+                <h4 style="margin: 0; font-size: 14px; margin-right: 10px;">{doctor_name}</h4>
+                <img src="data:image/png;base64,{doctor_image_base64}" alt="Doctor Picture" style="width: 35px; height: auto;">
+            </div>
+            """
+        )
+
+
+#####################################################################################
+### Expander with Information about the page                                      ###
+#####################################################################################
+
+with st.expander(label="Instruction", icon=":material/info:"):
+    st.write(
+        """
+        This page lists all stored patients, sorted by their predicted heart attack risk.
+
+        - Patients that were added or changed since the last visit are scored automatically when the page is opened. Patients with unchanged data keep their risk.
+        - Use **Only high risk patients** to hide the patients with a low risk.
+        - Select a patient and click **Open patient** to show the patient data.
+        - Use **Export reports** to download the risk reports of all (or only the high risk) patients as one ZIP file. The export runs in the background and can be cancelled.
+        """
+    )
+
+
+#####################################################################################
+### Functions                                                                     ###
+#####################################################################################
+
+# Show the progress of the report export, polls until the background export is finished
+def show_report_export(report_export):
+    status = report_export.get_status()
+    processed = status['exported'] + status['skipped'] + status['failed']
+    if status['state'] == 'running':
+        st.progress(processed / max(status['total'], 1), text=f"Exporting reports... {processed} of {status['total']} patients")
+        if st.button("Cancel export"):
+            report_export.cancel()
+        return
+    # The export finished while polling, rerun the page to stop polling
+    if st.session_state.get('report_export_polling'):
+        st.session_state['report_export_polling'] = False
+        st.rerun()
+
+    if status['state'] == 'done':
+        skipped = f", {status['skipped']} patients with incomplete data were skipped" if status['skipped'] else ""
+        failed = f", {status['failed']} reports failed" if status['failed'] else ""
+        st.success(f"{status['exported']} reports exported{skipped}{failed}.")
+        st.download_button("Download reports", data=report_export.read_archive(), file_name="risk_reports.zip", mime="application/zip", type="primary")
+    elif status['state'] == 'cancelled':
+        st.warning("The export was cancelled.")
+    else:
+        st.error(f"The export failed: {status['error']}")
+
+
+#####################################################################################
+### Update the scores and show the worklist                                       ###
+#####################################################################################
+
+# Only the patients that changed since the last scoring are scored again
+preprocessor, risk_model, model_version = get_prediction_models()
+ensure_simulated_patients()
+with st.spinner("Updating the risk scores..."):
+    scored, unchanged = refresh_worklist(preprocessor, risk_model, model_version)
+if scored:
+    st.toast(f"{scored} patients scored")
+
+only_high_risk = st.toggle("Only high risk patients", value=False)
+worklist_page = st.session_state.get('worklist_page', 0)
+worklist, total_patients = get_worklist(worklist_page, only_high_risk=only_high_risk)
+
+# Go back to the first page if the filter has fewer patients than the current page
+if worklist_page and not worklist:
+    st.session_state['worklist_page'] = worklist_page = 0
+    worklist, total_patients = get_worklist(worklist_page, only_high_risk=only_high_risk)
+
+worklist_df = pd.DataFrame(worklist, columns=['Patient ID', 'Name', 'Risk', 'Last Update'])
+worklist_df['Risk Level'] = worklist_df['Risk'].map(
+    lambda risk: "No Risk Calculated" if pd.isna(risk) else "High Risk" if risk > high_risk_threshold else "Low Risk"
+)
+worklist_df['Last Update'] = pd.to_datetime(worklist_df['Last Update'], unit='ns')
+
+st.write(f"**{total_patients}** patients")
+st.dataframe(
+    worklist_df[['Name', 'Patient ID', 'Risk', 'Risk Level', 'Last Update']],
+    hide_index=True,
+    use_container_width=True,
+    column_config={
+        'Risk': st.column_config.ProgressColumn("Risk", format="%.2f", min_value=0.0, max_value=1.0),
+        'Last Update': st.column_config.DatetimeColumn("Last Update", format="YYYY-MM-DD HH:mm"),
+    },
+)
+
+# Pagination of the worklist
+page_count = max(1, -(-total_patients // worklist_page_size))
+page_col1, page_col2, page_col3 = st.columns([1, 4, 1])
+with page_col1:
+    if st.button("Previous", disabled=worklist_page == 0, use_container_width=True):
+        st.session_state['worklist_page'] = worklist_page - 1
+        st.rerun()
+with page_col2:
+    st.caption(f"Page {worklist_page + 1} of {page_count}")
+with page_col3:
+    if st.button("Next", disabled=worklist_page + 1 >= page_count, use_container_width=True):
+        st.session_state['worklist_page'] = worklist_page + 1
+        st.rerun()
+
+# Open a patient of the current page on the patient data page
+patient_labels = {f"{name} ({patient_id})": patient_id for patient_id, name, _, _ in worklist}
+open_col1, open_col2 = st.columns([3, 1])
+with open_col1:
+    selected_label = st.selectbox("Select a patient", list(patient_labels), index=None, placeholder="Select a patient...", label_visibility="collapsed")
+with open_col2:
+    if st.button("Open patient", type="primary", disabled=selected_label is None, use_container_width=True):
+        patient_id = patient_labels[selected_label]
+        st.session_state['patient_data'] = load_patient(patient_id)
+        st.session_state['loaded_patient_id'] = patient_id
+        st.session_state['risk_calculated'] = False
+        st.session_state['risk_result'] = None
+        st.session_state['risk_explanation'] = None
+        st.session_state['shap_values'] = None
+        st.switch_page("visualization/Subpages/1_Patient_Data.py")
+
+
+#####################################################################################
+### Export the risk reports                                                       ###
+#####################################################################################
+
+st.subheader("Report Export")
+
+# The reports are rendered in worker processes and written into the archive as soon as they are finished
+report_export = st.session_state.get('report_export')
+export_col1, export_col2 = st.columns([3, 1])
+with export_col1:
+    export_high_risk = st.toggle("Only high risk patients", value=True, key='export_high_risk')
+with export_col2:
+    if st.button("Export reports", disabled=report_export is not None and not report_export.finished(), use_container_width=True):
+        if report_export is not None:
+            report_export.cleanup()
+        export_patient_ids = get_worklist_patient_ids(only_high_risk=export_high_risk)
+        report_tasks = prepare_report_tasks(export_patient_ids, preprocessor, risk_model, model_version, st.session_state['df'], get_risk_log_writer())
+        st.session_state['report_export'] = report_export = ReportExport(report_tasks, len(export_patient_ids), get_export_pool()).start()
+
+if report_export is not None:
+    st.session_state['report_export_polling'] = not report_export.finished()
+    st.fragment(show_report_export, run_every=None if report_export.finished() else 1)(report_export)
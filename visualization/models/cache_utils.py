@@ -0,0 +1,79 @@
+#####################################################################################
+# cache_utils.py                                                                    #
+#                                                                                   #
+# This is the LRU cache shared between all sessions (figures, PDF reports)          #
+#                                                                                   #
+# - Store serialized values (bytes or str), the caller serializes them              #
+# - Evict the least recently used values above a size limit                         #
+# - Build each value only once, even if many sessions request it at the same time   #
+#####################################################################################
+
+# Import needed libraries
+import threading
+from collections import OrderedDict
+
+
+# Thread-safe LRU cache limited by the size of the values (Streamlit runs each session in its own thread)
+class SharedCache:
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.values = OrderedDict()
+        self.lock = threading.Lock()
+        self.building = {}
+
+    # Return the value of the key, None if it was not built yet
+    def get(self, key):
+        with self.lock:
+            if key in self.values:
+                self.values.move_to_end(key)
+                self.hits += 1
+                return self.values[key]
+            return None
+
+    # Return the value of the key, build and store it with build_value if it is missing
+    def get_or_build(self, key, build_value):
+        while True:
+            with self.lock:
+                if key in self.values:
+                    self.values.move_to_end(key)
+                    self.hits += 1
+                    return self.values[key]
+                # Wait for the session that is already building this value
+                in_progress = self.building.get(key)
+                if in_progress is None:
+                    in_progress = self.building[key] = threading.Event()
+                    self.misses += 1
+                    break
+            in_progress.wait()
+
+        try:
+            value = build_value()
+            self.put(key, value)
+            return value
+        finally:
+            with self.lock:
+                del self.building[key]
+            in_progress.set()
+
+    # Store a value and evict the least recently used ones until the size limit is kept
+    def put(self, key, value):
+        size = len(value)
+        with self.lock:
+            if key in self.values:
+                self.size -= len(self.values.pop(key))
+            # Values larger than the whole cache are not stored
+            if size > self.max_bytes:
+                return
+            self.values[key] = value
+            self.size += size
+            while self.size > self.max_bytes:
+                _, evicted = self.values.popitem(last=False)
+                self.size -= len(evicted)
+
+    # Statistics to check how well the cache works
+    def get_statistics(self):
+        with self.lock:
+            return {'entries': len(self.values), 'bytes': self.size, 'hits': self.hits, 'misses': self.misses}
@@ -0,0 +1,121 @@
+#####################################################################################
+# cluster_utils.py                                                                  #
+#                                                                                   #
+# This is a helper function collection for the clustering analysis                  #
+#                                                                                   #
+# - K-Means for small data, MiniBatchKMeans above a row threshold                   #
+# - Silhouette score on a random sample above the row threshold (it is O(n^2))      #
+# - PCA projection to 2D, fitted once per feature set                               #
+# - Cache the results per feature set, number of clusters and dataset version       #
+# - Sweep all numbers of clusters in parallel in the background (elbow/silhouette)  #
+#####################################################################################
+
+# Import needed libraries
+from concurrent.futures import ThreadPoolExecutor
+import streamlit as st
+import numpy as np
+from joblib import Parallel, delayed
+from sklearn.cluster import KMeans, MiniBatchKMeans
+from sklearn.metrics import silhouette_score
+from sklearn.decomposition import PCA
+
+# Number of rows above which MiniBatchKMeans and the sampled silhouette score are used
+clustering_row_threshold = 10000
+
+# Number of rows used for the silhouette score above the row threshold
+silhouette_sample_size = 5000
+
+# Batch size of MiniBatchKMeans
+minibatch_size = 4096
+
+# Fixed seed so the same selection always gives the same clusters
+clustering_random_state = 42
+
+# Numbers of clusters offered on the clustering section (slider and k-sweep)
+cluster_range = range(2, 11)
+
+# Number of k-sweeps that run at the same time, each one uses all cores
+sweep_workers = 2
+
+
+#####################################################################################
+### Clustering and projection                                                     ###
+#####################################################################################
+
+# Get the values of the selected features as float matrix (bool columns become 0/1)
+def get_feature_matrix(df, features):
+    return df[list(features)].to_numpy(dtype=float)
+
+# Cluster the data and compute the inertia and the silhouette score
+def fit_clusters(X, num_clusters, row_threshold=clustering_row_threshold):
+    if len(X) > row_threshold:
+        kmeans = MiniBatchKMeans(n_clusters=num_clusters, batch_size=minibatch_size, n_init=3, random_state=clustering_random_state)
+        sample_size = min(len(X), silhouette_sample_size)
+    else:
+        kmeans = KMeans(n_clusters=num_clusters, random_state=clustering_random_state)
+        sample_size = None
+    labels = kmeans.fit_predict(X)
+    inertia = kmeans.inertia_  # Sum of squared distances to the closest cluster center
+
+    # The silhouette score needs at least two different clusters
+    if len(np.unique(labels)) > 1:
+        silhouette_avg = silhouette_score(X, labels, sample_size=sample_size, random_state=clustering_random_state)
+    else:
+        silhouette_avg = None
+
+    return {'labels': labels.astype(np.int16), 'inertia': inertia, 'silhouette': silhouette_avg}
+
+# Reduce the data to 2 dimensions with PCA, a single feature is padded with zeros
+def fit_projection(X):
+    n_components = min(2, X.shape[1])
+    reduced_data = PCA(n_components=n_components).fit_transform(X)
+    if n_components < 2:
+        reduced_data = np.column_stack((reduced_data, np.zeros(len(reduced_data))))
+    return reduced_data.astype(np.float32)
+
+
+#####################################################################################
+### Model selection over the number of clusters                                   ###
+#####################################################################################
+
+# Fit all numbers of clusters at once, each one in its own process
+def sweep_clusters(X, k_values=cluster_range, n_jobs=-1):
+    results = Parallel(n_jobs=n_jobs)(delayed(fit_clusters)(X, k) for k in k_values)
+    return dict(zip(k_values, results))
+
+# Suggest the number of clusters with the highest silhouette score
+def suggest_num_clusters(sweep_results):
+    scores = {k: result['silhouette'] for k, result in sweep_results.items() if result['silhouette'] is not None}
+    return max(scores, key=scores.get) if scores else None
+
+
+#####################################################################################
+### Cached layer shared between sessions                                          ###
+#####################################################################################
+
+# The data itself is not hashed, the dataset version identifies it, features must be a tuple
+@st.cache_resource(max_entries=64)
+def get_clustering(_df, dataset_version, features, num_clusters):
+    return fit_clusters(get_feature_matrix(_df, features), num_clusters)
+
+@st.cache_resource(max_entries=16)
+def get_projection(_df, dataset_version, features):
+    return fit_projection(get_feature_matrix(_df, features))
+
+# Executor for the k-sweeps, shared by all sessions
+@st.cache_resource
+def get_sweep_executor():
+    return ThreadPoolExecutor(max_workers=sweep_workers, thread_name_prefix='cluster-sweep')
+
+# Start the k-sweep of a feature set in the background, returns the future of the results
+# Every session asking for the same feature set gets the same future
+@st.cache_resource(max_entries=16)
+def get_cluster_sweep(_df, dataset_version, features):
+    return get_sweep_executor().submit(sweep_clusters, get_feature_matrix(_df, features))
+
+# Get the clustering of k from the finished k-sweep, fit it alone while the sweep is still running
+def get_clustering_result(_df, dataset_version, features, num_clusters):
+    sweep = get_cluster_sweep(_df, dataset_version, features)
+    if sweep.done() and sweep.exception() is None:
+        return sweep.result()[num_clusters]
+    return get_clustering(_df, dataset_version, features, num_clusters)
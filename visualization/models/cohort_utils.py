@@ -0,0 +1,100 @@
+#####################################################################################
+# cohort_utils.py                                                                   #
+#                                                                                   #
+# This is a helper function collection for the shared cohort data                   #
+#                                                                                   #
+# - Filter the cohort into read-only views per patient group                        #
+# - Compute derived columns (age groups) in a separate layer                        #
+# - Pre-aggregate the cohort into a cube of patient counts                          #
+# - Cache all of them once per dataset version for all sessions                     #
+#                                                                                   #
+# The cohort DataFrames are shared by reference between all sessions. They must     #
+# never be changed in place, derived values are kept in separate objects instead.   #
+#####################################################################################
+
+# Import needed libraries
+import streamlit as st
+import pandas as pd
+import numpy as np
+
+# Filters for the patient groups offered on the analytics pages
+patient_filters = ("All Patients", "Only Heart Attack Patients", "Only No Heart Attack Patients")
+
+# Age groups used for the descriptive analytics
+age_group_bins = [0, 40, 50, 60, 70, 80, float('inf')]
+age_group_labels = ['<40', '40-50', '50-60', '60-70', '70-80', '>80']
+
+# Dimensions of the cohort cube, the age is kept in years so the age distribution can be answered from it
+cube_dimensions = ['gender', 'heart_disease_diagnosis', 'age', 'age_group', 'chest_pain_type', 'resting_ecg_results']
+
+
+#####################################################################################
+### Filtered views and derived columns                                            ###
+#####################################################################################
+
+# Filter the cohort by the selected patient group
+def filter_cohort(df, patient_filter):
+    if patient_filter == "Only Heart Attack Patients":
+        return df[df['heart_disease_diagnosis']]
+    elif patient_filter == "Only No Heart Attack Patients":
+        return df[~df['heart_disease_diagnosis']]
+    return df  # All patients
+
+# Assign the age group to each age
+def get_age_groups(ages):
+    return pd.cut(ages, bins=age_group_bins, labels=age_group_labels, right=False).rename('age_group')
+
+# Compute the derived columns of the cohort, the index matches the cohort so they can be aligned with any view
+def get_derived_columns(df):
+    return pd.DataFrame({'age_group': get_age_groups(df['age'])}, index=df.index)
+
+
+#####################################################################################
+### Cohort cube with the patient counts                                           ###
+#####################################################################################
+
+# Count the patients per combination of the cube dimensions, only existing combinations are kept
+# The filters of filter_cohort work on the cube as well, as it has the diagnosis as column
+def build_cohort_cube(df, derived_columns=None):
+    if derived_columns is None:
+        derived_columns = get_derived_columns(df)
+    keys = [derived_columns[column] if column in derived_columns.columns else df[column] for column in cube_dimensions]
+    return df.groupby(keys, observed=True).size().rename('count').reset_index()
+
+# Sum the patient counts of the cube over the given dimensions
+def count_by(cube, dimensions, observed=True):
+    return cube.groupby(dimensions, observed=observed)['count'].sum()
+
+# Summary statistics of the cube (number of patients, patients with heart attack, average age)
+def get_cube_summary_statistics(cube):
+    total_patients = int(cube['count'].sum())
+    total_risk_patients = int(cube.loc[cube['heart_disease_diagnosis'], 'count'].sum())
+    average_age = (cube['age'] * cube['count']).sum() / total_patients if total_patients else 0
+    return total_patients, total_risk_patients, round(average_age, 2)
+
+# Quartiles, minimum and maximum of the age, weighted by the patient counts of the cube
+def get_age_quartiles(cube):
+    age_counts = count_by(cube, 'age')
+    ages = age_counts.index.to_numpy()
+    cumulative = age_counts.to_numpy().cumsum()
+    positions = np.searchsorted(cumulative, np.array([0.25, 0.5, 0.75]) * cumulative[-1])
+    q1, median, q3 = ages[positions]
+    return {'min': ages[0], 'q1': q1, 'median': median, 'q3': q3, 'max': ages[-1]}
+
+
+#####################################################################################
+### Cached layer shared between sessions                                          ###
+#####################################################################################
+
+# The cohort itself is not hashed, the dataset version identifies it (see data_utils.get_dataset_version)
+@st.cache_resource(max_entries=16)
+def get_cohort_view(_df, dataset_version, patient_filter):
+    return filter_cohort(_df, patient_filter)
+
+@st.cache_resource(max_entries=4)
+def get_cohort_derived_columns(_df, dataset_version):
+    return get_derived_columns(_df)
+
+@st.cache_resource(max_entries=4)
+def get_cohort_cube(_df, dataset_version):
+    return build_cohort_cube(_df, get_cohort_derived_columns(_df, dataset_version))
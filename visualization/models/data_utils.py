@@ -4,25 +4,128 @@
 # This is a helper function collection for handling the raw data and pdf generation #
 #                                                                                   #
 # - Load data from file path                                                        #
+# - Apply the compact dtype schema to the cohort data                               #
 # - Calculate basic summaries                                                       #
 #####################################################################################
 
 
+import threading
 import pandas as pd
+import numpy as np
+import hashlib
 # For PDF generation
 from fpdf import FPDF
+from fpdf.image_parsing import preload_image
+from fpdf.image_datastructures import ImageCache
 from io import BytesIO
 from datetime import datetime
 
+# Categories of the enum features in the raw cohort data (order as in the UCI documentation)
+cohort_categories = {
+    'gender': ['Female', 'Male'],
+    'chest_pain_type': ['Typical Angina', 'Atypical Angina', 'Non-Anginal Pain', 'Asymptomatic'],
+    'resting_ecg_results': ['Normal', 'ST-T Wave Abnormality', 'Left Ventricular Hypertrophy'],
+}
+
+# Declared dtype schema for the raw cohort data (complete_case_data.csv)
+# The integer types are chosen to cover the clinical ranges of the features
+cohort_schema = {
+    'age': 'int16',
+    'gender': pd.CategoricalDtype(cohort_categories['gender']),
+    'chest_pain_type': pd.CategoricalDtype(cohort_categories['chest_pain_type']),
+    'serum_cholesterol': 'int16',
+    'high_fasting_blood_sugar': 'bool',
+    'resting_ecg_results': pd.CategoricalDtype(cohort_categories['resting_ecg_results']),
+    'max_heart_rate': 'int16',
+    'exercise_induced_angina': 'bool',
+    'st_depression': 'float32',
+    'has_hypertension': 'bool',
+    'cigarettes_per_day': 'int16',
+    'years_smoking': 'int16',
+    'family_history_cad': 'bool',
+    'resting_heart_rate': 'int16',
+    'heart_disease_diagnosis': 'bool',
+}
+
+# Accepted spellings for boolean values in the raw files
+bool_values = {
+    'true': True, 'yes': True, '1': True, '1.0': True,
+    'false': False, 'no': False, '0': False, '0.0': False,
+}
+
 # Load and process data
 def load_data(file_path):
     data = pd.read_csv(file_path)
     return data
 
+# Convert a column strictly to bool, unknown values raise an error instead of silently becoming True
+def to_bool(series):
+    if series.dtype == bool:
+        return series
+    converted = series.astype(str).str.strip().str.lower().map(bool_values)
+    if converted.isna().any():
+        invalid = series[converted.isna()].unique().tolist()
+        raise ValueError(f"Column '{series.name}' has non-boolean values: {invalid}")
+    return converted.astype(bool)
+
+# Convert a column to a compact numeric type, checking that no value is lost in the conversion
+def to_numeric(series, dtype):
+    values = pd.to_numeric(series)
+    if np.issubdtype(np.dtype(dtype), np.integer):
+        limits = np.iinfo(dtype)
+        if values.isna().any() or (values % 1 != 0).any():
+            raise ValueError(f"Column '{series.name}' has missing or non-integer values and cannot be stored as {dtype}")
+        if values.min() < limits.min or values.max() > limits.max:
+            raise ValueError(f"Column '{series.name}' exceeds the range of {dtype}")
+    return values.astype(dtype)
+
+# Apply the declared schema to the raw cohort data, columns not in the schema are kept as they are
+def apply_cohort_schema(df, schema=cohort_schema):
+    df = df.copy()
+    for column, dtype in schema.items():
+        if column not in df.columns:
+            continue
+        if isinstance(dtype, pd.CategoricalDtype):
+            df[column] = df[column].astype(dtype)
+            # Values that are not part of the declared categories would silently become NaN
+            if df[column].isna().any():
+                raise ValueError(f"Column '{column}' has values outside of {list(dtype.categories)}")
+        elif dtype == 'bool':
+            df[column] = to_bool(df[column])
+        else:
+            df[column] = to_numeric(df[column], dtype)
+    return df
+
+# Compare the memory usage of the data before and after applying the schema
+def get_memory_report(before_df, after_df):
+    report = pd.DataFrame({
+        'dtype before': before_df.dtypes.astype(str),
+        'dtype after': after_df.dtypes.astype(str),
+        'bytes before': before_df.memory_usage(index=False, deep=True),
+        'bytes after': after_df.memory_usage(index=False, deep=True),
+    })
+    report.loc['Total'] = ['', '', report['bytes before'].sum(), report['bytes after'].sum()]
+    report['reduction'] = (report['bytes before'] / report['bytes after']).round(1).astype(str) + 'x'
+    return report
+
+# Identify the version of the dataset by the content of its files
+def get_dataset_version(file_paths):
+    digest = hashlib.sha256()
+    for file_path in file_paths:
+        with open(file_path, "rb") as file:
+            digest.update(file.read())
+    return digest.hexdigest()[:16]
+
+# Load the raw cohort data and apply the compact dtype schema
+def load_cohort_data(file_path):
+    data = load_data(file_path)
+    cohort_data = apply_cohort_schema(data)
+    return cohort_data, get_memory_report(data, cohort_data)
+
 # Function to calculate summary statistics
 def get_summary_statistics(df):
     total_patients = len(df)
-    total_risk_patients = df['heart_disease_diagnosis'].sum()
+    total_risk_patients = int(df['heart_disease_diagnosis'].sum())
     average_age = df['age'].mean()
     return total_patients, total_risk_patients, round(average_age, 2)
 
@@ -30,6 +133,19 @@ def get_summary_statistics(df):
 def get_gender_distribution(df):
     return df['gender'].value_counts()
 
+# Static images of the PDF report, decoded once per process
+report_logo_path = "visualization/assets/CardioVision_Full_Logo.png"
+report_images = {}
+report_images_lock = threading.Lock()
+
+# Decoded and compressed data of a static report image, read from the file only on the first use in the process
+def get_report_image(image_path):
+    with report_images_lock:
+        if image_path not in report_images:
+            _, _, info = preload_image(ImageCache(), image_path)
+            report_images[image_path] = info
+        return report_images[image_path]
+
 # Define a custom PDF class to handle headers
 class CustomPDF(FPDF):
     def __init__(self, patient_name, patient_id, *args, **kwargs):
@@ -37,9 +153,17 @@ class CustomPDF(FPDF):
         self.patient_name = patient_name
         self.patient_id = patient_id
 
+    # Add a static image, every document gets its own copy of the decoded image (safe to use in parallel)
+    def static_image(self, image_path, **kwargs):
+        if image_path not in self.image_cache.images:
+            info = get_report_image(image_path)
+            info = type(info)(info, i=len(self.image_cache.images) + 1, usages=0)
+            self.image_cache.images[image_path] = info
+        self.image(image_path, **kwargs)
+
     def header(self):
         # Add the logo on every page
-        self.image("visualization/assets/CardioVision_Full_Logo.png", x=self.w * 0.3, y=10, w=self.w * 0.5)
+        self.static_image(report_logo_path, x=self.w * 0.3, y=10, w=self.w * 0.5)
         self.ln(30)  # Move to next section after the image
 
         # Get current date and time
@@ -146,7 +270,7 @@ def generate_pdf(patient_data, risk_result, shap_image, interpretation_text):
     start_y = pdf.get_y()
 
     # Insert the image (traffic light) aligned to the right
-    pdf.image(image, x=right_x, y=start_y, w=17)  # Adjust 'w' for size of the image
+    pdf.static_image(image, x=right_x, y=start_y, w=17)  # Adjust 'w' for size of the image
     pdf.ln(35)  # Adjust spacing after the image (you can modify this based on the image height)
 
     # Move the cursor below the image
@@ -243,13 +367,10 @@ def generate_pdf(patient_data, risk_result, shap_image, interpretation_text):
 
         start_y = pdf.get_y()  # Starting y position for both sections
 
-        # Save SHAP image to a temporary file and add to PDF
-        with open("shap_plot.png", "wb") as f:
-            f.write(shap_image.getbuffer())
-        
         # Set the image to be 50% of the page width and aligned left
         image_width = (pdf.w - 20) / 2  # Set image width to half the page width with 10mm margin
-        pdf.image("shap_plot.png", x=10, y=pdf.get_y(), w=image_width)  # Align left with x=10
+        # The SHAP image is added straight from memory
+        pdf.image(BytesIO(shap_image.getvalue()), x=10, y=pdf.get_y(), w=image_width)  # Align left with x=10
         pdf.ln(10 + image_width / 3)  # Move cursor down after the image
 
 
@@ -0,0 +1,51 @@
+#####################################################################################
+# database_utils.py                                                                 #
+#                                                                                   #
+# This is a helper function collection for the local patient database (SQLite)     #
+#                                                                                   #
+# - Path of the database file and connections with the shared settings              #
+# - Create the tables of a store once per process                                  #
+#                                                                                   #
+# Every call opens its own connection, as Streamlit runs each session in its own    #
+# thread. WAL mode lets the sessions read while another one writes.                 #
+#####################################################################################
+
+# Import needed libraries
+import os
+import sqlite3
+import threading
+
+# Folder and file of the local patient database (relative to the repository root)
+repository_dir = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+database_dir = os.path.join(repository_dir, 'data', '04_patient_database')
+database_path = os.path.join(database_dir, 'cardiovision.db')
+
+# Seconds a connection waits for a lock held by another writer
+busy_timeout = 30
+
+# Schemas that were already created in this process, per database file
+created_schemas = set()
+schema_lock = threading.Lock()
+
+
+# Open a connection to the database, the folder is created if needed
+def connect(db_path=database_path):
+    os.makedirs(os.path.dirname(db_path), exist_ok=True)
+    connection = sqlite3.connect(db_path, timeout=busy_timeout)
+    connection.execute("PRAGMA journal_mode=WAL")
+    connection.execute("PRAGMA synchronous=NORMAL")
+    return connection
+
+# Create the tables and indexes of a store (the statements must use IF NOT EXISTS)
+def ensure_schema(name, statements, db_path=database_path):
+    with schema_lock:
+        if (name, db_path) in created_schemas:
+            return
+        connection = connect(db_path)
+        try:
+            with connection:
+                for statement in statements:
+                    connection.execute(statement)
+        finally:
+            connection.close()
+        created_schemas.add((name, db_path))
@@ -0,0 +1,109 @@
+#####################################################################################
+# deeplift_utils.py                                                                 #
+#                                                                                   #
+# This is the NumPy implementation of the DeepLIFT / DeepSHAP attributions          #
+#                                                                                   #
+# - Read the weights of a Keras network of Dense layers (Dropout is skipped)        #
+# - Forward pass of the patients and the background rows                            #
+# - Rescale rule for ReLU and sigmoid, as in shap.DeepExplainer                     #
+# - Batched over patients and background rows, only matrix products                 #
+#                                                                                   #
+# The SHAP value of a feature is the mean over the background rows of the           #
+# difference to the background row times the DeepLIFT multiplier.                   #
+#####################################################################################
+
+# Import needed libraries
+import numpy as np
+
+# Activations of the Dense layers the rescale rule is implemented for
+activation_functions = {
+    'linear': lambda z: z,
+    'relu': lambda z: np.maximum(z, 0),
+    'sigmoid': lambda z: 1 / (1 + np.exp(-z)),
+}
+
+# Derivatives of the activations, used where the input and the reference are (almost) equal
+activation_gradients = {
+    'linear': lambda z: np.ones_like(z),
+    'relu': lambda z: (z > 0).astype(z.dtype),
+    'sigmoid': lambda z: (1 / (1 + np.exp(-z))) * (1 - 1 / (1 + np.exp(-z))),
+}
+
+# Below this difference of input and reference the rescale rule uses the gradient (same as shap)
+rescale_epsilon = 1e-6
+
+# Number of patients explained at once, limits the memory of the (patients x background x units) multipliers
+deeplift_batch_size = 64
+
+
+#####################################################################################
+### Network                                                                       ###
+#####################################################################################
+
+# Weights and activation of every Dense layer of a Keras model
+# None if the model has other layers or activations, or more than one output
+def get_dense_layers(model):
+    layers = []
+    for layer in model.layers:
+        layer_type = type(layer).__name__
+        if layer_type in ('Dropout', 'InputLayer'):
+            continue
+        activation = layer.get_config().get('activation')
+        if layer_type != 'Dense' or activation not in activation_functions:
+            return None
+        weights, bias = layer.get_weights()
+        layers.append((weights.astype(np.float64), bias.astype(np.float64), activation))
+    if not layers or layers[-1][0].shape[1] != 1:
+        return None
+    return layers
+
+# Pre-activations of every layer and the output of the network
+def forward(layers, data):
+    pre_activations = []
+    activations = data
+    for weights, bias, activation in layers:
+        z = activations @ weights + bias
+        pre_activations.append(z)
+        activations = activation_functions[activation](z)
+    return pre_activations, activations
+
+# Predicted output of the network (same as model.predict)
+def predict_network(layers, data):
+    return forward(layers, np.asarray(data, dtype=np.float64))[1]
+
+
+#####################################################################################
+### Attributions                                                                  ###
+#####################################################################################
+
+# Rescale multiplier of an activation: change of the output divided by the change of the input
+def rescale(activation, z_input, z_reference):
+    delta = z_input - z_reference
+    small = np.abs(delta) < rescale_epsilon
+    output_delta = activation_functions[activation](z_input) - activation_functions[activation](z_reference)
+    return np.where(small, activation_gradients[activation](z_input), output_delta / np.where(small, 1, delta))
+
+# DeepLIFT attributions of the patients against every background row, averaged over the background
+def explain_batch(layers, data, background, background_pre_activations):
+    data_pre_activations, _ = forward(layers, data)
+
+    # Multipliers of the output towards the inputs for all (patient, background row) pairs: N x B x units
+    multipliers = None
+    for (weights, _, activation), z_input, z_reference in reversed(list(zip(layers, data_pre_activations, background_pre_activations))):
+        layer_multipliers = rescale(activation, z_input[:, None, :], z_reference[None, :, :])
+        multipliers = layer_multipliers if multipliers is None else multipliers * layer_multipliers
+        multipliers = multipliers @ weights.T
+
+    return ((data[:, None, :] - background[None, :, :]) * multipliers).mean(axis=1)
+
+# SHAP values (N x features) of a single output network and the expected value (mean output of the background)
+def deeplift_shap_values(layers, data, background):
+    data = np.asarray(data, dtype=np.float64)
+    background = np.asarray(background, dtype=np.float64)
+    background_pre_activations, background_output = forward(layers, background)
+
+    shap_values = np.empty(data.shape)
+    for start in range(0, len(data), deeplift_batch_size):
+        stop = start + deeplift_batch_size
+        shap_values[start:stop] = explain_batch(layers, data[start:stop], background, background_pre_activations)
+    return shap_values, float(background_output.mean())
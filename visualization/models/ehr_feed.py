@@ -0,0 +1,240 @@
+#####################################################################################
+# ehr_feed.py                                                                       #
+#                                                                                   #
+# This is the consumer of the EHR feed with the patient records                     #
+#                                                                                   #
+# - asyncio consumer for a feed of newline separated JSON patient records (TCP)     #
+# - Local mock EHR server for demos, only on request (CARDIOVISION_EHR_MOCK=1), its #
+#   patients are tagged and not stored in the repository                            #
+# - Score the incoming patients in micro-batches in a worker thread                 #
+# - Store the patients in the repository and collect alerts for the bell            #
+#                                                                                   #
+# The feed runs in its own thread with its own event loop, started once for all     #
+# sessions. The pages only read the alerts.                                         #
+#####################################################################################
+
+# Import needed libraries
+import os
+import json
+import time
+import glob
+import copy
+import html
+import uuid
+import asyncio
+import threading
+from collections import deque
+import numpy as np
+import streamlit as st
+from visualization.models.model_utils import get_prediction_models, score_patients
+from visualization.models.patient_utils import save_patient, simulation_data_dir
+
+# Address of the EHR feed (host:port), without it there is no feed
+ehr_feed_address = os.environ.get('CARDIOVISION_EHR_FEED')
+
+# Start the mock server as feed if no address is set (CARDIOVISION_EHR_MOCK=1)
+ehr_mock_enabled = os.environ.get('CARDIOVISION_EHR_MOCK') == '1'
+
+# Micro-batches: score when this many records arrived or the oldest record waited this long (seconds)
+feed_batch_size = 16
+feed_batch_timeout = 1.0
+
+# Seconds to wait before reconnecting to the feed
+reconnect_delay = 5.0
+
+# Probability above which a patient raises an alert (same as the risk calculation)
+high_risk_threshold = 0.5
+
+# Number of alerts kept for the bell
+max_alerts = 50
+
+# Seconds between two records of the mock server
+mock_interval = 3.0
+
+# Source of the patients created by the mock server, their ids start with the same prefix
+mock_source = 'ehr-mock'
+
+# Names of the patients created by the mock server
+mock_first_names = ['Anna', 'Ben', 'Clara', 'David', 'Emma', 'Felix', 'Grace', 'Henry', 'Ida', 'Jonas']
+mock_last_names = ['Miller', 'Schmidt', 'Garcia', 'Novak', 'Rossi', 'Berg', 'Larsen', 'Moreau', 'Keller', 'Silva']
+
+
+#####################################################################################
+### Mock EHR server                                                               ###
+#####################################################################################
+
+# Create a random patient record based on the simulated patients, tagged as mock record
+# The id is random, so it does not repeat after a restart of the app
+def create_mock_patient(templates, rng):
+    patient_data = copy.deepcopy(templates[rng.integers(len(templates))])
+    patient_info = patient_data['PatientInfo']
+    patient_info['patient_id'] = f"{mock_source.upper()}-{uuid.uuid4().hex[:12]}"
+    patient_info['source'] = mock_source
+    patient_info['name'] = f"{rng.choice(mock_first_names)} {rng.choice(mock_last_names)}"
+    patient_info['age'] = int(rng.integers(30, 80))
+    patient_data['VitalParameters']['resting_heart_rate'] = float(rng.integers(55, 110))
+    patient_data['VitalParameters']['max_heart_rate'] = float(rng.integers(90, 190))
+    patient_data['LaboratoryValues']['serum_cholesterol'] = float(rng.integers(150, 330))
+    patient_data['LaboratoryValues']['st_depression'] = round(float(rng.uniform(0, 4)), 1)
+    patient_data['SymptomsObservations']['chest_pain_type'] = str(rng.choice(['Typical Angina', 'Atypical Angina', 'Non-Anginal Pain', 'Asymptomatic']))
+    patient_data['SymptomsObservations']['exercise_induced_angina'] = bool(rng.integers(2))
+    return patient_data
+
+# Start the mock EHR server, every client gets a stream of random patient records
+async def start_mock_server(host='127.0.0.1', port=0, interval=mock_interval):
+    templates = []
+    for file_path in sorted(glob.glob(os.path.join(simulation_data_dir, '*.json'))):
+        with open(file_path) as f:
+            templates.append(json.load(f))
+
+    async def handle_client(reader, writer):
+        rng = np.random.default_rng()
+        try:
+            while True:
+                record = create_mock_patient(templates, rng)
+                writer.write(json.dumps(record).encode() + b'\n')
+                await writer.drain()
+                await asyncio.sleep(interval)
+        except (ConnectionError, asyncio.CancelledError):
+            pass
+        finally:
+            writer.close()
+
+    return await asyncio.start_server(handle_client, host, port)
+
+
+#####################################################################################
+### Feed consumer                                                                 ###
+#####################################################################################
+
+class EHRFeed:
+    # Without an address the feed reads from the mock server, its patients are only scored, not stored
+    def __init__(self, preprocessor, model, address=ehr_feed_address):
+        self.preprocessor = preprocessor
+        self.model = model
+        self.address = address
+        self.store_patients = bool(address)
+        self.lock = threading.Lock()
+        self.alerts = deque(maxlen=max_alerts)
+        self.statistics = {'received': 0, 'invalid': 0, 'scored': 0, 'batches': 0, 'alerts': 0, 'connected': False}
+        self.thread = None
+
+    # Start the feed in a background thread with its own event loop
+    def start(self):
+        self.thread = threading.Thread(target=asyncio.run, args=(self.run(),), name='ehr-feed', daemon=True)
+        self.thread.start()
+        return self
+
+    async def run(self):
+        if self.address:
+            host, port = self.address.rsplit(':', 1)
+        else:
+            server = await start_mock_server()
+            host, port = server.sockets[0].getsockname()[:2]
+            print(f"EHR mock server listening on {host}:{port}")
+
+        queue = asyncio.Queue()
+        await asyncio.gather(self.consume(host, int(port), queue), self.score_batches(queue))
+
+    # Read the records from the feed and decode them, reconnect if the connection is lost
+    async def consume(self, host, port, queue):
+        while True:
+            try:
+                reader, writer = await asyncio.open_connection(host, port)
+                self.update_statistics(connected=True)
+                while line := await reader.readline():
+                    try:
+                        await queue.put(json.loads(line))
+                        self.update_statistics(received=1)
+                    except json.JSONDecodeError:
+                        self.update_statistics(invalid=1)
+                writer.close()
+            except OSError as e:
+                print(f"EHR feed connection failed: {e}")
+            self.update_statistics(connected=False)
+            await asyncio.sleep(reconnect_delay)
+
+    # Collect the records into micro-batches and score them in a worker thread
+    async def score_batches(self, queue):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await queue.get()]
+            deadline = loop.time() + feed_batch_timeout
+            while len(batch) < feed_batch_size and (remaining := deadline - loop.time()) > 0:
+                try:
+                    batch.append(await asyncio.wait_for(queue.get(), remaining))
+                except asyncio.TimeoutError:
+                    break
+            try:
+                await loop.run_in_executor(None, self.score_batch, batch)
+            except Exception as e:
+                print(f"EHR feed scoring failed: {e}")
+
+    # Score a batch, store the patients and raise alerts for high risks
+    def score_batch(self, batch):
+        probabilities = score_patients(self.preprocessor, self.model, batch)
+        new_alerts = []
+        for patient_data, probability in zip(batch, probabilities):
+            patient_info = patient_data.get('PatientInfo', {})
+            if not patient_info.get('patient_id'):
+                self.update_statistics(invalid=1)
+                continue
+            if self.store_patients:
+                save_patient(patient_data)
+            if probability > high_risk_threshold:
+                new_alerts.append({
+                    'patient_id': str(patient_info.get('patient_id')),
+                    'name': patient_info.get('name', 'Unknown'),
+                    'probability': float(probability),
+                    'time': time.time(),
+                    'mock': patient_info.get('source') == mock_source,
+                })
+        with self.lock:
+            self.alerts.extend(new_alerts)
+        self.update_statistics(scored=int(np.isfinite(probabilities).sum()), batches=1, alerts=len(new_alerts))
+
+    def update_statistics(self, connected=None, **counts):
+        with self.lock:
+            for key, count in counts.items():
+                self.statistics[key] += count
+            if connected is not None:
+                self.statistics['connected'] = connected
+
+    # Newest alerts first
+    def get_alerts(self):
+        with self.lock:
+            return list(reversed(self.alerts))
+
+    def get_statistics(self):
+        with self.lock:
+            return dict(self.statistics)
+
+
+#####################################################################################
+### Shared feed and the notification bell                                         ###
+#####################################################################################
+
+# One feed for all sessions, started with the app
+# None if no EHR address is configured and the mock server was not requested
+@st.cache_resource
+def get_ehr_feed():
+    if not ehr_feed_address and not ehr_mock_enabled:
+        return None
+    preprocessor, model, _ = get_prediction_models()
+    return EHRFeed(preprocessor, model).start()
+
+# HTML of the bell in the page headers with the number of alerts, the latest alerts are shown as tooltip
+def notification_bell_html(feed=None):
+    alerts = feed.get_alerts() if feed is not None else []
+    if not alerts:
+        return '<span class="notification-bell" title="Notifications" style="font-size: 15px; margin-right: 5px;">🔔</span>'
+
+    tooltip = "&#10;".join(
+        f"{time.strftime('%H:%M', time.localtime(alert['time']))} {'[Mock] ' if alert.get('mock') else ''}{html.escape(alert['name'])} ({html.escape(alert['patient_id'])}): {alert['probability']:.0%} risk"
+        for alert in alerts[:10]
+    )
+    return f"""
+        <span class="notification-bell" title="High risk patients:&#10;{tooltip}" style="font-size: 15px; margin-right: 5px; position: relative;">
+            🔔<span style="position: absolute; top: -6px; right: -10px; background-color: red; color: white; border-radius: 10px; padding: 0 5px; font-size: 10px;">{len(alerts)}</span>
+        </span>
+    """
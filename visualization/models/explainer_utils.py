@@ -0,0 +1,152 @@
+#####################################################################################
+# explainer_utils.py                                                                #
+#                                                                                   #
+# This is the dispatcher of the SHAP explainers by model family                     #
+#                                                                                   #
+# - Linear models: exact closed-form SHAP values (log-odds / decision function)     #
+# - Tree ensembles: shap.TreeExplainer                                              #
+# - Dense ReLU/sigmoid networks (Keras): DeepLIFT in NumPy (see deeplift_utils)     #
+# - Other neural networks (Keras): shap.DeepExplainer                               #
+# - All other models: sampled shap.KernelExplainer with a fixed budget              #
+# - Measure the latency of every explanation per explainer                          #
+#####################################################################################
+
+# Import needed libraries
+import time
+import threading
+from collections import deque
+import numpy as np
+import tensorflow as tf
+import shap
+from visualization.models.deeplift_utils import get_dense_layers, deeplift_shap_values
+
+# Budget of the KernelExplainer: background rows (k-means summary) and model evaluations per patient
+kernel_background_size = 20
+kernel_nsamples = 200
+
+# Number of latencies kept per explainer
+latency_history = 200
+
+# Measured latencies per explainer: (seconds, number of explained patients)
+explainer_latencies = {}
+latency_lock = threading.Lock()
+
+
+#####################################################################################
+### Model families                                                                ###
+#####################################################################################
+
+# Family of the model that decides which explainer is used
+def get_model_family(model):
+    if isinstance(model, tf.keras.Model):
+        return 'deeplift' if get_dense_layers(model) is not None else 'deep'
+    # Linear models have one coefficient per feature (coef_ raises an error for kernel SVMs)
+    if hasattr(model, 'coef_') and hasattr(model, 'intercept_') and np.ndim(model.coef_) <= 2 and np.shape(model.coef_)[0] == 1:
+        return 'linear'
+    if hasattr(model, 'tree_') or hasattr(model, 'estimators_') or type(model).__module__.split('.')[0] in ('xgboost', 'lightgbm', 'catboost'):
+        return 'tree'
+    return 'kernel'
+
+# Output of the model for the positive class that is explained by the KernelExplainer
+def get_positive_output(model):
+    if hasattr(model, 'predict_proba'):
+        return lambda data: model.predict_proba(data)[:, 1]
+    if hasattr(model, 'decision_function'):
+        return model.decision_function
+    return model.predict
+
+# Reduce the explainer output to one row of SHAP values per patient and one expected value (positive class)
+def select_positive_class(shap_values, expected_value, rows):
+    if isinstance(shap_values, list):
+        shap_values = shap_values[-1]
+    shap_values = np.asarray(shap_values)
+    if shap_values.ndim == 3:
+        shap_values = shap_values[..., -1]
+    expected_value = expected_value.numpy() if isinstance(expected_value, tf.Tensor) else expected_value
+    return shap_values.reshape(rows, -1), float(np.ravel(expected_value)[-1])
+
+
+#####################################################################################
+### Explainers                                                                    ###
+#####################################################################################
+
+# Exact SHAP values of a linear model with independent features: coefficient times the distance to the background mean
+def explain_linear(model, data, background):
+    coefficients = np.ravel(model.coef_)
+    background_mean = background.mean(axis=0)
+    shap_values = (data - background_mean) * coefficients
+    expected_value = float(np.ravel(model.intercept_)[0] + background_mean @ coefficients)
+    return shap_values, expected_value
+
+def explain_tree(model, data, background):
+    explainer = shap.TreeExplainer(model)
+    return select_positive_class(explainer.shap_values(data), explainer.expected_value, len(data))
+
+# Same rescale rule as the DeepExplainer, but only NumPy matrix products
+def explain_deeplift(model, data, background):
+    return deeplift_shap_values(get_dense_layers(model), data, background)
+
+def explain_deep(model, data, background):
+    explainer = shap.DeepExplainer(model, background)
+    return select_positive_class(explainer.shap_values(data, check_additivity=False), explainer.expected_value, len(data))
+
+# Sampled KernelExplainer, the background is summarized and the number of model evaluations is limited
+def explain_kernel(model, data, background):
+    background_summary = shap.kmeans(background, min(kernel_background_size, len(background)))
+    explainer = shap.KernelExplainer(get_positive_output(model), background_summary)
+    shap_values = explainer.shap_values(data, nsamples=kernel_nsamples, silent=True)
+    return select_positive_class(shap_values, explainer.expected_value, len(data))
+
+explainers = {
+    'linear': explain_linear,
+    'tree': explain_tree,
+    'deeplift': explain_deeplift,
+    'deep': explain_deep,
+    'kernel': explain_kernel,
+}
+
+
+#####################################################################################
+### Dispatch and latency                                                          ###
+#####################################################################################
+
+# SHAP values of the preprocessed patients (N x features) and the expected value with the explainer of the model family
+# Models that the TreeExplainer does not support (e.g. AdaBoost or voting ensembles) fall back to the KernelExplainer
+# Returns the SHAP values, the expected value and the used explainer
+def explain_model(model, data, background):
+    data = np.asarray(data, dtype=np.float32)
+    background = np.asarray(background, dtype=np.float32)
+    family = get_model_family(model)
+
+    start = time.perf_counter()
+    try:
+        shap_values, expected_value = explainers[family](model, data, background)
+    except Exception as e:
+        if family != 'tree':
+            raise
+        print(f"TreeExplainer does not support {type(model).__name__}, using the KernelExplainer: {e}")
+        family = 'kernel'
+        start = time.perf_counter()
+        shap_values, expected_value = explain_kernel(model, data, background)
+    record_latency(family, time.perf_counter() - start, len(data))
+    return shap_values, expected_value, family
+
+def record_latency(family, seconds, rows):
+    with latency_lock:
+        explainer_latencies.setdefault(family, deque(maxlen=latency_history)).append((seconds, rows))
+
+# Latency statistics per explainer (milliseconds per call and per patient)
+def get_explainer_statistics():
+    with latency_lock:
+        latencies = {family: list(history) for family, history in explainer_latencies.items()}
+    statistics = {}
+    for family, history in latencies.items():
+        seconds = np.array([latency for latency, _ in history])
+        rows = np.array([row_count for _, row_count in history])
+        statistics[family] = {
+            'calls': len(history),
+            'mean_ms': float(seconds.mean() * 1000),
+            'p95_ms': float(np.percentile(seconds, 95) * 1000),
+            'ms_per_patient': float(seconds.sum() / max(rows.sum(), 1) * 1000),
+        }
+    return statistics
@@ -0,0 +1,68 @@
+#####################################################################################
+# explanation_utils.py                                                              #
+#                                                                                   #
+# This is the background worker for the explanation of a risk calculation           #
+#                                                                                   #
+# - Calculate the SHAP values (or take them from the risk log)                      #
+# - Render the SHAP waterfall plot in its own worker process (pyplot is not safe in #
+#   the app threads, the export pool can be busy with a bulk export)                #
+# - Write the interpretation text                                                   #
+#                                                                                   #
+# The risk is shown as soon as the prediction is done, the explanation is filled    #
+# in by the page when the worker has finished. The worker has no session state,     #
+# everything it needs is passed to it.                                              #
+#####################################################################################
+
+# Import needed libraries
+import multiprocessing
+from io import BytesIO
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+import numpy as np
+import streamlit as st
+from visualization.models.model_utils import explain_patients, interpret_shap_values
+from visualization.models.report_export import render_waterfall
+
+# Number of explanations that are calculated at the same time
+explanation_workers = 2
+
+# Worker processes that render the waterfall plots of the risk page
+render_workers = 1
+
+
+# Executor for the explanations, shared by all sessions
+@st.cache_resource
+def get_explanation_executor():
+    return ThreadPoolExecutor(max_workers=explanation_workers, thread_name_prefix='risk-explanation')
+
+# Pool of the render processes, started fresh (no fork of the app) and warmed up with one plot,
+# so the first explanation does not wait for the start of the process
+@st.cache_resource
+def get_render_pool():
+    pool = ProcessPoolExecutor(max_workers=render_workers, mp_context=multiprocessing.get_context('spawn'))
+    pool.submit(render_waterfall, [0.0], 0.0, ['warm-up'])
+    return pool
+
+# Explanation of one patient: SHAP values, waterfall plot and interpretation text
+# Without shap_values they are calculated and passed to on_explained (e.g. to log them)
+def explain_risk(model, processed_data, df, probability, flat_data, feature_names, render_pool, shap_values=None, expected_value=None, on_explained=None):
+    if shap_values is None:
+        shap_values, expected_value = explain_patients(model, processed_data, df)
+        if on_explained is not None:
+            on_explained(shap_values[0], expected_value)
+
+    # One row of SHAP values for the patient
+    shap_values_patient = np.asarray(shap_values, dtype=np.float32).reshape(1, -1)
+    shap_image = render_pool.submit(render_waterfall, shap_values_patient[0], expected_value, feature_names)
+    interpretation_text = interpret_shap_values(shap_values_patient, feature_names, probability, flat_data)
+    return {
+        'shap_values_patient': shap_values_patient,
+        'expected_value': expected_value,
+        'feature_names': feature_names,
+        'shap_image': BytesIO(shap_image.result()),
+        'interpretation_text': interpretation_text,
+    }
+
+# Start the explanation in the background, returns the future of the explanation
+# The process pool is looked up here, the explanation thread has no Streamlit context
+def submit_explanation(model, processed_data, df, probability, flat_data, feature_names, **kwargs):
+    return get_explanation_executor().submit(explain_risk, model, processed_data, df, probability, flat_data, feature_names, get_render_pool(), **kwargs)
@@ -0,0 +1,30 @@
+#####################################################################################
+# figure_cache.py                                                                   #
+#                                                                                   #
+# This is the cache for the plotly figures shared between all sessions              #
+#                                                                                   #
+# - Store figures as serialized JSON, keyed by plot id, filter and dataset version  #
+# - Evict the least recently used figures above a size limit                        #
+# - Build each figure only once, even if many sessions request it at the same time  #
+#   (see cache_utils)                                                               #
+#####################################################################################
+
+# Import needed libraries
+import streamlit as st
+import plotly.io as pio
+from visualization.models.cache_utils import SharedCache
+
+# Maximum size of all cached figures (serialized JSON)
+figure_cache_max_bytes = 64 * 1024 * 1024
+
+
+# One cache instance for all sessions
+@st.cache_resource
+def get_figure_cache():
+    return SharedCache(figure_cache_max_bytes)
+
+# Get a figure from the shared cache, the key must contain everything the figure depends on
+# (plot id, filter, selected features and dataset version)
+def get_cached_figure(key, plot_function, *args):
+    figure_json = get_figure_cache().get_or_build(key, lambda: plot_function(*args).to_json())
+    return pio.from_json(figure_json)
@@ -0,0 +1,159 @@
+#####################################################################################
+# inference_utils.py                                                                #
+#                                                                                   #
+# This is the executor for all calls of the prediction model                        #
+#                                                                                   #
+# - One prediction thread per model owns its predictions, requests are queued       #
+# - SHAP explanations are queued on a second thread per model, a long explanation   #
+#   (e.g. KernelExplainer) does not hold up the predictions of the other sessions   #
+# - TensorFlow thread pools with configurable sizes (intra- and inter-op)           #
+# - Queue depth, waiting time and service time of the requests                      #
+# - Predictions on the risk scale (0 to 1) for Keras and scikit-learn models        #
+#                                                                                   #
+# Streamlit runs each session in its own thread, without the executor all of them   #
+# would call the shared TensorFlow model at the same time. With the executor, at    #
+# most one prediction and one explanation use a model at a time.                    #
+#####################################################################################
+
+# Import needed libraries
+import os
+import time
+import queue
+import threading
+from collections import deque
+from concurrent.futures import Future
+import numpy as np
+import tensorflow as tf
+
+# Threads of TensorFlow within one operation and for independent operations
+# (set with CARDIOVISION_INTRA_OP_THREADS and CARDIOVISION_INTER_OP_THREADS)
+inference_intra_op_threads = int(os.environ.get('CARDIOVISION_INTRA_OP_THREADS', max(1, min(4, os.cpu_count() or 1))))
+inference_inter_op_threads = int(os.environ.get('CARDIOVISION_INTER_OP_THREADS', 1))
+
+# Number of requests kept for the service time statistics
+service_time_history = 200
+
+# Workers of each model: predictions and explanations are queued separately
+inference_workers = ['predict', 'explain']
+
+# One executor per model and worker, the models are loaded once for all sessions
+inference_executors = {}
+executors_lock = threading.Lock()
+
+
+# Size the TensorFlow thread pools, only possible before TensorFlow has run its first operation
+def configure_tensorflow_threads(intra_op_threads=inference_intra_op_threads, inter_op_threads=inference_inter_op_threads):
+    try:
+        tf.config.threading.set_intra_op_parallelism_threads(intra_op_threads)
+        tf.config.threading.set_inter_op_parallelism_threads(inter_op_threads)
+    except RuntimeError as e:
+        print(f"TensorFlow threads could not be configured: {e}")
+
+configure_tensorflow_threads()
+
+
+#####################################################################################
+### Executor                                                                      ###
+#####################################################################################
+
+class InferenceExecutor:
+    def __init__(self, model, worker='predict'):
+        self.model = model
+        self.worker = worker
+        self.queue = queue.Queue()
+        self.lock = threading.Lock()
+        self.max_queue_depth = 0
+        self.requests = 0
+        self.failed = 0
+        # (waiting seconds, service seconds) of the latest requests
+        self.timings = deque(maxlen=service_time_history)
+        self.thread = threading.Thread(target=self.run, name=f'model-{worker}', daemon=True)
+        self.thread.start()
+
+    # Queue a call of function(model, *args), returns a future of its result
+    def submit(self, function, *args):
+        future = Future()
+        # A request from the thread of the executor itself would wait for itself
+        if threading.current_thread() is self.thread:
+            self.serve(future, function, args)
+            return future
+        self.queue.put((future, function, args, time.perf_counter()))
+        with self.lock:
+            self.max_queue_depth = max(self.max_queue_depth, self.queue.qsize())
+        return future
+
+    # Serve the requests one after the other
+    def run(self):
+        while True:
+            future, function, args, queued_at = self.queue.get()
+            if not future.set_running_or_notify_cancel():
+                continue
+            started_at = time.perf_counter()
+            succeeded = self.serve(future, function, args)
+            with self.lock:
+                self.requests += 1
+                self.failed += not succeeded
+                self.timings.append((started_at - queued_at, time.perf_counter() - started_at))
+
+    def serve(self, future, function, args):
+        try:
+            future.set_result(function(self.model, *args))
+            return True
+        except Exception as e:
+            future.set_exception(e)
+            return False
+
+    # Queue depth, waiting time and service time of the requests (milliseconds)
+    def get_statistics(self):
+        with self.lock:
+            timings = np.array(self.timings).reshape(-1, 2) * 1000
+            statistics = {'requests': self.requests, 'failed': self.failed, 'queued': self.queue.qsize(), 'max_queued': self.max_queue_depth}
+        if len(timings):
+            statistics.update({
+                'mean_wait_ms': float(timings[:, 0].mean()),
+                'p95_wait_ms': float(np.percentile(timings[:, 0], 95)),
+                'mean_service_ms': float(timings[:, 1].mean()),
+                'p95_service_ms': float(np.percentile(timings[:, 1], 95)),
+            })
+        return statistics
+
+
+#####################################################################################
+### Run model calls                                                               ###
+#####################################################################################
+
+# Executor of the worker of the model, it is started with the first request
+def get_inference_executor(model, worker='predict'):
+    if worker not in inference_workers:
+        raise ValueError(f"Unknown inference worker: {worker}")
+    with executors_lock:
+        executor = inference_executors.get((id(model), worker))
+        if executor is None or executor.model is not model:
+            executor = inference_executors[(id(model), worker)] = InferenceExecutor(model, worker)
+        return executor
+
+# Run function(model, *args) on the thread of the worker of the model and wait for the result
+def run_inference(model, function, *args, worker='predict'):
+    return get_inference_executor(model, worker).submit(function, *args).result()
+
+# Predicted risk of the model between 0 and 1 (Keras without the progress bar)
+# scikit-learn classifiers give the probability of the positive class instead of the label,
+# classifiers without probabilities (e.g. SVC) their decision function through the sigmoid
+def predict_model(model, data):
+    if isinstance(model, tf.keras.Model):
+        return model.predict(data, verbose=0)
+    if hasattr(model, 'predict_proba'):
+        return model.predict_proba(data)[:, 1]
+    if hasattr(model, 'decision_function'):
+        return 1 / (1 + np.exp(-model.decision_function(data)))
+    return model.predict(data)
+
+# Predict on the prediction thread of the model
+def predict(model, data):
+    return run_inference(model, predict_model, data)
+
+# Statistics of the executors of all models, by model class and worker
+def get_inference_statistics():
+    with executors_lock:
+        executors = list(inference_executors.values())
+    return {f"{type(executor.model).__name__} ({executor.worker})": executor.get_statistics() for executor in executors}
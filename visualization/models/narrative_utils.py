@@ -0,0 +1,142 @@
+#####################################################################################
+# narrative_utils.py                                                                #
+#                                                                                   #
+# This is the narrative engine for the human readable explanation of SHAP values    #
+#                                                                                   #
+# - Map the encoded model features back to the raw patient features                 #
+# - Describe the raw values of the features with name and unit                      #
+# - Write the explanations of N patients at once from an N x features SHAP matrix   #
+#                                                                                   #
+# Thresholds, sorting and text assembly are array operations over all patients.     #
+# The module does not use Streamlit, so it also works in background workers.        #
+#####################################################################################
+
+# Import needed libraries
+import re
+import numpy as np
+import pandas as pd
+
+# Dictionary to map original feature names to more understandable names
+feature_name_mapping = {
+    'age': 'Age',
+    'gender': 'Gender',
+    'chest_pain_type': 'Chest Pain Type',
+    'family_history_cad': 'Family History of CAD',
+    'resting_heart_rate': 'Resting Heart Rate',
+    'max_heart_rate': 'Maximum Heart Rate',
+    'has_hypertension': 'Has Hypertension',
+    'exercise_induced_angina': 'Exercise-Induced Angina',
+    'serum_cholesterol': 'Serum Cholesterol',
+    'high_fasting_blood_sugar': 'High Fasting Blood Sugar',
+    'st_depression': 'ST Depression',
+    'cigarettes_per_day': 'Cigarettes per Day',
+    'years_smoking': 'Years of Smoking',
+    'resting_ecg_results': 'Resting ECG Results',
+}
+
+# Dictionary for feature units
+feature_units = {
+    'age': 'years',
+    'resting_heart_rate': 'bpm',
+    'max_heart_rate': 'bpm',
+    'serum_cholesterol': 'mg/dL',
+    'st_depression': 'mm',
+    'cigarettes_per_day': 'cigarettes/day',
+    'years_smoking': 'years'
+}
+
+# Raw features that are one-hot encoded, with the name used in the explanation
+categorical_feature_names = {
+    'gender': 'Gender',
+    'chest_pain_type': 'Chest Pain Type',
+    'resting_ecg_results': 'ECG Result',
+}
+
+# Prefixes of the one-hot columns in the machine learning data (the preprocessor uses the raw feature name)
+one_hot_prefixes = {
+    'gender_': 'gender',
+    'cp_': 'chest_pain_type',
+    'ecg_': 'resting_ecg_results',
+}
+
+# Absolute SHAP value from which a feature is mentioned in the explanation
+shap_threshold = 0.05
+
+# Probability above which the explanation is written for a high risk
+high_risk_threshold = 0.5
+
+# Text blocks of the explanation
+high_risk_intro = "According to the input data, the features that raise the risk are more than those that reduce the risk.\n\n"
+low_risk_intro = "According to the input data, the features that reduce the risk are more than those that raise the risk.\n\n"
+no_increase_text = "- No patient data increased the risk significantly.\n"
+no_reduction_text = "- No patient data reduced the risk significantly.\n"
+
+
+#####################################################################################
+### Feature descriptions                                                          ###
+#####################################################################################
+
+# Raw patient feature of an encoded model feature, e.g. 'cat__chest_pain_type_Asymptomatic' or 'cp_Asymptomatic'
+def get_source_feature(feature):
+    feature = re.sub(r'^(num|cat|bin)__', '', feature)
+    if feature in feature_name_mapping:
+        return feature
+    for raw_feature in categorical_feature_names:
+        if feature.startswith(raw_feature + '_'):
+            return raw_feature
+    for prefix, raw_feature in one_hot_prefixes.items():
+        if feature.startswith(prefix):
+            return raw_feature
+    return feature
+
+# Descriptions of all features for all patients (N x features), e.g. "The Age was 63 years"
+def describe_features(raw_values, feature_names):
+    raw_values = pd.DataFrame(raw_values, dtype=object)
+    descriptions = []
+    for feature in feature_names:
+        source_feature = get_source_feature(feature)
+        values = raw_values[source_feature].astype(str) if source_feature in raw_values else pd.Series("Unknown", index=raw_values.index)
+        if source_feature in categorical_feature_names:
+            descriptions.append("The " + categorical_feature_names[source_feature] + " was " + values)
+        else:
+            unit = feature_units.get(source_feature, "")
+            descriptions.append(("The " + feature_name_mapping.get(source_feature, source_feature) + " was " + values + " " + unit).str.strip())
+    return np.column_stack([description.to_numpy(dtype=object) for description in descriptions])
+
+
+#####################################################################################
+### Explanations                                                                  ###
+#####################################################################################
+
+# Markdown list of the features selected by the mask, in the given order (one string per patient)
+def join_feature_lines(descriptions, mask, order):
+    lines = np.where(mask, "  - **" + descriptions + "**\n", "")
+    lines = np.take_along_axis(lines, order, axis=1)
+    return lines.sum(axis=1) if lines.shape[1] else np.full(len(lines), "", dtype=object)
+
+# Explanations of N patients: SHAP matrix (N x features), predicted probabilities (N) and raw values
+# (N rows of the flattened patient data), returns one markdown text per patient
+def build_narratives(shap_matrix, probabilities, raw_values, feature_names):
+    shap_matrix = np.asarray(shap_matrix, dtype=np.float64).reshape(len(probabilities), len(feature_names))
+    high_risk = np.asarray(probabilities, dtype=np.float64).ravel() > high_risk_threshold
+    descriptions = describe_features(raw_values, feature_names)
+
+    # Increasing features sorted by the largest, reducing features by the smallest SHAP value (stable as the original)
+    increasing = shap_matrix > shap_threshold
+    reducing = shap_matrix < -shap_threshold
+    increasing_lines = join_feature_lines(descriptions, increasing, np.argsort(-shap_matrix, axis=1, kind='stable'))
+    reducing_lines = join_feature_lines(descriptions, reducing, np.argsort(shap_matrix, axis=1, kind='stable'))
+    has_increasing = increasing.any(axis=1)
+    has_reducing = reducing.any(axis=1)
+
+    high_risk_text = (
+        high_risk_intro
+        + np.where(has_increasing, "- These features **increased the risk**:\n" + increasing_lines, no_increase_text)
+        + np.where(has_reducing, "\n- These features **reduced the risk**, but they were not sufficient to lower it to a low risk:\n" + reducing_lines, no_reduction_text)
+    )
+    low_risk_text = (
+        low_risk_intro
+        + np.where(has_reducing, "- These features **reduced the risk** for a heart attack:\n" + reducing_lines, no_reduction_text)
+        + np.where(has_increasing, "\n- These features **increased the risk**, but they did not raise it to a high-risk level:\n" + increasing_lines, no_increase_text)
+    )
+    return np.where(high_risk, high_risk_text, low_risk_text).tolist()
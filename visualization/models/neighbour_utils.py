@@ -0,0 +1,76 @@
+#####################################################################################
+# neighbour_utils.py                                                                #
+#                                                                                   #
+# This is a helper function collection for finding similar patients                #
+#                                                                                   #
+# - Build a KD-tree over the training patients in the standardized feature space    #
+#   (the space of standardizer.pkl, as stored in the machine learning data)         #
+# - Persist the index per dataset version, so it is only built once                 #
+# - Find the k most similar training patients of a new patient                      #
+#####################################################################################
+
+# Import needed libraries
+import os
+import joblib
+import numpy as np
+import streamlit as st
+from sklearn.neighbors import KDTree
+
+# Folder of the persisted indexes, one file per dataset version
+neighbour_index_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), '.neighbour_index')
+
+# Target column of the machine learning data, it is not part of the feature space
+target_column = 'Has_heart_disease'
+
+# Number of similar patients shown on the risk calculation page
+similar_patients_count = 5
+
+# Number of points per leaf of the KD-tree
+leaf_size = 40
+
+
+#####################################################################################
+### Build, persist and query the index                                            ###
+#####################################################################################
+
+# Build the KD-tree over the training patients together with their diagnoses
+# The columns of the machine learning data are in the output order of the preprocessor
+def build_neighbour_index(df):
+    X = df.drop(columns=[target_column]).to_numpy(dtype=np.float64)
+    return {
+        'tree': KDTree(X, leaf_size=leaf_size),
+        'diagnosis': df[target_column].to_numpy(dtype=bool),
+    }
+
+# Load the index of the dataset version from disk, build and save it if it does not exist yet
+def load_or_build_neighbour_index(df, dataset_version, index_dir=neighbour_index_dir):
+    index_path = os.path.join(index_dir, f'{dataset_version}.joblib')
+    if os.path.exists(index_path):
+        try:
+            return joblib.load(index_path)
+        except Exception as e:
+            print(f"Neighbour index {index_path} could not be loaded, rebuilding it: {e}")
+
+    neighbour_index = build_neighbour_index(df)
+    os.makedirs(index_dir, exist_ok=True)
+    # Write to a temporary file first, so other processes never read a half written index
+    temp_path = f'{index_path}.{os.getpid()}.tmp'
+    joblib.dump(neighbour_index, temp_path)
+    os.replace(temp_path, index_path)
+    return neighbour_index
+
+# Find the k most similar training patients, returns their row positions, distances and diagnoses
+def find_similar_patients(neighbour_index, patient_vector, k=similar_patients_count):
+    patient_vector = np.asarray(patient_vector, dtype=np.float64).reshape(1, -1)
+    distances, positions = neighbour_index['tree'].query(patient_vector, k=k)
+    return positions[0], distances[0], neighbour_index['diagnosis'][positions[0]]
+
+
+#####################################################################################
+### Cached layer shared between sessions                                          ###
+#####################################################################################
+
+# The data itself is not hashed, the dataset version identifies it
+@st.cache_resource(max_entries=2)
+def get_neighbour_index(_df, dataset_version):
+    return load_or_build_neighbour_index(_df, dataset_version)
@@ -0,0 +1,159 @@
+#####################################################################################
+# patient_utils.py                                                                  #
+#                                                                                   #
+# This is the repository of the patient records (SQLite, see database_utils)        #
+#                                                                                   #
+# - Store the patient JSON documents with indexes on id, name and last update       #
+# - Paginated, searchable listing that only reads the indexed columns               #
+# - Search by the beginning of the full name, of any name part (e.g. last name)     #
+#   or of the id                                                                    #
+# - Load the full record of a single patient on demand                              #
+# - Import the simulated patients of Patient_Simulation_Data if they are missing    #
+#####################################################################################
+
+# Import needed libraries
+import os
+import glob
+import json
+import time
+from visualization.models.database_utils import connect, ensure_schema, database_path, repository_dir
+
+# Folder with the simulated EHR patients that are imported into an empty repository
+simulation_data_dir = os.path.join(repository_dir, 'Patient_Simulation_Data')
+
+# Number of patients per page of the listing
+patients_page_size = 20
+
+# Databases into which the simulated patients were already imported in this process
+imported_simulations = set()
+
+# Databases whose name parts were already indexed in this process
+indexed_name_parts = set()
+
+# The name and its parts are stored in lower case for the case-insensitive prefix search
+patients_schema = [
+    """CREATE TABLE IF NOT EXISTS patients (
+        patient_id TEXT PRIMARY KEY,
+        name TEXT NOT NULL,
+        name_search TEXT NOT NULL,
+        updated_at INTEGER NOT NULL,
+        document TEXT NOT NULL
+    )""",
+    "CREATE INDEX IF NOT EXISTS patients_name ON patients (name_search)",
+    "CREATE INDEX IF NOT EXISTS patients_updated_at ON patients (updated_at)",
+    """CREATE TABLE IF NOT EXISTS patient_name_parts (
+        name_part TEXT NOT NULL,
+        patient_id TEXT NOT NULL,
+        PRIMARY KEY (name_part, patient_id)
+    ) WITHOUT ROWID""",
+]
+
+
+#####################################################################################
+### Store and load patients                                                       ###
+#####################################################################################
+
+# Parts of a name for the search, e.g. "Jose M. Krueger" -> ['jose', 'm.', 'krueger']
+def get_name_parts(name):
+    return sorted(set(name.lower().split()))
+
+# Replace the indexed name parts of a patient (inside the transaction of the caller)
+def write_name_parts(connection, patient_id, name):
+    connection.execute("DELETE FROM patient_name_parts WHERE patient_id = ?", (patient_id,))
+    connection.executemany(
+        "INSERT INTO patient_name_parts VALUES (?, ?)",
+        [(name_part, patient_id) for name_part in get_name_parts(name)],
+    )
+
+# Save the record of a patient, an existing record with the same id is replaced
+def save_patient(patient_data, db_path=database_path):
+    ensure_schema('patients', patients_schema, db_path)
+    patient_info = patient_data.get('PatientInfo', {})
+    patient_id = str(patient_info.get('patient_id', ''))
+    if not patient_id:
+        raise ValueError("The patient record has no patient_id")
+    name = patient_info.get('name', '')
+
+    connection = connect(db_path)
+    try:
+        with connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO patients VALUES (?, ?, ?, ?, ?)",
+                (patient_id, name, name.lower(), time.time_ns(), json.dumps(patient_data)),
+            )
+            write_name_parts(connection, patient_id, name)
+    finally:
+        connection.close()
+    return patient_id
+
+# Load the full record of a patient, None if the patient does not exist
+def load_patient(patient_id, db_path=database_path):
+    ensure_schema('patients', patients_schema, db_path)
+    connection = connect(db_path)
+    try:
+        row = connection.execute("SELECT document FROM patients WHERE patient_id = ?", (str(patient_id),)).fetchone()
+    finally:
+        connection.close()
+    return json.loads(row[0]) if row else None
+
+# Search the patients by the beginning of the name, of a name part or of the id, returns one page of
+# (patient_id, name, updated_at) and the total number of matches, the newest updates come first
+def search_patients(search_text='', page=0, page_size=patients_page_size, db_path=database_path):
+    ensure_schema('patients', patients_schema, db_path)
+    ensure_name_parts(db_path)
+    ensure_simulated_patients(db_path)
+
+    # Prefix search as range on the indexed columns, e.g. "kr" matches "kr" <= name < "ks"
+    prefix = search_text.strip().lower()
+    if prefix:
+        upper = prefix[:-1] + chr(ord(prefix[-1]) + 1)
+        condition = """(name_search >= ? AND name_search < ?) OR (patient_id >= ? AND patient_id < ?)
+            OR patient_id IN (SELECT patient_id FROM patient_name_parts WHERE name_part >= ? AND name_part < ?)"""
+        parameters = (prefix, upper, prefix, upper, prefix, upper)
+    else:
+        condition = "1"
+        parameters = ()
+
+    connection = connect(db_path)
+    try:
+        total = connection.execute(f"SELECT COUNT(*) FROM patients WHERE {condition}", parameters).fetchone()[0]
+        rows = connection.execute(
+            f"""SELECT patient_id, name, updated_at FROM patients WHERE {condition}
+                ORDER BY updated_at DESC LIMIT ? OFFSET ?""",
+            (*parameters, page_size, page * page_size),
+        ).fetchall()
+    finally:
+        connection.close()
+    return rows, total
+
+# Index the name parts of patients that were stored before the name parts were indexed (once per process)
+def ensure_name_parts(db_path=database_path):
+    if db_path in indexed_name_parts:
+        return
+    connection = connect(db_path)
+    try:
+        with connection:
+            rows = connection.execute(
+                "SELECT patient_id, name FROM patients WHERE patient_id NOT IN (SELECT patient_id FROM patient_name_parts)"
+            ).fetchall()
+            for patient_id, name in rows:
+                write_name_parts(connection, patient_id, name)
+    finally:
+        connection.close()
+    indexed_name_parts.add(db_path)
+
+
+#####################################################################################
+### Import the simulated patients                                                 ###
+#####################################################################################
+
+# Import the simulated EHR patients that are not in the repository yet (once per process)
+def ensure_simulated_patients(db_path=database_path, source_dir=simulation_data_dir):
+    if db_path in imported_simulations:
+        return
+    for file_path in sorted(glob.glob(os.path.join(source_dir, '*.json'))):
+        with open(file_path) as f:
+            patient_data = json.load(f)
+        if load_patient(patient_data['PatientInfo']['patient_id'], db_path) is None:
+            save_patient(patient_data, db_path)
+    imported_simulations.add(db_path)
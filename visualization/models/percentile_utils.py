@@ -0,0 +1,94 @@
+#####################################################################################
+# percentile_utils.py                                                               #
+#                                                                                   #
+# This is a helper function collection for ranking patient values in the cohort    #
+#                                                                                   #
+# - Sorted value arrays per feature and stratum (gender, age group), built once     #
+# - Percentile lookups with binary search instead of scanning the cohort            #
+# - Percentile of the predicted risk among all scored training patients            #
+#####################################################################################
+
+# Import needed libraries
+import numpy as np
+import streamlit as st
+from visualization.models.cohort_utils import age_group_bins, age_group_labels, get_cohort_derived_columns
+from visualization.models.inference_utils import predict
+
+# Features of the patient tiles that are ranked in the cohort
+percentile_features = ['resting_heart_rate', 'max_heart_rate', 'serum_cholesterol', 'cigarettes_per_day', 'st_depression']
+
+# Strata with fewer patients are not used, the next wider stratum is used instead
+min_stratum_size = 10
+
+# Target column of the machine learning data
+target_column = 'Has_heart_disease'
+
+
+#####################################################################################
+### Build the sorted arrays and look up percentiles                               ###
+#####################################################################################
+
+# Sort the values of each feature for the whole cohort, per gender and per gender and age group
+# The keys of the strata are (gender, age group), None stands for all values of that dimension
+def build_percentile_index(df, derived_columns, features=percentile_features):
+    strata = df[['gender']].assign(age_group=derived_columns['age_group'])
+    percentile_index = {}
+    for feature in features:
+        values = df[feature].to_numpy(dtype=float)
+        sorted_values = {(None, None): np.sort(values)}
+        for gender, positions in strata.groupby('gender', observed=True).indices.items():
+            sorted_values[(gender, None)] = np.sort(values[positions])
+        for (gender, age_group), positions in strata.groupby(['gender', 'age_group'], observed=True).indices.items():
+            sorted_values[(gender, age_group)] = np.sort(values[positions])
+        percentile_index[feature] = sorted_values
+    return percentile_index
+
+# Percentile rank of a value in a sorted array (ties count half, like scipy.stats.percentileofscore 'mean')
+def percentile_of(sorted_values, value):
+    below = np.searchsorted(sorted_values, value, side='left')
+    below_or_equal = np.searchsorted(sorted_values, value, side='right')
+    return 100 * (below + below_or_equal) / (2 * len(sorted_values))
+
+# Assign the age group to a single age (same bins as cohort_utils.get_age_groups)
+def get_age_group(age):
+    position = np.searchsorted(age_group_bins, age, side='right') - 1
+    return age_group_labels[min(max(position, 0), len(age_group_labels) - 1)]
+
+# Percentile of a value in the narrowest stratum with enough patients, returns the percentile and the stratum
+def get_percentile(percentile_index, feature, value, gender=None, age=None):
+    sorted_values = percentile_index[feature]
+    age_group = get_age_group(age) if age is not None else None
+    for stratum in [(gender, age_group), (gender, None), (None, None)]:
+        if stratum in sorted_values and len(sorted_values[stratum]) >= min_stratum_size:
+            return percentile_of(sorted_values[stratum], value), stratum
+    return None, None
+
+# Describe a stratum in words, e.g. "males 60-70"
+def describe_stratum(stratum):
+    gender, age_group = stratum
+    if gender is None:
+        return "all patients"
+    group = "males" if gender == "Male" else "females"
+    return f"{group} {age_group}" if age_group is not None else group
+
+# Format a percentile as ordinal, e.g. "87th percentile"
+def format_percentile(percentile):
+    rounded = int(round(percentile))
+    suffix = 'th' if 10 <= rounded % 100 <= 20 else {1: 'st', 2: 'nd', 3: 'rd'}.get(rounded % 10, 'th')
+    return f"{rounded}{suffix} percentile"
+
+
+#####################################################################################
+### Cached layer shared between sessions                                          ###
+#####################################################################################
+
+# The data itself is not hashed, the dataset version identifies it
+@st.cache_resource(max_entries=2)
+def get_percentile_index(_df, dataset_version):
+    return build_percentile_index(_df, get_cohort_derived_columns(_df, dataset_version))
+
+# Sorted predicted risks of all training patients, the model is identified by its version (content of the model files)
+@st.cache_resource(max_entries=2)
+def get_risk_distribution(_model, _df, dataset_version, model_version):
+    X = _df.drop(columns=[target_column]).to_numpy(dtype=np.float32)
+    return np.sort(np.ravel(predict(_model, X)))
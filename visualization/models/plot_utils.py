@@ -4,35 +4,53 @@
 # This is a helper function collection for handling the plots                       #
 #                                                                                   #
 # - Functions to plot data in different variants                                    #
+# - Scatter plots use WebGL and switch to 2-D histograms above a row threshold      #
+#   (the cluster plot draws a random sample instead)                                #
+# - The population plots are answered from the cohort cube (see cohort_utils.py),   #
+#   so their cost does not depend on the number of patients                         #
 #####################################################################################
 
 import plotly.express as px
+import plotly.graph_objects as go
+from plotly.subplots import make_subplots
 import pandas as pd
+import numpy as np
+from visualization.models.cohort_utils import count_by, get_age_quartiles
+
+# Number of rows above which scatter plots are replaced by 2-D histograms (density binning)
+scatter_density_threshold = 5000
+
+# Number of bins per axis for the density binning
+density_bins = 40
+
+# Maximum number of points drawn in the cluster plot, larger data is sampled
+cluster_plot_max_points = 20000
 
 # Gender Distribution Plot
-def plot_gender_distribution(df):
-    fig = px.pie(df, names='gender', title='Gender Distribution')
+def plot_gender_distribution(cube):
+    gender_counts = count_by(cube, 'gender')
+    fig = px.pie(names=gender_counts.index, values=gender_counts.values, title='Gender Distribution')
     fig.update_traces(marker=dict(colors=['skyblue', 'lightcoral']))
     return fig
 
 # Age Distribution of Patients Plot
-def plot_age_distribution(df):
-    fig = px.histogram(df, x='age', nbins=10, title='Age Distribution of Patients')
+def plot_age_distribution(cube):
+    fig = px.histogram(cube, x='age', y='count', histfunc='sum', nbins=10, title='Age Distribution of Patients')
     fig.update_traces(marker_color='#2a9d8f')
     fig.update_layout(xaxis_title='Age of Patients', yaxis_title='Number of Patients')
     return fig
 
 # Heart Attack Risk by Gender Plot
-def plot_risk_by_gender(df):
-    risk_by_gender = df[df['heart_disease_diagnosis'] == True]['gender'].value_counts()
-    fig = px.bar(risk_by_gender, x=risk_by_gender.index, y=risk_by_gender.values, title='Heart Attack Risk by Gender')
+def plot_risk_by_gender(cube):
+    risk_by_gender = count_by(cube[cube['heart_disease_diagnosis']], 'gender').sort_values(ascending=False).reset_index()
+    fig = px.bar(risk_by_gender, x='gender', y='count', title='Heart Attack Risk by Gender')
     fig.update_traces(marker_color='#264653')
     fig.update_layout(xaxis_title='Gender', yaxis_title='Number of Patients at Risk')
     return fig
 
 # Distribution of Heart Attacks Plot
-def plot_risk_distribution(df):
-    risk_distribution = df['heart_disease_diagnosis'].value_counts().reset_index()
+def plot_risk_distribution(cube):
+    risk_distribution = count_by(cube, 'heart_disease_diagnosis').sort_values(ascending=False).reset_index()
     risk_distribution.columns = ['Heart Attack Risk', 'Count']
     fig = px.bar(risk_distribution, x='Heart Attack Risk', y='Count', title='Distribution of Heart Attacks')
     fig.update_traces(marker_color='#234973')
@@ -40,24 +58,156 @@ def plot_risk_distribution(df):
     return fig
 
 # Age Distribution by Gender and Heart Attack Status Plot
-def plot_age_distribution_by_gender_and_heart_attack(df):
-    fig = px.violin(
-        df, y="age", x="heart_disease_diagnosis", color="gender", 
-        title="Age Distribution by Gender and Heart Attack Status", box=True
+# Box plots with the quartiles taken from the cube, as the single ages are not kept per patient
+def plot_age_distribution_by_gender_and_heart_attack(cube):
+    fig = go.Figure()
+    for gender, gender_cube in cube.groupby('gender', observed=True):
+        statistics = [
+            (diagnosis, get_age_quartiles(group_cube))
+            for diagnosis, group_cube in gender_cube.groupby('heart_disease_diagnosis')
+        ]
+        fig.add_trace(go.Box(
+            name=gender,
+            x=[str(diagnosis) for diagnosis, _ in statistics],
+            q1=[quartiles['q1'] for _, quartiles in statistics],
+            median=[quartiles['median'] for _, quartiles in statistics],
+            q3=[quartiles['q3'] for _, quartiles in statistics],
+            lowerfence=[quartiles['min'] for _, quartiles in statistics],
+            upperfence=[quartiles['max'] for _, quartiles in statistics],
+        ))
+    fig.update_layout(
+        title="Age Distribution by Gender and Heart Attack Status", boxmode='group',
+        xaxis_title="Heart Attack Status", yaxis_title="Age", legend_title_text='gender'
     )
-    fig.update_layout(xaxis_title="Heart Attack Status", yaxis_title="Age")
     return fig
 
 # Heart Attack Distribution by Age Group and Gender Plot
-def plot_heart_attack_by_age_group_and_gender(df):
-    bins = [0, 40, 50, 60, 70, 80, float('inf')]
-    labels = ['<40', '40-50', '50-60', '60-70', '70-80', '>80']
-    df['age_group'] = pd.cut(df['age'], bins=bins, labels=labels, right=False)
-    high_risk_patients = df[df['heart_disease_diagnosis'] == True]
-    heart_attack_distribution = high_risk_patients.groupby(['age_group', 'gender']).size().reset_index(name='count')
+def plot_heart_attack_by_age_group_and_gender(cube):
+    high_risk_patients = cube[cube['heart_disease_diagnosis']]
+    heart_attack_distribution = count_by(high_risk_patients, ['age_group', 'gender'], observed=False).reset_index()
     fig = px.bar(
         heart_attack_distribution, x='age_group', y='count', color='gender', 
         barmode='group', title="Distribution of Heart Attacks by Age Group and Gender"
     )
     fig.update_layout(xaxis_title='Age Group', yaxis_title='Number of Heart Attacks')
     return fig
+
+# Distribution of a single feature
+def plot_feature_distribution(df, feature):
+    fig = px.histogram(df, x=feature, nbins=20, title=f'Distribution of {feature}')
+    fig.update_layout(xaxis_title=feature, yaxis_title='Frequency')
+    return fig
+
+# Box plot of a single feature
+def plot_feature_box_plot(df, feature):
+    fig = px.box(df, y=feature, title=f'Box Plot of {feature}')
+    fig.update_layout(yaxis_title=feature)
+    return fig
+
+# Correlation heatmap of a correlation matrix
+def plot_correlation_heatmap(correlation_matrix):
+    fig = go.Figure(data=go.Heatmap(
+        z=correlation_matrix.values,
+        x=correlation_matrix.columns,
+        y=correlation_matrix.index,
+        colorscale='Viridis',  # You can adjust the color scale
+        texttemplate="%{z:.2f}",
+        hoverongaps=False
+    ))
+    fig.update_layout(
+        title="",
+        xaxis_title="Features",
+        yaxis_title="Features",
+        width=700,
+        height=700
+    )
+    return fig
+
+# Bin two features into a 2-D histogram, the result can be shown as heatmap
+def get_density(x, y, bins=density_bins):
+    counts, x_edges, y_edges = np.histogram2d(x, y, bins=bins)
+    x_centers = (x_edges[:-1] + x_edges[1:]) / 2
+    y_centers = (y_edges[:-1] + y_edges[1:]) / 2
+    # histogram2d counts x in the rows, the heatmap expects y in the rows
+    return counts.T, x_centers, y_centers
+
+# Pair plot of all features, WebGL scatter matrix for small data and 2-D histograms for large data
+def plot_pair_plot(df, features, threshold=scatter_density_threshold):
+    if len(df) <= threshold:
+        fig = go.Figure(go.Splom(
+            dimensions=[dict(label=feature, values=df[feature]) for feature in features],
+            marker=dict(size=4, color='#636efa')
+        ))
+    else:
+        num_features = len(features)
+        fig = make_subplots(rows=num_features, cols=num_features, horizontal_spacing=0.01, vertical_spacing=0.01)
+        for row, feature_y in enumerate(features, start=1):
+            for col, feature_x in enumerate(features, start=1):
+                data = df[[feature_x, feature_y]].dropna()
+                if row == col:
+                    # Distribution of the feature on the diagonal
+                    counts, edges = np.histogram(data[feature_x], bins=density_bins)
+                    fig.add_trace(go.Bar(x=(edges[:-1] + edges[1:]) / 2, y=counts, marker_color='#636efa'), row=row, col=col)
+                else:
+                    z, x_centers, y_centers = get_density(data[feature_x], data[feature_y])
+                    fig.add_trace(go.Heatmap(x=x_centers, y=y_centers, z=z, colorscale='Viridis', showscale=False), row=row, col=col)
+                if row == num_features:
+                    fig.update_xaxes(title_text=feature_x, row=row, col=col)
+                if col == 1:
+                    fig.update_yaxes(title_text=feature_y, row=row, col=col)
+        fig.update_xaxes(showticklabels=False)
+        fig.update_yaxes(showticklabels=False)
+        fig.update_layout(showlegend=False, bargap=0)
+    fig.update_layout(width=800, height=800)
+    return fig
+
+# Comparison of two features with a regression line, WebGL scatter for small data and a 2-D histogram for large data
+def plot_feature_comparison(df, feature_1, feature_2, threshold=scatter_density_threshold):
+    data = df[[feature_1, feature_2]].dropna()
+    x = data[feature_1].to_numpy(dtype=float)
+    y = data[feature_2].to_numpy(dtype=float)
+
+    fig = go.Figure()
+    if len(data) <= threshold:
+        fig.add_trace(go.Scattergl(x=x, y=y, mode='markers', name='Patients'))
+    else:
+        z, x_centers, y_centers = get_density(x, y)
+        fig.add_trace(go.Heatmap(x=x_centers, y=y_centers, z=z, colorscale='Viridis', name='Patients', colorbar=dict(title='Patients')))
+
+    # Least squares regression line (not defined if the first feature is constant)
+    if len(x) > 1 and x.std() > 0:
+        slope, intercept = np.polyfit(x, y, 1)
+        line_x = np.array([x.min(), x.max()])
+        fig.add_trace(go.Scatter(x=line_x, y=slope * line_x + intercept, mode='lines', name='Regression Line'))
+
+    fig.update_layout(title=f'{feature_1} vs {feature_2}', xaxis_title=feature_1, yaxis_title=feature_2)
+    return fig
+
+# Clusters in the 2D PCA projection, WebGL scatter of a fixed random sample for large data
+def plot_clusters_2d(reduced_data, labels, max_points=cluster_plot_max_points):
+    if len(reduced_data) > max_points:
+        sample = np.sort(np.random.default_rng(42).choice(len(reduced_data), size=max_points, replace=False))
+        reduced_data, labels = reduced_data[sample], labels[sample]
+    reduced_df = pd.DataFrame(reduced_data, columns=['PCA 1', 'PCA 2'])
+    reduced_df['Cluster'] = labels
+    fig = px.scatter(reduced_df, x='PCA 1', y='PCA 2', color='Cluster',
+                     title='Clusters Visualized in 2D with PCA',
+                     color_continuous_scale='Viridis', render_mode='webgl')
+    fig.update_layout(xaxis_title='PCA 1', yaxis_title='PCA 2')
+    return fig
+
+# Elbow curve (inertia) and silhouette curve of the k-sweep, the suggested number of clusters is marked
+def plot_cluster_selection(sweep_results, suggested_k=None):
+    k_values = list(sweep_results)
+    inertias = [sweep_results[k]['inertia'] for k in k_values]
+    silhouettes = [sweep_results[k]['silhouette'] for k in k_values]
+
+    fig = make_subplots(rows=2, cols=1, subplot_titles=('Elbow Curve (Inertia)', 'Silhouette Score'), vertical_spacing=0.2)
+    fig.add_trace(go.Scatter(x=k_values, y=inertias, mode='lines+markers', name='Inertia'), row=1, col=1)
+    fig.add_trace(go.Scatter(x=k_values, y=silhouettes, mode='lines+markers', name='Silhouette'), row=2, col=1)
+    if suggested_k is not None:
+        for row in (1, 2):
+            fig.add_vline(x=suggested_k, line_dash='dash', line_color='green', row=row, col=1)
+    fig.update_xaxes(title_text='Number of Clusters', dtick=1)
+    fig.update_layout(showlegend=False, height=500, margin=dict(l=20, r=20, t=40, b=20))
+    return fig
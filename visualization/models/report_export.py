@@ -0,0 +1,182 @@
+#####################################################################################
+# report_export.py                                                                  #
+#                                                                                   #
+# This is the bulk export of the PDF risk reports of many patients into one ZIP     #
+#                                                                                   #
+# - Render the reports (SHAP plot and PDF) in a pool of worker processes            #
+# - Write each report into the archive as soon as it is finished                    #
+# - Progress and cancellation of a running export                                   #
+# - Render the SHAP plot (also used by the render process of the risk page)         #
+#                                                                                   #
+# The worker processes only import this module, so they do not load TensorFlow.     #
+# The risk and the SHAP values are prepared in the app (see report_utils).          #
+#####################################################################################
+
+# Import needed libraries
+import os
+import re
+import zipfile
+import tempfile
+import weakref
+import threading
+import multiprocessing
+from io import BytesIO
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+import matplotlib
+matplotlib.use('Agg')
+import matplotlib.pyplot as plt
+import shap
+import streamlit as st
+from visualization.models.data_utils import generate_pdf
+
+# Number of worker processes, one core is left for the app
+export_workers = max(1, min(4, (os.cpu_count() or 2) - 1))
+
+# Reports that are rendered at the same time, more are only submitted when one is finished
+export_window = 2 * export_workers
+
+# Marks the end of the tasks
+end_of_tasks = object()
+
+
+#####################################################################################
+### Render a single report (worker process)                                       ###
+#####################################################################################
+
+# Name of the report of a patient in the archive
+def get_report_file_name(patient_data):
+    patient_id = str(patient_data.get('PatientInfo', {}).get('patient_id', 'unknown'))
+    return f"risk_report_{re.sub(r'[^A-Za-z0-9_-]', '_', patient_id)}.pdf"
+
+# Render the SHAP waterfall plot of one patient, returns the PNG bytes
+def render_waterfall(shap_values, expected_value, feature_names):
+    plt.figure()
+    shap.waterfall_plot(shap.Explanation(
+        values=shap_values,
+        base_values=expected_value,
+        feature_names=feature_names
+    ), show=False)
+    shap_image = BytesIO()
+    plt.gcf().savefig(shap_image, format='png')
+    plt.close('all')
+    return shap_image.getvalue()
+
+# Render the SHAP waterfall plot and the PDF report of one patient, returns the file name and the PDF bytes
+def render_report(task):
+    shap_image = BytesIO(render_waterfall(task['shap_values'], task['expected_value'], task['feature_names']))
+    pdf_buffer = generate_pdf(task['patient_data'], task['risk_result'], shap_image, task['interpretation_text'])
+    return get_report_file_name(task['patient_data']), pdf_buffer.getvalue()
+
+
+#####################################################################################
+### Bulk export                                                                   ###
+#####################################################################################
+
+# One pool of worker processes for all exports, the workers are started fresh (no fork of the app)
+@st.cache_resource
+def get_export_pool():
+    return ProcessPoolExecutor(max_workers=export_workers, mp_context=multiprocessing.get_context('spawn'))
+
+class ReportExport:
+    # tasks yields one report task per patient, or None for a patient without a report (incomplete data)
+    def __init__(self, tasks, total, pool):
+        self.tasks = tasks
+        self.total = total
+        self.pool = pool
+        self.lock = threading.Lock()
+        self.cancel_event = threading.Event()
+        self.progress = {'exported': 0, 'skipped': 0, 'failed': 0}
+        self.state = 'running'
+        self.error = None
+        self.path = None
+        self.archive = None
+        self.thread = None
+
+    # Start the export in a background thread
+    def start(self):
+        self.thread = threading.Thread(target=self.run, name='report-export', daemon=True)
+        self.thread.start()
+        return self
+
+    # Stop the export, reports that are not rendered yet are dropped
+    def cancel(self):
+        self.cancel_event.set()
+
+    def run(self):
+        file_descriptor, path = tempfile.mkstemp(prefix='cardiovision_reports_', suffix='.zip')
+        os.close(file_descriptor)
+        in_flight = set()
+        try:
+            # The PDFs are already compressed, so they are stored as they are
+            with zipfile.ZipFile(path, 'w', compression=zipfile.ZIP_STORED) as archive:
+                tasks = iter(self.tasks)
+                task = None
+                while not self.cancel_event.is_set():
+                    while len(in_flight) < export_window and task is not end_of_tasks:
+                        task = next(tasks, end_of_tasks)
+                        if task is None:
+                            self.update_progress(skipped=1)
+                        elif task is not end_of_tasks:
+                            in_flight.add(self.pool.submit(render_report, task))
+                    if not in_flight:
+                        break
+                    done, in_flight = wait(in_flight, timeout=1, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        try:
+                            file_name, pdf = future.result()
+                            archive.writestr(file_name, pdf)
+                            self.update_progress(exported=1)
+                        except Exception as e:
+                            print(f"Report could not be rendered: {e}")
+                            self.update_progress(failed=1)
+        except Exception as e:
+            print(f"Report export failed: {e}")
+            self.error = str(e)
+
+        for future in in_flight:
+            future.cancel()
+        with self.lock:
+            if self.cancel_event.is_set() or self.error is not None:
+                os.remove(path)
+                self.state = 'cancelled' if self.error is None else 'failed'
+            else:
+                self.path = path
+                self.state = 'done'
+                # The archive is also removed if the session ends before it is downloaded
+                weakref.finalize(self, remove_archive, path)
+
+    def update_progress(self, **counts):
+        with self.lock:
+            for key, count in counts.items():
+                self.progress[key] += count
+
+    # State and progress for the page
+    def get_status(self):
+        with self.lock:
+            return dict(self.progress, state=self.state, total=self.total, error=self.error)
+
+    def finished(self):
+        with self.lock:
+            return self.state != 'running'
+
+    # Bytes of the finished archive, the file is read once and then removed
+    def read_archive(self):
+        with self.lock:
+            if self.archive is None:
+                with open(self.path, 'rb') as f:
+                    self.archive = f.read()
+                remove_archive(self.path)
+            return self.archive
+
+    # Remove the archive when it is no longer needed
+    def cleanup(self):
+        self.cancel()
+        with self.lock:
+            self.archive = None
+            if self.path is not None:
+                remove_archive(self.path)
+
+# Remove the temporary file of an archive if it still exists
+def remove_archive(path):
+    if os.path.exists(path):
+        os.remove(path)
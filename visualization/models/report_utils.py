@@ -0,0 +1,105 @@
+#####################################################################################
+# report_utils.py                                                                   #
+#                                                                                   #
+# This is the cache for the PDF risk reports shared between all sessions            #
+#                                                                                   #
+# - Reports are only generated when they are requested                              #
+# - Store the PDF bytes per patient, input hash and model version                   #
+# - Evict the least recently used reports above a size limit                        #
+# - Build each report only once, even if many sessions request it at the same time  #
+#   (see cache_utils)                                                               #
+# - Prepare the report tasks of the bulk export (see report_export)                 #
+#####################################################################################
+
+# Import needed libraries
+import json
+import hashlib
+import numpy as np
+import pandas as pd
+import streamlit as st
+from visualization.models.cache_utils import SharedCache
+from visualization.models.data_utils import generate_pdf
+from visualization.models.model_utils import get_input_hash, flatten_patient_data, score_patients, explain_patients, get_model_feature_names
+from visualization.models.narrative_utils import build_narratives
+from visualization.models.patient_utils import load_patient
+from visualization.models.risk_log_utils import find_risk_calculation, log_risk_calculation, attach_risk_explanation
+
+# Maximum size of all cached reports (PDF bytes)
+report_cache_max_bytes = 32 * 1024 * 1024
+
+# Number of patients whose risk and SHAP values are calculated in one batch for the bulk export
+export_batch_size = 64
+
+# Probability above which a patient has a high risk (same as the risk calculation)
+high_risk_threshold = 0.5
+
+
+# One cache instance for all sessions
+@st.cache_resource
+def get_report_cache():
+    return SharedCache(report_cache_max_bytes)
+
+# Key of the report of a patient: patient id, hash of the model inputs and model version
+# The hash of the whole record is added, as name and contact data are printed in the report as well
+def get_report_key(patient_data, model_version):
+    patient_id = str(patient_data.get('PatientInfo', {}).get('patient_id', ''))
+    record_hash = hashlib.sha256(json.dumps(patient_data, sort_keys=True, default=str).encode()).hexdigest()[:16]
+    return patient_id, get_input_hash(patient_data), model_version, record_hash
+
+# Get the cached report of the key, None if it was not generated yet
+def find_risk_report(key):
+    return get_report_cache().get(key)
+
+# Get the report of the key, it is generated if it is not cached yet
+def get_risk_report(key, patient_data, risk_result, shap_image, interpretation_text):
+    return get_report_cache().get_or_build(
+        key, lambda: generate_pdf(patient_data, risk_result, shap_image, interpretation_text).getvalue()
+    )
+
+
+#####################################################################################
+### Tasks of the bulk export                                                      ###
+#####################################################################################
+
+# Yield the report task of every patient (None if the patient data is incomplete)
+# Logged calculations are reused, the other patients are calculated in batches and logged
+# Runs in the export thread, so the risk log writer is passed in by the page
+def prepare_report_tasks(patient_ids, preprocessor, model, model_version, df, risk_log_writer):
+    feature_names = get_model_feature_names(preprocessor)
+    for start in range(0, len(patient_ids), export_batch_size):
+        records = [load_patient(patient_id) for patient_id in patient_ids[start:start + export_batch_size]]
+        flat_records = [flatten_patient_data(patient_data) if patient_data else None for patient_data in records]
+        complete = [flat_data is not None and all(value is not None for value in flat_data.values()) for flat_data in flat_records]
+        input_hashes = [get_input_hash(patient_data) if is_complete else None for patient_data, is_complete in zip(records, complete)]
+        calculations = [find_risk_calculation(input_hash, model_version, writer=risk_log_writer) if input_hash else None for input_hash in input_hashes]
+
+        # Risk and SHAP values of the patients without a logged calculation (or without logged SHAP values), in one batch
+        missing = [i for i in range(len(records)) if complete[i] and (calculations[i] is None or calculations[i]['shap_values'] is None)]
+        if missing:
+            probabilities = score_patients(preprocessor, model, [records[i] for i in missing])
+            processed_data = preprocessor.transform(pd.DataFrame([flat_records[i] for i in missing]))
+            shap_values, expected_value = explain_patients(model, processed_data, df)
+            for i, probability, patient_shap_values in zip(missing, probabilities, shap_values):
+                risk_result = "High Risk" if probability > high_risk_threshold else "Low Risk"
+                if calculations[i] is None:
+                    patient_id = records[i]['PatientInfo'].get('patient_id')
+                    log_risk_calculation(patient_id, input_hashes[i], model_version, probability, risk_result, patient_shap_values, expected_value, writer=risk_log_writer)
+                else:
+                    attach_risk_explanation(input_hashes[i], model_version, calculations[i]['logged_at'], patient_shap_values, expected_value, writer=risk_log_writer)
+                calculations[i] = {'label': risk_result, 'probability': float(probability), 'shap_values': patient_shap_values, 'expected_value': expected_value}
+
+        # Explanations of all patients of the batch at once
+        explained = [i for i in range(len(records)) if calculations[i] is not None]
+        shap_matrix = np.array([np.asarray(calculations[i]['shap_values'], dtype=np.float32).ravel() for i in explained]).reshape(len(explained), len(feature_names))
+        narratives = build_narratives(shap_matrix, [calculations[i]['probability'] for i in explained], [flat_records[i] for i in explained], feature_names)
+        tasks = [None] * len(records)
+        for i, patient_shap_values, interpretation_text in zip(explained, shap_matrix, narratives):
+            tasks[i] = {
+                'patient_data': records[i],
+                'risk_result': calculations[i]['label'],
+                'shap_values': patient_shap_values,
+                'expected_value': calculations[i]['expected_value'],
+                'feature_names': feature_names,
+                'interpretation_text': interpretation_text,
+            }
+        yield from tasks
@@ -0,0 +1,199 @@
+#####################################################################################
+# risk_log_utils.py                                                                 #
+#                                                                                   #
+# This is the append-only log of all risk calculations (SQLite, see database_utils) #
+#                                                                                   #
+# - Log input hash, model version, probability, label and SHAP values               #
+# - The prediction is logged at once, its SHAP values are attached when ready       #
+# - Writes are queued and written in batches by a background thread                 #
+# - Read-through: find the logged result of the same inputs and model version       #
+#####################################################################################
+
+# Import needed libraries
+import time
+import queue
+import threading
+import numpy as np
+import streamlit as st
+from visualization.models.database_utils import connect, ensure_schema, database_path
+
+# A batch is written when this many entries are queued or the oldest entry waited this long (seconds)
+log_batch_size = 64
+log_flush_interval = 1.0
+
+# The SHAP values are stored as float32 bytes, entries are only appended and their SHAP values attached later
+risk_log_schema = [
+    """CREATE TABLE IF NOT EXISTS risk_log (
+        log_id INTEGER PRIMARY KEY,
+        logged_at REAL NOT NULL,
+        patient_id TEXT,
+        input_hash TEXT NOT NULL,
+        model_version TEXT NOT NULL,
+        probability REAL NOT NULL,
+        label TEXT NOT NULL,
+        expected_value REAL,
+        shap_values BLOB
+    )""",
+    "CREATE INDEX IF NOT EXISTS risk_log_input ON risk_log (input_hash, model_version, log_id)",
+]
+
+
+#####################################################################################
+### Batched writer                                                                ###
+#####################################################################################
+
+class RiskLogWriter:
+    def __init__(self, db_path=database_path):
+        self.db_path = db_path
+        self.queue = queue.Queue()
+        self.lock = threading.Lock()
+        # Entries that are queued but not written yet, so read-through finds them as well
+        self.pending = {}
+        self.statistics = {'logged': 0, 'attached': 0, 'written': 0, 'batches': 0}
+        self.thread = threading.Thread(target=self.run, name='risk-log-writer', daemon=True)
+        self.thread.start()
+
+    # Queue an entry, returns immediately
+    def log(self, entry):
+        with self.lock:
+            self.pending[(entry['input_hash'], entry['model_version'])] = entry
+            self.statistics['logged'] += 1
+        self.queue.put(('insert', entry))
+
+    # Queue the SHAP values of a logged entry (same input hash, model version and logged_at), returns immediately
+    def attach(self, update):
+        key = (update['input_hash'], update['model_version'])
+        with self.lock:
+            # Read-through sees the SHAP values before the update is written
+            pending = self.pending.get(key)
+            if pending is not None and pending['logged_at'] == update['logged_at']:
+                update = self.pending[key] = dict(pending, **update)
+            self.statistics['attached'] += 1
+        self.queue.put(('update', update))
+
+    # Collect the queued entries into batches and write each batch in one transaction
+    def run(self):
+        ensure_schema('risk_log', risk_log_schema, self.db_path)
+        while True:
+            batch = [self.queue.get()]
+            deadline = time.monotonic() + log_flush_interval
+            while len(batch) < log_batch_size and (remaining := deadline - time.monotonic()) > 0:
+                try:
+                    batch.append(self.queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            try:
+                self.write_batch(batch)
+            except Exception as e:
+                print(f"Risk log batch could not be written: {e}")
+
+    # Inserts are written before the updates, the insert of an update is always queued before it
+    def write_batch(self, batch):
+        inserts = [entry for operation, entry in batch if operation == 'insert']
+        updates = [entry for operation, entry in batch if operation == 'update']
+        connection = connect(self.db_path)
+        try:
+            with connection:
+                connection.executemany(
+                    """INSERT INTO risk_log (logged_at, patient_id, input_hash, model_version, probability, label, expected_value, shap_values)
+                       VALUES (?, ?, ?, ?, ?, ?, ?, ?)""",
+                    [(entry['logged_at'], entry['patient_id'], entry['input_hash'], entry['model_version'], entry['probability'],
+                      entry['label'], entry['expected_value'], to_blob(entry['shap_values']))
+                     for entry in inserts],
+                )
+                connection.executemany(
+                    """UPDATE risk_log SET expected_value = ?, shap_values = ?
+                       WHERE input_hash = ? AND model_version = ? AND logged_at = ?""",
+                    [(entry['expected_value'], to_blob(entry['shap_values']), entry['input_hash'], entry['model_version'], entry['logged_at'])
+                     for entry in updates],
+                )
+        finally:
+            connection.close()
+        with self.lock:
+            for _, entry in batch:
+                key = (entry['input_hash'], entry['model_version'])
+                if self.pending.get(key) is entry:
+                    del self.pending[key]
+            self.statistics['written'] += len(batch)
+            self.statistics['batches'] += 1
+
+    def get_pending(self, input_hash, model_version):
+        with self.lock:
+            return self.pending.get((input_hash, model_version))
+
+    def get_statistics(self):
+        with self.lock:
+            return dict(self.statistics, queued=self.queue.qsize())
+
+
+#####################################################################################
+### Log and read-through                                                          ###
+#####################################################################################
+
+# One writer for all sessions
+@st.cache_resource
+def get_risk_log_writer():
+    return RiskLogWriter()
+
+# SHAP values as float32 bytes, None if they are not calculated yet
+def to_blob(shap_values):
+    return None if shap_values is None else shap_values.astype(np.float32).tobytes()
+
+# Log a risk calculation (non-blocking), background threads pass the writer they got from the session
+# The SHAP values can be attached later with attach_risk_explanation, returns the logged_at of the entry
+def log_risk_calculation(patient_id, input_hash, model_version, probability, label, shap_values=None, expected_value=None, writer=None):
+    logged_at = time.time()
+    (writer or get_risk_log_writer()).log({
+        'logged_at': logged_at,
+        'patient_id': None if patient_id is None else str(patient_id),
+        'input_hash': input_hash,
+        'model_version': model_version,
+        'probability': float(probability),
+        'label': label,
+        'expected_value': None if expected_value is None else float(expected_value),
+        'shap_values': None if shap_values is None else np.asarray(shap_values, dtype=np.float32).ravel(),
+    })
+    return logged_at
+
+# Attach the SHAP values to a logged risk calculation (non-blocking)
+def attach_risk_explanation(input_hash, model_version, logged_at, shap_values, expected_value, writer=None):
+    (writer or get_risk_log_writer()).attach({
+        'logged_at': logged_at,
+        'input_hash': input_hash,
+        'model_version': model_version,
+        'expected_value': float(expected_value),
+        'shap_values': np.asarray(shap_values, dtype=np.float32).ravel(),
+    })
+
+# Find the latest logged calculation with the same inputs and model version, None if there is none
+# The SHAP values and the expected value are None if they were not attached (yet)
+# Background threads pass the writer they got from the session (for the entries that are not written yet)
+def find_risk_calculation(input_hash, model_version, db_path=database_path, writer=None):
+    pending = (writer or get_risk_log_writer()).get_pending(input_hash, model_version)
+    if pending is not None:
+        return pending
+
+    ensure_schema('risk_log', risk_log_schema, db_path)
+    connection = connect(db_path)
+    try:
+        row = connection.execute(
+            """SELECT logged_at, patient_id, probability, label, expected_value, shap_values FROM risk_log
+               WHERE input_hash = ? AND model_version = ? ORDER BY log_id DESC LIMIT 1""",
+            (input_hash, model_version),
+        ).fetchone()
+    finally:
+        connection.close()
+    if row is None:
+        return None
+
+    logged_at, patient_id, probability, label, expected_value, shap_values = row
+    return {
+        'logged_at': logged_at,
+        'patient_id': patient_id,
+        'input_hash': input_hash,
+        'model_version': model_version,
+        'probability': probability,
+        'label': label,
+        'expected_value': expected_value,
+        'shap_values': None if shap_values is None else np.frombuffer(shap_values, dtype=np.float32),
+    }
@@ -0,0 +1,107 @@
+#####################################################################################
+# statistics_utils.py                                                               #
+#                                                                                   #
+# This is a helper function collection for the pairwise statistics of the features #
+#                                                                                   #
+# - Compute r, R-squared and p-values for all feature pairs at once (numpy)         #
+# - Cache the full matrices once per dataset version                                #
+# - Slice subsets and single pairs, find strong correlations by masks               #
+#####################################################################################
+
+# Import needed libraries
+import streamlit as st
+import pandas as pd
+import numpy as np
+from scipy import stats
+
+
+#####################################################################################
+### Compute the pairwise statistics                                               ###
+#####################################################################################
+
+# Compute the correlation r, R-squared, p-value and number of observations of all numeric column pairs
+# The p-value is the one of the two-sided t-test of the regression slope (as in scipy.stats.linregress)
+def compute_pairwise_statistics(df):
+    numeric_df = df.select_dtypes(include=['number', 'bool']).astype(float)
+    columns = numeric_df.columns.tolist()
+    values = numeric_df.to_numpy()
+
+    if not np.isnan(values).any():
+        # All columns are complete: one matrix product of the standardized values
+        n = np.full((len(columns), len(columns)), len(values), dtype=float)
+        centered = values - values.mean(axis=0)
+        norms = np.sqrt((centered ** 2).sum(axis=0))
+        with np.errstate(divide='ignore', invalid='ignore'):
+            r = (centered.T @ centered) / np.outer(norms, norms)
+    else:
+        # Missing values: use the pairwise complete observations like DataFrame.corr()
+        present = ~np.isnan(values)
+        n = present.T.astype(float) @ present.astype(float)
+        r = numeric_df.corr().to_numpy()
+
+    r = np.clip(r, -1.0, 1.0)
+    r_squared = r ** 2
+
+    # t statistic of the slope with n - 2 degrees of freedom
+    degrees_of_freedom = n - 2
+    with np.errstate(divide='ignore', invalid='ignore'):
+        t_statistic = r * np.sqrt(degrees_of_freedom / (1.0 - r_squared))
+    p_value = 2 * stats.t.sf(np.abs(t_statistic), np.maximum(degrees_of_freedom, 1))
+    p_value[degrees_of_freedom < 1] = np.nan
+
+    return {
+        'columns': columns,
+        'index': {column: position for position, column in enumerate(columns)},
+        'r': r,
+        'r_squared': r_squared,
+        'p_value': p_value,
+        'n': n,
+    }
+
+
+#####################################################################################
+### Slice the cached matrices                                                     ###
+#####################################################################################
+
+# Correlation matrix of a subset of the columns
+def select_correlation_matrix(statistics, variables):
+    variables = [variable for variable in variables if variable in statistics['index']]
+    positions = [statistics['index'][variable] for variable in variables]
+    return pd.DataFrame(statistics['r'][np.ix_(positions, positions)], index=variables, columns=variables)
+
+# Correlation, R-squared and p-value of a single pair of columns
+def get_pair_statistics(statistics, feature_1, feature_2):
+    i = statistics['index'][feature_1]
+    j = statistics['index'][feature_2]
+    return statistics['r'][i, j], statistics['r_squared'][i, j], statistics['p_value'][i, j]
+
+# Find the pairs of the lower triangle with a correlation in the given range (lower <= r < upper),
+# for negative correlations the range is mirrored (-upper < r <= -lower), the signed r is returned
+def find_correlated_pairs(correlation_matrix, lower, upper, negative=False):
+    rows, cols = np.tril_indices(len(correlation_matrix.columns), k=-1)
+    values = correlation_matrix.to_numpy()[rows, cols]
+    if negative:
+        mask = (values > -upper) & (values <= -lower)
+    else:
+        mask = (values >= lower) & (values < upper)
+    columns = correlation_matrix.columns
+    return [(columns[i], columns[j], value) for i, j, value in zip(rows[mask], cols[mask], values[mask])]
+
+# Group the pairs into strong (0.5 <= |r| < 0.7) and very strong (|r| >= 0.7) correlations
+def find_strong_correlations(correlation_matrix):
+    return {
+        'strong_positive': find_correlated_pairs(correlation_matrix, 0.5, 0.7),
+        'strong_negative': find_correlated_pairs(correlation_matrix, 0.5, 0.7, negative=True),
+        'very_strong_positive': find_correlated_pairs(correlation_matrix, 0.7, np.inf),
+        'very_strong_negative': find_correlated_pairs(correlation_matrix, 0.7, np.inf, negative=True),
+    }
+
+
+#####################################################################################
+### Cached layer shared between sessions                                          ###
+#####################################################################################
+
+# The data itself is not hashed, the dataset version and the name of the data identify it
+@st.cache_resource(max_entries=8)
+def get_pairwise_statistics(_df, dataset_version, name):
+    return compute_pairwise_statistics(_df)
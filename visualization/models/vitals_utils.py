@@ -0,0 +1,151 @@
+#####################################################################################
+# vitals_utils.py                                                                   #
+#                                                                                   #
+# This is a helper function collection for the time series of the patient vitals    #
+#                                                                                   #
+# - Append-only store per patient, feature and timestamp (SQLite)                   #
+# - Range queries on the primary key index                                          #
+# - Downsample long histories in SQL to the width of the chart (min/mean/max)       #
+# - Simulated history for patients without readings (until the EHR delivers them),  #
+#   generated for each query and never stored with the real readings                #
+#####################################################################################
+
+# Import needed libraries
+import zlib
+from datetime import datetime
+import numpy as np
+import pandas as pd
+from visualization.models.database_utils import connect, ensure_schema, database_path
+
+# Features of the trend analysis with their units
+vital_units = {
+    'Blood Pressure': 'mmHg',
+    'Cholesterol': 'mg/dL',
+    'FBS': 'mg/dL',
+    'Heart Rate': 'bpm',
+}
+
+# Ranges of the simulated readings per feature
+simulated_ranges = {
+    'Blood Pressure': (110, 140),
+    'Cholesterol': (150, 240),
+    'FBS': (70, 130),
+    'Heart Rate': (60, 100),
+}
+
+# Length and interval of the simulated history
+simulated_history_days = 730
+simulated_interval_hours = 6
+
+# Maximum number of points returned for a chart (about one point per pixel of the chart width)
+chart_width_points = 800
+
+# The primary key is the index of the range queries (patient, feature, time), the table has no extra rowid
+vitals_schema = [
+    """CREATE TABLE IF NOT EXISTS vitals (
+        patient_id TEXT NOT NULL,
+        feature TEXT NOT NULL,
+        measured_at INTEGER NOT NULL,
+        value REAL NOT NULL,
+        PRIMARY KEY (patient_id, feature, measured_at)
+    ) WITHOUT ROWID""",
+]
+
+
+#####################################################################################
+### Append and query the readings                                                 ###
+#####################################################################################
+
+# Append readings (rows of patient_id, feature, timestamp, value), readings that already exist are kept
+def append_vitals(readings, db_path=database_path):
+    ensure_schema('vitals', vitals_schema, db_path)
+    rows = [(str(patient_id), feature, int(pd.Timestamp(measured_at).timestamp()), float(value))
+            for patient_id, feature, measured_at, value in readings]
+    connection = connect(db_path)
+    try:
+        with connection:
+            connection.executemany("INSERT OR IGNORE INTO vitals VALUES (?, ?, ?, ?)", rows)
+    finally:
+        connection.close()
+    return len(rows)
+
+# Check if a patient has any readings
+def has_vitals(patient_id, db_path=database_path):
+    ensure_schema('vitals', vitals_schema, db_path)
+    connection = connect(db_path)
+    try:
+        row = connection.execute("SELECT 1 FROM vitals WHERE patient_id = ? LIMIT 1", (str(patient_id),)).fetchone()
+    finally:
+        connection.close()
+    return row is not None
+
+# Start, end (seconds) and bucket length of a time range split into at most max_points buckets
+def get_buckets(start, end, max_points):
+    start_ts = int(pd.Timestamp(start).timestamp())
+    end_ts = int(pd.Timestamp(end).timestamp())
+    return start_ts, end_ts, max(1, -(-(end_ts - start_ts + 1) // max_points))
+
+# Get the readings of a feature in a time range, downsampled to at most max_points buckets
+# Each bucket keeps the mean, minimum and maximum, so peaks stay visible in long histories
+def query_vitals(patient_id, feature, start, end, max_points=chart_width_points, db_path=database_path):
+    ensure_schema('vitals', vitals_schema, db_path)
+    start_ts, end_ts, bucket_seconds = get_buckets(start, end, max_points)
+
+    connection = connect(db_path)
+    try:
+        rows = connection.execute(
+            """SELECT AVG(measured_at), AVG(value), MIN(value), MAX(value), COUNT(*)
+               FROM vitals
+               WHERE patient_id = ? AND feature = ? AND measured_at BETWEEN ? AND ?
+               GROUP BY (measured_at - ?) / ?
+               ORDER BY 1""",
+            (str(patient_id), feature, start_ts, end_ts, start_ts, bucket_seconds),
+        ).fetchall()
+    finally:
+        connection.close()
+
+    trend_data = pd.DataFrame(rows, columns=['Date', 'Mean', 'Min', 'Max', 'Readings'])
+    trend_data['Date'] = pd.to_datetime(trend_data['Date'], unit='s')
+    return trend_data
+
+
+#####################################################################################
+### Simulated history                                                             ###
+#####################################################################################
+
+# Simulate a history of readings, the seed is taken from the patient id so it is always the same
+def simulate_vitals(patient_id, end=None, days=simulated_history_days, interval_hours=simulated_interval_hours):
+    end = (end or datetime.now()).replace(minute=0, second=0, microsecond=0)
+    timestamps = pd.date_range(end=end, periods=days * 24 // interval_hours, freq=f'{interval_hours}h')
+    rng = np.random.default_rng(zlib.crc32(str(patient_id).encode()))
+    readings = []
+    for feature, (low, high) in simulated_ranges.items():
+        values = rng.integers(low, high, size=len(timestamps))
+        readings.extend(zip([patient_id] * len(timestamps), [feature] * len(timestamps), timestamps, values))
+    return readings
+
+# Get the simulated readings of a feature in a time range, downsampled like query_vitals
+def query_simulated_vitals(patient_id, feature, start, end, max_points=chart_width_points):
+    start_ts, end_ts, bucket_seconds = get_buckets(start, end, max_points)
+    readings = pd.DataFrame(
+        [(int(measured_at.timestamp()), value) for _, reading_feature, measured_at, value in simulate_vitals(patient_id) if reading_feature == feature],
+        columns=['measured_at', 'value'],
+    )
+    readings = readings[readings['measured_at'].between(start_ts, end_ts)]
+
+    buckets = readings.groupby((readings['measured_at'] - start_ts) // bucket_seconds)
+    trend_data = pd.DataFrame({
+        'Date': buckets['measured_at'].mean(),
+        'Mean': buckets['value'].mean(),
+        'Min': buckets['value'].min(),
+        'Max': buckets['value'].max(),
+        'Readings': buckets.size(),
+    }).reset_index(drop=True)
+    trend_data['Date'] = pd.to_datetime(trend_data['Date'], unit='s')
+    return trend_data
+
+# Get the trend of a feature: the stored readings, or the simulated history while the patient has none
+def get_vitals_trend(patient_id, feature, start, end, max_points=chart_width_points, db_path=database_path):
+    if has_vitals(patient_id, db_path):
+        return query_vitals(patient_id, feature, start, end, max_points, db_path)
+    return query_simulated_vitals(patient_id, feature, start, end, max_points)
@@ -0,0 +1,138 @@
+#####################################################################################
+# worklist_utils.py                                                                 #
+#                                                                                   #
+# This is a helper function collection for the high-risk worklist                   #
+#                                                                                   #
+# - Keep the predicted risk of every stored patient (SQLite, see database_utils)    #
+# - Find the dirty patients: updated after their last scoring or other model        #
+# - Re-score only the dirty patients whose model inputs changed, in batches         #
+# - Paginated worklist sorted by the predicted risk                                 #
+#####################################################################################
+
+# Import needed libraries
+import json
+import threading
+import numpy as np
+from visualization.models.database_utils import connect, ensure_schema, database_path
+from visualization.models.patient_utils import patients_schema
+from visualization.models.model_utils import score_patients, get_input_hash
+
+# Number of dirty patients that are scored in one batch
+worklist_batch_size = 256
+
+# Number of patients per page of the worklist
+worklist_page_size = 25
+
+# Probability above which a patient has a high risk (same as the risk calculation)
+high_risk_threshold = 0.5
+
+# scored_at is the updated_at of the patient record that was scored, the record is dirty if it was updated later
+risk_scores_schema = [
+    """CREATE TABLE IF NOT EXISTS risk_scores (
+        patient_id TEXT PRIMARY KEY,
+        input_hash TEXT NOT NULL,
+        model_version TEXT NOT NULL,
+        probability REAL,
+        scored_at INTEGER NOT NULL
+    )""",
+    "CREATE INDEX IF NOT EXISTS risk_scores_probability ON risk_scores (probability DESC)",
+]
+
+# Only one refresh runs at a time, other sessions see the result of the running one
+refresh_lock = threading.Lock()
+
+
+#####################################################################################
+### Incremental scoring                                                           ###
+#####################################################################################
+
+# Get a batch of dirty patients (never scored, updated after the scoring or scored with another model)
+def find_dirty_patients(model_version, limit=worklist_batch_size, db_path=database_path):
+    connection = connect(db_path)
+    try:
+        return connection.execute(
+            """SELECT p.patient_id, p.updated_at, p.document, r.input_hash, r.model_version
+               FROM patients p LEFT JOIN risk_scores r ON r.patient_id = p.patient_id
+               WHERE r.patient_id IS NULL OR r.scored_at < p.updated_at OR r.model_version != ?
+               LIMIT ?""",
+            (model_version, limit),
+        ).fetchall()
+    finally:
+        connection.close()
+
+# Score all dirty patients in batches, patients with unchanged inputs are only marked as clean
+# Returns the number of scored and the number of unchanged patients
+def refresh_worklist(preprocessor, model, model_version, db_path=database_path):
+    ensure_schema('patients', patients_schema, db_path)
+    ensure_schema('risk_scores', risk_scores_schema, db_path)
+    scored, unchanged = 0, 0
+
+    with refresh_lock:
+        while dirty := find_dirty_patients(model_version, db_path=db_path):
+            documents = [json.loads(document) for _, _, document, _, _ in dirty]
+            input_hashes = [get_input_hash(patient_data) for patient_data in documents]
+            changed = [i for i, (row, input_hash) in enumerate(zip(dirty, input_hashes))
+                       if row[3] != input_hash or row[4] != model_version]
+            changed_set = set(changed)
+
+            probabilities = np.full(len(dirty), np.nan)
+            if changed:
+                probabilities[changed] = score_patients(preprocessor, model, [documents[i] for i in changed])
+
+            connection = connect(db_path)
+            try:
+                with connection:
+                    # Unchanged inputs keep their probability, only the scoring time moves on
+                    connection.executemany(
+                        "UPDATE risk_scores SET scored_at = ? WHERE patient_id = ?",
+                        [(dirty[i][1], dirty[i][0]) for i in range(len(dirty)) if i not in changed_set],
+                    )
+                    connection.executemany(
+                        "INSERT OR REPLACE INTO risk_scores VALUES (?, ?, ?, ?, ?)",
+                        [(dirty[i][0], input_hashes[i], model_version,
+                          None if np.isnan(probabilities[i]) else float(probabilities[i]), dirty[i][1]) for i in changed],
+                    )
+            finally:
+                connection.close()
+            scored += len(changed)
+            unchanged += len(dirty) - len(changed)
+
+    return scored, unchanged
+
+
+#####################################################################################
+### Worklist                                                                      ###
+#####################################################################################
+
+# One page of the worklist (patient_id, name, probability, updated_at) sorted by the risk, and the number of patients
+def get_worklist(page=0, page_size=worklist_page_size, only_high_risk=False, db_path=database_path):
+    ensure_schema('patients', patients_schema, db_path)
+    ensure_schema('risk_scores', risk_scores_schema, db_path)
+    # Patients without a probability (incomplete records) come last, NULL is the smallest value in SQLite
+    condition, parameters = ("r.probability > ?", (high_risk_threshold,)) if only_high_risk else ("1", ())
+
+    connection = connect(db_path)
+    try:
+        total = connection.execute(f"SELECT COUNT(*) FROM risk_scores r WHERE {condition}", parameters).fetchone()[0]
+        rows = connection.execute(
+            f"""SELECT r.patient_id, p.name, r.probability, p.updated_at
+                FROM risk_scores r JOIN patients p ON p.patient_id = r.patient_id
+                WHERE {condition}
+                ORDER BY r.probability DESC LIMIT ? OFFSET ?""",
+            (*parameters, page_size, page * page_size),
+        ).fetchall()
+    finally:
+        connection.close()
+    return rows, total
+
+# Ids of all patients of the worklist sorted by the risk (for the bulk export of the reports)
+def get_worklist_patient_ids(only_high_risk=False, db_path=database_path):
+    ensure_schema('risk_scores', risk_scores_schema, db_path)
+    condition, parameters = ("probability > ?", (high_risk_threshold,)) if only_high_risk else ("1", ())
+
+    connection = connect(db_path)
+    try:
+        rows = connection.execute(f"SELECT patient_id FROM risk_scores WHERE {condition} ORDER BY probability DESC", parameters).fetchall()
+    finally:
+        connection.close()
+    return [patient_id for patient_id, in rows]